@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import json
+import random
+import argparse
+from collections import OrderedDict
+import torch
+import torch.autograd as autograd
+import numpy as np
+from main import batchify_with_label
+from model.seqmodel import SeqModel
+from model.charcnn import CharCNN
+from model.charbilstm import CharBiLSTM
+from model.charbigru import CharBiGRU
+from utils.data import Data
+from utils.functions import read_instance, load_pretrain_emb
+from utils.metric import get_ner_fmeasure
+from benchmark.synthetic import generate_dataset
+
+
+## arguments which change the measured work, results are only comparable with equal settings
+SETTINGS = ["sentences", "vocab", "word_emb_dim", "trans_emb_dim", "tag_scheme", "batch_size", "batches", "nbest",
+            "repeat", "threads", "seed"]
+
+
+def time_component(function, repeat, items, warmup=1):
+    """
+        run function warmup + repeat times
+        output: median/min seconds of one run, items processed per run and items per second (on the median)
+    """
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeat):
+        start_time = time.time()
+        function()
+        times.append(time.time() - start_time)
+    times.sort()
+    median = times[len(times) // 2]
+    return OrderedDict([("median", median), ("min", times[0]), ("repeat", repeat), ("items", items),
+                        ("items_per_second", items / median if median > 0 else -1)])
+
+
+def inference(function):
+    """
+        run function without autograd bookkeeping if torch.no_grad exists (inputs are volatile otherwise)
+    """
+    if not hasattr(torch, "no_grad"):
+        return function
+
+    def wrapped():
+        with torch.no_grad():
+            return function()
+    return wrapped
+
+
+def build_data(paths, args):
+    data = Data()
+    for name, path in paths.items():
+        setattr(data, name, path)
+    data.word_emb_dim = args.word_emb_dim
+    data.trans_emb_dim = args.trans_emb_dim
+    data.char_seq_feature = "LSTM"
+    data.HP_batch_size = args.batch_size
+    data.HP_gpu = False
+    data.build_alphabet(data.train_dir)
+    data.build_translation_alphabet(data.trans_dir)
+    data.fix_alphabet()
+    data.build_translation_dict(data.trans_dir)
+    data.generate_instance('train')
+    data.build_pretrain_emb()
+    return data
+
+
+def benchmark_components(data, paths, args):
+    results = OrderedDict()
+    train_num = len(data.train_Ids)
+    results["read_instance"] = time_component(
+        lambda: read_instance(paths["train_dir"], data.word_alphabet, data.char_alphabet, data.feature_alphabets,
+                              data.label_alphabet, data.number_normalized, data.MAX_SENTENCE_LENGTH,
+                              data.translation_id_format), args.repeat, train_num)
+    results["build_translation_dict"] = time_component(lambda: data.build_translation_dict(paths["trans_dir"]),
+                                                       args.repeat, data.word_alphabet.size())
+    results["load_pretrain_emb"] = time_component(lambda: load_pretrain_emb(paths["word_emb_dir"]), args.repeat,
+                                                  data.word_alphabet.size())
+
+    batches = [data.train_Ids[start:start + args.batch_size] for start in range(0, train_num, args.batch_size)]
+    batches = batches[:args.batches]
+    results["batchify_with_label"] = time_component(
+        lambda: [batchify_with_label(batch, data.HP_gpu, True) for batch in batches], args.repeat, len(batches))
+    batched = [batchify_with_label(batch, data.HP_gpu, True) for batch in batches]
+
+    model = SeqModel(data)
+    model.eval()
+    wordrep = model.word_hidden.wordrep
+
+    def wordrep_forward():
+        for word, features, wordlen, _, char, charlen, charrecover, _, trans, trans_lengths, trans_recover, _ in batched:
+            wordrep(word, features, wordlen, char, charlen, charrecover, trans, trans_lengths, trans_recover)
+    results["WordRep.forward"] = time_component(inference(wordrep_forward), args.repeat, len(batched))
+
+    char_encoders = [("CharCNN", CharCNN(data.char_alphabet.size(), data.char_emb_dim, data.HP_char_hidden_dim,
+                                         data.HP_dropout, data.HP_gpu)),
+                     ("CharBiLSTM", CharBiLSTM(data.char_alphabet.size(), data.char_emb_dim,
+                                               data.HP_char_hidden_dim, data.HP_dropout, None, data.HP_gpu)),
+                     ("CharBiGRU", CharBiGRU(data.char_alphabet.size(), data.char_emb_dim, data.HP_char_hidden_dim,
+                                             data.HP_dropout, data.HP_gpu))]
+    char_inputs = [(item[4], item[5].cpu().numpy()) for item in batched]
+    for name, encoder in char_encoders:
+        encoder.eval()
+        results[name + ".get_last_hiddens"] = time_component(
+            inference(lambda: [encoder.get_last_hiddens(char, charlen) for char, charlen in char_inputs]),
+            args.repeat, len(batched))
+
+    crf = model.crf
+    tag_size = crf.tagset_size + 2
+    crf_inputs = []
+    for item in batched:
+        mask = item[-1]
+        feats = autograd.Variable(torch.randn(mask.size(0), mask.size(1), tag_size), volatile=True)
+        if data.HP_gpu:
+            feats = feats.cuda()
+        crf_inputs.append((feats, mask))
+    results["CRF._calculate_PZ"] = time_component(
+        inference(lambda: [crf._calculate_PZ(feats, mask) for feats, mask in crf_inputs]), args.repeat,
+        len(batched))
+    results["CRF._viterbi_decode"] = time_component(
+        inference(lambda: [crf._viterbi_decode(feats, mask) for feats, mask in crf_inputs]), args.repeat,
+        len(batched))
+    results["CRF._viterbi_decode_nbest"] = time_component(
+        inference(lambda: [crf._viterbi_decode_nbest(feats, mask, args.nbest) for feats, mask in crf_inputs]),
+        args.repeat, len(batched))
+
+    ## predictions: gold labels with 10% of the tokens replaced by a random label
+    rng = random.Random(args.seed)
+    gold_labels = [text[-1] for text in data.train_texts]
+    label_list = data.label_alphabet.instances
+    pred_labels = [[rng.choice(label_list) if rng.random() < 0.1 else label for label in labels]
+                   for labels in gold_labels]
+    results["get_ner_fmeasure"] = time_component(lambda: get_ner_fmeasure(gold_labels, pred_labels, data.tagScheme),
+                                                 args.repeat, len(gold_labels))
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+        print current vs baseline median time of every component
+        output: names of the components slower than baseline * (1 + tolerance)
+    """
+    regressions = []
+    print("%-32s %12s %12s %8s" % ("component", "baseline(s)", "current(s)", "ratio"))
+    for name, result in results.items():
+        if name not in baseline:
+            print("%-32s %12s %12.5f %8s" % (name, "-", result["median"], "new"))
+            continue
+        ratio = result["median"] / max(baseline[name]["median"], 1e-9)
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "REGRESSION"
+            regressions.append(name)
+        print("%-32s %12.5f %12.5f %8.2f %s" % (name, baseline[name]["median"], result["median"], ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Component microbenchmarks on a synthetic corpus')
+    parser.add_argument('--data_dir', default="./data/synthetic", help='Directory of the generated dataset')
+    parser.add_argument('--sentences', type=int, default=2000)
+    parser.add_argument('--vocab', type=int, default=5000)
+    parser.add_argument('--word_emb_dim', type=int, default=50)
+    parser.add_argument('--trans_emb_dim', type=int, default=50)
+    parser.add_argument('--tag_scheme', choices=['BIO', 'BMES'], default='BIO')
+    parser.add_argument('--batch_size', type=int, default=10)
+    parser.add_argument('--batches', type=int, default=50, help='Batches timed for the tensor components')
+    parser.add_argument('--nbest', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads, 0: torch default')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default="./benchmark_result.json", help='JSON result file')
+    parser.add_argument('--baseline', default=None, help='JSON result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown ratio against baseline')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    paths = generate_dataset(args.data_dir, args.sentences, args.vocab, args.word_emb_dim, args.trans_emb_dim,
+                             args.tag_scheme, args.seed)
+    data = build_data(paths, args)
+    results = benchmark_components(data, paths, args)
+    report = OrderedDict([("environment", OrderedDict([("python", sys.version.split()[0]),
+                                                       ("torch", torch.__version__),
+                                                       ("numpy", np.__version__),
+                                                       ("threads", torch.get_num_threads())])),
+                          ("settings", OrderedDict([(name, getattr(args, name)) for name in SETTINGS])),
+                          ("results", results)])
+    with open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    print("Benchmark results have been written into file. %s" % (args.output))
+    if args.baseline:
+        with open(args.baseline, 'r') as fin:
+            baseline = json.load(fin)
+        if baseline["settings"] != json.loads(json.dumps(report["settings"])):
+            print("WARNING: baseline was measured with different settings, ratios are not comparable")
+        regressions = compare_with_baseline(results, baseline["results"], args.tolerance)
+        if regressions:
+            print("Regression in: %s" % (", ".join(regressions)))
+            exit(1)
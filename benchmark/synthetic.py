@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import argparse
+
+ENTITY_TYPES = ["PER", "LOC", "ORG", "MISC"]
+POS_TAGS = ["N", "V", "Adj", "Adv", "Art", "Prep", "Pron", "Conj", "Num", "Punc"]
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def random_word(rng, min_len=2, max_len=12):
+    return "".join(rng.choice(LETTERS) for _ in range(rng.randint(min_len, max_len)))
+
+
+def build_vocabulary(rng, size):
+    """
+        distinct random lowercase words, the list order is the frequency rank
+    """
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = random_word(rng)
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def skewed_choice(rng, words, skew=3):
+    """
+        pick a word with a long-tailed rank distribution (power of a uniform sample), frequent words come first
+    """
+    rank = int(len(words) * rng.random() ** skew)
+    return words[min(rank, len(words) - 1)]
+
+
+def entity_labels(entity_type, length, tag_scheme):
+    if tag_scheme == "BMES":
+        if length == 1:
+            return ["S-" + entity_type]
+        return ["B-" + entity_type] + ["M-" + entity_type] * (length - 2) + ["E-" + entity_type]
+    return ["B-" + entity_type] + ["I-" + entity_type] * (length - 1)
+
+
+def generate_sentence(rng, words, tag_scheme, min_len, max_len, entity_rate, digit_rate):
+    """
+        output: list of (word, pos, label), entities are capitalized words of 1-3 tokens
+    """
+    sent_len = rng.randint(min_len, max_len)
+    tokens = []
+    while len(tokens) < sent_len:
+        if rng.random() < entity_rate:
+            length = min(rng.randint(1, 3), sent_len - len(tokens))
+            labels = entity_labels(rng.choice(ENTITY_TYPES), length, tag_scheme)
+            for label in labels:
+                tokens.append((skewed_choice(rng, words).capitalize(), "N", label))
+        elif rng.random() < digit_rate:
+            tokens.append((str(rng.randint(0, 10000)), "Num", "O"))
+        else:
+            tokens.append((skewed_choice(rng, words), rng.choice(POS_TAGS), "O"))
+    return tokens
+
+
+def write_corpus(path, words, sent_num, seed=42, tag_scheme="BIO", min_len=3, max_len=40, entity_rate=0.1,
+                 digit_rate=0.02, doc_size=30):
+    """
+        CoNLL-2002 style file: "word pos label" per line, blank line after each sentence and a -DOCSTART-
+        sentence every doc_size sentences. output: number of tokens written
+    """
+    rng = random.Random(seed)
+    token_num = 0
+    with open(path, 'w') as fout:
+        for idx in range(sent_num):
+            if doc_size > 0 and idx % doc_size == 0:
+                fout.write("-DOCSTART- -DOCSTART- O\n\n")
+            for word, pos, label in generate_sentence(rng, words, tag_scheme, min_len, max_len, entity_rate,
+                                                      digit_rate):
+                fout.write("%s %s %s\n" % (word, pos, label))
+                token_num += 1
+            fout.write("\n")
+    return token_num
+
+
+def write_translation_dict(path, words, target_words, seed=42, coverage=0.6, max_trans=4):
+    """
+        "word: translation translation ..." per line for a `coverage` share of words (and their capitalized form)
+    """
+    rng = random.Random(seed)
+    with open(path, 'w') as fout:
+        for word in words:
+            if rng.random() >= coverage:
+                continue
+            translations = " ".join(rng.choice(target_words) for _ in range(rng.randint(1, max_trans)))
+            fout.write("%s: %s\n" % (word, translations))
+            fout.write("%s: %s\n" % (word.capitalize(), translations))
+
+
+def write_embedding(path, words, dim, seed=42, coverage=0.8):
+    """
+        text embedding file "word v1 v2 ..." without header, as read by load_pretrain_emb
+    """
+    rng = random.Random(seed)
+    with open(path, 'w') as fout:
+        for word in words:
+            if rng.random() >= coverage:
+                continue
+            fout.write(word + " " + " ".join("%.5f" % (rng.uniform(-1, 1)) for _ in range(dim)) + "\n")
+
+
+def generate_dataset(out_dir, sent_num=2000, vocab_size=5000, word_emb_dim=50, trans_emb_dim=50, tag_scheme="BIO",
+                     seed=42):
+    """
+        write train/dev/test corpora, a translation dictionary and word/translation embeddings into out_dir.
+        dev and test have sent_num // 4 sentences each.
+        output: dict of the written file paths, in the names of the config items
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    rng = random.Random(seed)
+    words = build_vocabulary(rng, vocab_size)
+    target_words = build_vocabulary(rng, vocab_size // 2)
+    paths = {"train_dir": os.path.join(out_dir, "synthetic.train"),
+             "dev_dir": os.path.join(out_dir, "synthetic.dev"),
+             "test_dir": os.path.join(out_dir, "synthetic.test"),
+             "trans_dir": os.path.join(out_dir, "synthetic.trans.txt"),
+             "word_emb_dir": os.path.join(out_dir, "synthetic.word.vec"),
+             "trans_embed_dir": os.path.join(out_dir, "synthetic.trans.vec")}
+    write_corpus(paths["train_dir"], words, sent_num, seed, tag_scheme)
+    write_corpus(paths["dev_dir"], words, sent_num // 4, seed + 1, tag_scheme)
+    write_corpus(paths["test_dir"], words, sent_num // 4, seed + 2, tag_scheme)
+    write_translation_dict(paths["trans_dir"], words, target_words, seed)
+    write_embedding(paths["word_emb_dir"], words, word_emb_dim, seed)
+    write_embedding(paths["trans_embed_dir"], target_words, trans_emb_dim, seed + 1)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic CoNLL-2002 style NER dataset')
+    parser.add_argument('--out_dir', default="./data/synthetic", help='Output directory')
+    parser.add_argument('--sentences', type=int, default=2000, help='Training sentences')
+    parser.add_argument('--vocab', type=int, default=5000, help='Vocabulary size')
+    parser.add_argument('--word_emb_dim', type=int, default=50)
+    parser.add_argument('--trans_emb_dim', type=int, default=50)
+    parser.add_argument('--tag_scheme', choices=['BIO', 'BMES'], default='BIO')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    paths = generate_dataset(args.out_dir, args.sentences, args.vocab, args.word_emb_dim, args.trans_emb_dim,
+                             args.tag_scheme, args.seed)
+    for name in sorted(paths):
+        print("%s=%s" % (name, paths[name]))
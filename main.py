@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import os
 import time
 import sys
 import argparse
@@ -7,14 +8,30 @@ import random
 import copy
 import torch
 import gc
+import json
+import multiprocessing
+import functools
+import Queue
 import cPickle as pickle
+from collections import OrderedDict
 import torch.autograd as autograd
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 import numpy as np
-from utils.metric import get_ner_fmeasure
+from utils.metric import get_ner_fmeasure, metric_from_alphabet
 from model.seqmodel import SeqModel
+from model.initialization import skip_init
+from model.scripted import ScriptTagger, build_script_inputs
+from utils.distributed import init_distributed, broadcast_model, broadcast_flag, average_gradients, shard_instances
+from utils.eval_schedule import EvalScheduler
+from utils.telemetry import telemetry
+from utils.memory import memory
+from utils.padding import padding
+from utils.window import split_windows, stitch_windows, stitch_scores, sum_scores
+from utils.batch_cache import BatchCache
+from utils.optimizer import CombinedOptimizer, split_sparse_parameters, build_sparse_optimizer, densify_embeddings
+from utils.checkpoint import CheckpointSaver, build_checkpoint, load_checkpoint, set_rng_states, snapshot_state_dict
 from utils.data import Data
 
 seed_num = 42
@@ -40,33 +57,31 @@ def predict_check(pred_variable, gold_variable, mask_variable):
     return right_token, total_token
 
 
+def label_array(label_alphabet, extra_num=2):
+    """
+        labels indexed by tag id as a numpy object array, id 0 (padding) is None. the extra ids (CRF START/STOP)
+        map to the first label like Alphabet.get_instance does for unknown ids.
+    """
+    return np.array([None] + label_alphabet.instances + label_alphabet.instances[:1] * extra_num, dtype=object)
+
+
 def recover_label(pred_variable, gold_variable, mask_variable, label_alphabet, word_recover):
     """
         input:
             pred_variable (batch_size, sent_len): pred tag result
-            gold_variable (batch_size, sent_len): gold result variable
+            gold_variable (batch_size, sent_len): gold result variable, None to recover the predictions only
             mask_variable (batch_size, sent_len): mask variable
+        output:
+            pred_label, gold_label: [batch_size, each_seq_len], gold_label is None without gold_variable
     """
-
-    pred_variable = pred_variable[word_recover]
-    gold_variable = gold_variable[word_recover]
-    mask_variable = mask_variable[word_recover]
-    batch_size = gold_variable.size(0)
-    seq_len = gold_variable.size(1)
-    mask = mask_variable.cpu().data.numpy()
-    pred_tag = pred_variable.cpu().data.numpy()
-    gold_tag = gold_variable.cpu().data.numpy()
-    batch_size = mask.shape[0]
-    pred_label = []
-    gold_label = []
-    for idx in range(batch_size):
-        pred = [label_alphabet.get_instance(pred_tag[idx][idy]) for idy in range(seq_len) if mask[idx][idy] != 0]
-        gold = [label_alphabet.get_instance(gold_tag[idx][idy]) for idy in range(seq_len) if mask[idx][idy] != 0]
-        # print "p:",pred, pred_tag.tolist()
-        # print "g:", gold, gold_tag.tolist()
-        assert (len(pred) == len(gold))
-        pred_label.append(pred)
-        gold_label.append(gold)
+    labels = label_array(label_alphabet)
+    lengths = mask_variable[word_recover].cpu().data.numpy().sum(1)
+    pred_tag = labels[pred_variable[word_recover].cpu().data.numpy()]
+    pred_label = [pred_tag[idx, :lengths[idx]].tolist() for idx in range(len(lengths))]
+    gold_label = None
+    if gold_variable is not None:
+        gold_tag = labels[gold_variable[word_recover].cpu().data.numpy()]
+        gold_label = [gold_tag[idx, :lengths[idx]].tolist() for idx in range(len(lengths))]
     return pred_label, gold_label
 
 
@@ -79,26 +94,11 @@ def recover_nbest_label(pred_variable, mask_variable, label_alphabet, word_recov
         output:
             nbest_pred_label list: [batch_size, nbest, each_seq_len]
     """
-    # print "word recover:", word_recover.size()
-    # exit(0)
-    pred_variable = pred_variable[word_recover]
-    mask_variable = mask_variable[word_recover]
-    batch_size = pred_variable.size(0)
-    seq_len = pred_variable.size(1)
-    # print pred_variable.size()
-    nbest = pred_variable.size(2)
-    mask = mask_variable.cpu().data.numpy()
-    pred_tag = pred_variable.cpu().data.numpy()
-    batch_size = mask.shape[0]
-    pred_label = []
-    for idx in range(batch_size):
-        pred = []
-        for idz in range(nbest):
-            each_pred = [label_alphabet.get_instance(pred_tag[idx][idy][idz]) for idy in range(seq_len) if
-                         mask[idx][idy] != 0]
-            pred.append(each_pred)
-        pred_label.append(pred)
-    return pred_label
+    labels = label_array(label_alphabet)
+    lengths = mask_variable[word_recover].cpu().data.numpy().sum(1)
+    ## (batch_size, nbest, sent_len)
+    pred_tag = labels[pred_variable[word_recover].cpu().data.numpy()].transpose(0, 2, 1)
+    return [pred_tag[idx, :, :lengths[idx]].tolist() for idx in range(len(lengths))]
 
 
 def lr_decay(optimizer, epoch, decay_rate, init_lr):
@@ -109,8 +109,45 @@ def lr_decay(optimizer, epoch, decay_rate, init_lr):
     return optimizer
 
 
-def evaluate(data, model, name, nbest=None):
-    if name == "train":
+def window_instances(data, instances):
+    """
+        with data.window_long_sentences, split the sentences longer than MAX_SENTENCE_LENGTH - 1 words into
+        overlapping windows of that length (see split_windows)
+        output: windows, spans (None if nothing is split)
+    """
+    if not data.window_long_sentences:
+        return instances, None
+    return split_windows(instances, data.MAX_SENTENCE_LENGTH - 1, data.window_context)
+
+
+## batch caches of evaluated instance lists, id of the list: (list, BatchCache). the list is kept alive, so its id
+## is not reused by another list
+_eval_caches = {}
+
+
+def eval_batch_cache(data, sentences, instances):
+    """
+        with data.batch_cache: the fixed length-sorted batches of instances (sentences or their windows), collated
+        at the first evaluation of the sentences list and reused by the next ones. None without data.batch_cache
+    """
+    if not data.batch_cache:
+        return None
+    key = id(sentences)
+    if key not in _eval_caches or len(_eval_caches[key][0]) != len(sentences):
+        _eval_caches[key] = (sentences, BatchCache(instances, data.HP_batch_size, 1, True, data.batch_cache_dir,
+                                                   "eval%s.%s" % (len(_eval_caches), os.getpid())))
+    return _eval_caches[key][1]
+
+
+def evaluate(data, model, name, nbest=None, instances=None):
+    """
+        instances: evaluate these instances (e.g. a dev subsample) instead of the whole set of name
+        long sentences are evaluated as windows (data.window_long_sentences), their predictions are stitched
+        before the metric, so the results are per sentence in either case
+    """
+    if instances is not None:
+        pass
+    elif name == "train":
         instances = data.train_Ids
     elif name == "dev":
         instances = data.dev_Ids
@@ -125,23 +162,30 @@ def evaluate(data, model, name, nbest=None):
     nbest_pred_results = []
     pred_scores = []
     pred_results = []
-    gold_results = []
+    metric = metric_from_alphabet(data.label_alphabet, data.tagScheme)
+    sentences = instances
+    instances, spans = window_instances(data, sentences)
     ## set model in eval model
     model.eval()
     batch_size = data.HP_batch_size
     start_time = time.time()
-    train_num = len(instances)
-    total_batch = train_num // batch_size + 1
-    for batch_id in range(total_batch):
-        start = batch_id * batch_size
-        end = (batch_id + 1) * batch_size
-        if end > train_num:
-            end = train_num
-        instance = instances[start:end]
-        if not instance:
-            continue
-        batch_word, batch_features, batch_wordlen, batch_wordrecover, batch_char, batch_charlen, batch_charrecover, batch_label, batch_trans, trans_seq_lengths, trans_seq_recover, mask = batchify_with_label(
-            instance, data.HP_gpu, True)
+    cache = eval_batch_cache(data, sentences, instances)
+    if cache is not None:
+        batches = cache.batches()
+    else:
+        batches = [instances[start:start + batch_size] for start in range(0, len(instances), batch_size)]
+    positions = []
+    for batch in batches:
+        telemetry.batch_begin()
+        with telemetry.stage("collate"):
+            if cache is not None:
+                batch_tensors = cache.collate(batch, data.HP_gpu)
+                positions.append(cache.positions(batch))
+            else:
+                batch_tensors = batchify_with_label(batch, data.HP_gpu, True)
+        batch_word, batch_features, batch_wordlen, batch_wordrecover, batch_char, batch_charlen, batch_charrecover, batch_label, batch_trans, trans_seq_lengths, trans_seq_recover, mask = batch_tensors
+        memory.batch_begin(batch_word, batch_char, batch_trans, batch_features, batch_wordlen, batch_label, mask)
+        padding.update(name, batch_word, batch_wordlen, batch_char, batch_charlen, batch_trans, trans_seq_lengths)
         if nbest:
             scores, nbest_tag_seq = model.decode_nbest(batch_word, batch_features, batch_wordlen, batch_char,
                                                        batch_charlen, batch_charrecover, mask, nbest, batch_trans,
@@ -155,17 +199,126 @@ def evaluate(data, model, name, nbest=None):
             tag_seq = model(batch_word, batch_features, batch_wordlen, batch_char, batch_charlen, batch_charrecover,
                             mask, batch_trans, trans_seq_lengths, trans_seq_recover)
         # print "tag:",tag_seq
-        pred_label, gold_label = recover_label(tag_seq, batch_label, mask, data.label_alphabet, batch_wordrecover)
+        ## metrics are counted on tag ids, the sentence order does not matter
+        if spans is None:
+            with telemetry.stage("metric"):
+                metric.update_batch(batch_label.cpu().data.numpy(), tag_seq.cpu().data.numpy(),
+                                    mask.cpu().data.numpy().sum(1))
+        with telemetry.stage("recover_label"):
+            pred_label, _ = recover_label(tag_seq, None, mask, data.label_alphabet, batch_wordrecover)
         pred_results += pred_label
-        gold_results += gold_label
+        telemetry.batch_end()
+        memory.batch_end()
+    if positions:
+        ## cached batches are in length order, back to the order of instances
+        order = np.argsort(np.concatenate(positions))
+        pred_results = [pred_results[idx] for idx in order]
+        if nbest:
+            nbest_pred_results = [nbest_pred_results[idx] for idx in order]
+            pred_scores = [pred_scores[idx] for idx in order]
+    if spans is not None:
+        pred_results = stitch_windows(pred_results, spans)
+        if nbest:
+            nbest_pred_results = stitch_windows(nbest_pred_results, spans, nbest=True)
+            pred_scores = stitch_scores(pred_scores, spans)
+        with telemetry.stage("metric"):
+            for sentence, pred_label in zip(sentences, pred_results):
+                metric.update(sentence[-1], metric.label_ids(pred_label))
     decode_time = time.time() - start_time
-    speed = len(instances) / decode_time
-    acc, p, r, f = get_ner_fmeasure(gold_results, pred_results, data.tagScheme)
+    speed = len(sentences) / decode_time
+    with telemetry.stage("metric"):
+        acc, p, r, f = metric.result()
+    telemetry.add("evaluate", decode_time)
     if nbest:
         return speed, acc, p, r, f, nbest_pred_results, pred_scores
     return speed, acc, p, r, f, pred_results, pred_scores
 
 
+def decode_instances(data, model, instances, nbest=None):
+    """
+        tag instances without gold labels, in batches of data.HP_batch_size, keeping the input order
+        output:
+            pred_results: [sent_num, each_sent_length], or [sent_num, nbest, each_sent_length] with nbest
+            pred_scores: [sent_num, nbest] with nbest, else [sent_num] 1-best scores (SeqModel.decode_scored)
+    """
+    model.eval()
+    batch_size = data.HP_batch_size
+    pred_results = []
+    pred_scores = []
+    instances, spans = window_instances(data, instances)
+    for start in range(0, len(instances), batch_size):
+        instance = instances[start:start + batch_size]
+        telemetry.batch_begin()
+        with telemetry.stage("collate"):
+            batch_word, batch_features, batch_wordlen, batch_wordrecover, batch_char, batch_charlen, batch_charrecover, batch_label, batch_trans, trans_seq_lengths, trans_seq_recover, mask = batchify_with_label(
+                instance, data.HP_gpu, True)
+        memory.batch_begin(batch_word, batch_char, batch_trans, batch_features, batch_wordlen, batch_label, mask)
+        padding.update("decode", batch_word, batch_wordlen, batch_char, batch_charlen, batch_trans, trans_seq_lengths)
+        if nbest:
+            scores, nbest_tag_seq = model.decode_nbest(batch_word, batch_features, batch_wordlen, batch_char,
+                                                       batch_charlen, batch_charrecover, mask, nbest, batch_trans,
+                                                       trans_seq_lengths, trans_seq_recover)
+            pred_results += recover_nbest_label(nbest_tag_seq, mask, data.label_alphabet, batch_wordrecover)
+            pred_scores += scores[batch_wordrecover].cpu().data.numpy().tolist()
+        else:
+            scores, tag_seq = model.decode_scored(batch_word, batch_features, batch_wordlen, batch_char,
+                                                  batch_charlen, batch_charrecover, mask, batch_trans,
+                                                  trans_seq_lengths, trans_seq_recover)
+            pred_label, _ = recover_label(tag_seq, None, mask, data.label_alphabet, batch_wordrecover)
+            pred_results += pred_label
+            pred_scores += scores[batch_wordrecover].cpu().data.numpy().tolist()
+        telemetry.batch_end()
+        memory.batch_end()
+    if spans is not None:
+        pred_results = stitch_windows(pred_results, spans, nbest=bool(nbest))
+        if nbest:
+            pred_scores = stitch_scores(pred_scores, spans)
+        else:
+            pred_scores = sum_scores(pred_scores, spans)
+    return pred_results, pred_scores
+
+
+def report_bf16_delta(data, model, name, bf16_acc, bf16_f, fp32_scores=None):
+    """
+        re-evaluate the same set with the float32 encoder and print the accuracy/f delta of bf16 autocast.
+        fp32_scores: (acc, f) already evaluated elsewhere (background evaluation), model is not used then
+    """
+    if fp32_scores is None:
+        fp32_scores = fp32_evaluate(data, model, name)
+    acc, f = fp32_scores
+    if data.seg:
+        print("%s bf16 vs fp32: acc: %.4f/%.4f (delta %.4f), f: %.4f/%.4f (delta %.4f)" % (
+            name, bf16_acc, acc, bf16_acc - acc, bf16_f, f, bf16_f - f))
+    else:
+        print("%s bf16 vs fp32: acc: %.4f/%.4f (delta %.4f)" % (name, bf16_acc, acc, bf16_acc - acc))
+    return acc, f
+
+
+def fp32_evaluate(data, model, name):
+    model.bf16 = False
+    speed, acc, p, r, f, _, _ = evaluate(data, model, name)
+    model.bf16 = True
+    return acc, f
+
+
+def pack_word_rows(rows, volatile_flag=False):
+    """
+        input: id lists of the real words (chars or translations), in the order of the sorted sentences
+        output:
+            row_tensor: (row_num, max_row_len) Variable, zero padded, sorted by length (descending)
+            row_lengths: (row_num,) LongTensor, sorted
+            row_recover: (row_num,) LongTensor, recover the word order of the rows
+    """
+    lengths = np.array(map(len, rows), dtype=np.int64)
+    max_len = lengths.max()
+    row_array = np.zeros((len(rows), max_len), dtype=np.int64)
+    row_array[np.arange(max_len) < lengths[:, None]] = np.concatenate(rows)
+    perm = np.argsort(-lengths, kind='mergesort')
+    recover = np.argsort(perm)
+    row_tensor = autograd.Variable(torch.from_numpy(row_array[perm]), volatile=volatile_flag)
+    return row_tensor, torch.from_numpy(lengths[perm]), torch.from_numpy(recover)
+
+
 def batchify_with_label(input_batch_list, gpu, volatile_flag=False):
     """
         input: list of words, chars and labels, various length. [[words,chars, labels],[words,chars,labels],...]
@@ -175,9 +328,10 @@ def batchify_with_label(input_batch_list, gpu, volatile_flag=False):
             zero padding for word and char, with their batch length
             word_seq_tensor: (batch_size, max_sent_len) Variable
             word_seq_lengths: (batch_size,1) Tensor
-            char_seq_tensor: (batch_size*max_sent_len, max_word_len) Variable
-            char_seq_lengths: (batch_size*max_sent_len,1) Tensor
-            char_seq_recover: (batch_size*max_sent_len,1)  recover char sequence order 
+            char_seq_tensor: (word_num, max_word_len) Variable, one row for each real word (see pack_word_rows)
+            char_seq_lengths: (word_num,) Tensor
+            char_seq_recover: (word_num,)  recover char sequence order 
+            trans_seq_tensor, trans_seq_lengths, trans_seq_recover: the same for the translations
             label_seq_tensor: (batch_size, max_sent_len)
             mask: (batch_size, max_sent_len) 
     """
@@ -231,60 +385,13 @@ def batchify_with_label(input_batch_list, gpu, volatile_flag=False):
     # print "label_seq_tensor:{}".format(label_seq_tensor)
     # print "mask:{}".format(mask)
 
-    ### deal with char
-    # pad_chars (batch_size, max_seq_len)
-    pad_chars = [chars[idx] + [[0]] * (max_seq_len - len(chars[idx])) for idx in range(len(chars))]
-    # print "pad_chars:{}".format(pad_chars)
-    length_list = [map(len, pad_char) for pad_char in pad_chars]
-    # print "length_list:{}".format(length_list)
-    max_word_len = max(map(max, length_list))
-    # print "max_word_len:{}".format(max_word_len)
-    char_seq_tensor = autograd.Variable(torch.zeros((batch_size, max_seq_len, max_word_len)),
-                                        volatile=volatile_flag).long()
-    char_seq_lengths = torch.LongTensor(length_list)
-    # print "char_seq_lengths:{}".format(char_seq_lengths)
-    for idx, (seq, seqlen) in enumerate(zip(pad_chars, char_seq_lengths)):
-        for idy, (word, wordlen) in enumerate(zip(seq, seqlen)):
-            # print len(word), wordlen
-            char_seq_tensor[idx, idy, :wordlen] = torch.LongTensor(word)
-
-    # print "char_seq_tensor:{}".format(char_seq_tensor)
-    char_seq_tensor = char_seq_tensor[word_perm_idx].view(batch_size * max_seq_len, -1)
-    # print "char_seq_tensor after reorder：{}".format(char_seq_tensor)
-    char_seq_lengths = char_seq_lengths[word_perm_idx].view(batch_size * max_seq_len, )
-    # print "char_seq_lengths after reorder：{}".format(char_seq_lengths)
-    char_seq_lengths, char_perm_idx = char_seq_lengths.sort(0, descending=True)
-    # print "char_seq_lengths:{}".format(char_seq_lengths)
-    # print "char_perm_idx:{}".format(char_perm_idx)
-    char_seq_tensor = char_seq_tensor[char_perm_idx]
-    # print "char_seq_tensor:{}".format(char_seq_tensor)
-    _, char_seq_recover = char_perm_idx.sort(0, descending=False)
-    # print "char_seq_recover:{}".format(char_seq_recover)
+    ### deal with char and trans, only the real words get a row, in the order of the sorted sentences
+    word_order = word_perm_idx.tolist()
+    char_seq_tensor, char_seq_lengths, char_seq_recover = pack_word_rows(
+        [word for idx in word_order for word in chars[idx]], volatile_flag)
+    trans_seq_tensor, trans_seq_lengths, trans_seq_recover = pack_word_rows(
+        [tran for idx in word_order for tran in trans[idx]], volatile_flag)
     _, word_seq_recover = word_perm_idx.sort(0, descending=False)
-    # print "word_seq_recover:{}".format(word_seq_recover)
-
-    ### deal with trans
-    pad_trans = [trans[idx] + [[0]] * (max_seq_len - len(trans[idx])) for idx in range(len(trans))]
-    # print "pad_trans:{}".format(pad_trans)
-    trans_length_list = [map(len, pdd_tran) for pdd_tran in pad_trans]
-    # print "trans_length_list:{}".format(trans_length_list)
-    max_tran_len = max(map(max, trans_length_list))
-    # print "max_tran_len:{}".format(max_tran_len)
-    trans_seq_tensor = autograd.Variable(torch.zeros((batch_size, max_seq_len, max_tran_len)),
-                                         volatile=volatile_flag).long()
-    trans_seq_lengths = torch.LongTensor(trans_length_list)
-    for idx, (seq, seqlen) in enumerate(zip(pad_trans, trans_seq_lengths)):
-        for idy, (tran, tranlen) in enumerate(zip(seq, seqlen)):
-            trans_seq_tensor[idx, idy, :tranlen] = torch.LongTensor(tran)
-
-    # print "trans_seq_tensor:{}".format(trans_seq_tensor)
-    trans_seq_tensor = trans_seq_tensor[word_perm_idx].view(batch_size * max_seq_len, -1)
-    # print "trans_seq_tensor:{}".format(trans_seq_tensor)
-    trans_seq_lengths = trans_seq_lengths[word_perm_idx].view(batch_size * max_seq_len, )
-    # print "trans_seq_lengths:{}".format(trans_seq_lengths)
-    trans_seq_lengths, trans_perm_idx = trans_seq_lengths.sort(0, descending=True)
-    trans_seq_tensor = trans_seq_tensor[trans_perm_idx]
-    _, trans_seq_recover = trans_perm_idx.sort(0, descending=False)
 
     if gpu:
         word_seq_tensor = word_seq_tensor.cuda()
@@ -304,144 +411,629 @@ def batchify_with_label(input_batch_list, gpu, volatile_flag=False):
            trans_seq_tensor, trans_seq_lengths, trans_seq_recover, mask
 
 
-def train(data):
-    print "Training model..."
-    data.show_data_summary()
-    save_data_name = data.model_dir + ".dset"
-    data.save(save_data_name)
-    model = SeqModel(data)
-    if data.HP_gpu:
-        model.cuda()
-
-    if data.optimizer.lower() == "sgd":
-        optimizer = optim.SGD(model.parameters(), lr=data.HP_lr, momentum=data.HP_momentum, weight_decay=data.HP_l2)
-    elif data.optimizer.lower() == "adagrad":
-        optimizer = optim.Adagrad(model.parameters(), lr=data.HP_lr, weight_decay=data.HP_l2)
-    elif data.optimizer.lower() == "adadelta":
-        optimizer = optim.Adadelta(model.parameters(), lr=data.HP_lr, weight_decay=data.HP_l2)
-    elif data.optimizer.lower() == "rmsprop":
-        optimizer = optim.RMSprop(model.parameters(), lr=data.HP_lr, weight_decay=data.HP_l2)
-    elif data.optimizer.lower() == "adam":
-        optimizer = optim.Adam(model.parameters(), lr=data.HP_lr, weight_decay=data.HP_l2)
+def build_optimizer(data, model):
+    """
+        optimizer: all trainable parameters, frozen embedding tables are left out. with sparse_embedding the
+        embedding tables get a row-sparse optimizer, stepped together with the dense one.
+        optimizer_wc: the projection w of the word embedding to the translation space
+    """
+    name = data.optimizer.lower()
+    params, sparse_params = split_sparse_parameters(model)
+    sparse_optimizer = None
+    if sparse_params:
+        sparse_optimizer = build_sparse_optimizer(name, sparse_params, data.HP_lr)
+        if sparse_optimizer is None:
+            print("Optimizer %s has no sparse version, embedding gradients stay dense" % (data.optimizer))
+            densify_embeddings(model)
+            params, sparse_params = split_sparse_parameters(model)
+    if name == "sgd":
+        optimizer = optim.SGD(params, lr=data.HP_lr, momentum=data.HP_momentum, weight_decay=data.HP_l2)
+    elif name == "adagrad":
+        optimizer = optim.Adagrad(params, lr=data.HP_lr, weight_decay=data.HP_l2)
+    elif name == "adadelta":
+        optimizer = optim.Adadelta(params, lr=data.HP_lr, weight_decay=data.HP_l2)
+    elif name == "rmsprop":
+        optimizer = optim.RMSprop(params, lr=data.HP_lr, weight_decay=data.HP_l2)
+    elif name == "adam":
+        optimizer = optim.Adam(params, lr=data.HP_lr, weight_decay=data.HP_l2)
     else:
         print("Optimizer illegal: %s" % (data.optimizer))
         exit(0)
+    if sparse_optimizer is not None:
+        optimizer = CombinedOptimizer([optimizer, sparse_optimizer])
 
     optimizer_wc = optim.SGD(model.word_hidden.wordrep.w.parameters(), lr=data.HP_lr, momentum=data.HP_momentum,
                              weight_decay=data.HP_l2)
+    return optimizer, optimizer_wc
 
-    best_dev = -10
-    ## start training
-    for idx in range(data.HP_iteration):
-        epoch_start = time.time()
-        temp_start = epoch_start
-        print("Epoch: %s/%s" % (idx, data.HP_iteration))
-        if data.optimizer == "SGD":
-            optimizer = lr_decay(optimizer, idx, data.HP_lr_decay, data.HP_lr)
-            optimizer_wc = lr_decay(optimizer_wc, idx, data.HP_lr_decay, data.HP_lr)
 
-        instance_count = 0
-        sample_id = 0
-        sample_loss = 0
-        total_loss = 0
-        right_token = 0
-        whole_token = 0
-        random.shuffle(data.train_Ids)
-        ## set model in train model
-        model.train()
-        model.zero_grad()
-        batch_size = data.HP_batch_size
-        batch_id = 0
-        train_num = len(data.train_Ids)
-        total_batch = train_num // batch_size + 1
-        for batch_id in range(total_batch):
-            start = batch_id * batch_size
-            end = (batch_id + 1) * batch_size
-            if end > train_num:
-                end = train_num
-            instance = data.train_Ids[start:end]
-            if not instance:
-                continue
-            batch_word, batch_features, batch_wordlen, batch_wordrecover, batch_char, batch_charlen, batch_charrecover, batch_label, batch_trans, trans_seq_lengths, trans_seq_recover, mask = batchify_with_label(
-                instance, data.HP_gpu)
-            instance_count += 1
+def train_epoch(data, model, optimizer, optimizer_wc, train_Ids, world_size=1, batch_hook=None, batch_cache=None):
+    """
+        one pass over train_Ids with both optimizer steps on each batch
+        world_size: gradients are averaged across the ranks if larger than 1
+        batch_hook: called after every batch, the epoch stops early if it returns True
+        batch_cache: BatchCache of the training instances, its buckets are used in a shuffled batch order instead
+                     of collating consecutive slices of train_Ids
+        output: total loss, right token number, whole token number
+    """
+    temp_start = time.time()
+    sample_loss = 0
+    total_loss = 0
+    right_token = 0
+    whole_token = 0
+    ## set model in train model
+    model.train()
+    model.zero_grad()
+    batch_size = data.HP_batch_size
+    if batch_cache is not None:
+        batches = batch_cache.batches(shuffle=True, regroup=data.batch_cache_regroup)
+    else:
+        batches = [train_Ids[start:start + batch_size] for start in range(0, len(train_Ids), batch_size)]
+    end = 0
+    for batch in batches:
+        telemetry.batch_begin()
+        with telemetry.stage("collate"):
+            if batch_cache is not None:
+                batch_tensors = batch_cache.collate(batch, data.HP_gpu)
+            else:
+                batch_tensors = batchify_with_label(batch, data.HP_gpu)
+        batch_word, batch_features, batch_wordlen, batch_wordrecover, batch_char, batch_charlen, batch_charrecover, batch_label, batch_trans, trans_seq_lengths, trans_seq_recover, mask = batch_tensors
+        end += batch_word.size(0)
+        memory.batch_begin(batch_word, batch_char, batch_trans, batch_features, batch_wordlen, batch_label, mask)
+        padding.update("train", batch_word, batch_wordlen, batch_char, batch_charlen, batch_trans, trans_seq_lengths)
+        with telemetry.stage("forward"):
             loss, tag_seq, wc_loss = model.neg_log_likelihood_loss(batch_word, batch_features, batch_wordlen,
                                                                    batch_char,
                                                                    batch_charlen, batch_charrecover, batch_label, mask,
                                                                    batch_trans, trans_seq_lengths, trans_seq_recover)
-            right, whole = predict_check(tag_seq, batch_label, mask)
-            right_token += right
-            whole_token += whole
-            sample_loss += loss.data[0]
-            total_loss += loss.data[0]
-            if end % 500 == 0:
-                temp_time = time.time()
-                temp_cost = temp_time - temp_start
-                temp_start = temp_time
-                print("     Instance: %s; Time: %.2fs; loss: %.4f; acc: %s/%s=%.4f" % (
-                    end, temp_cost, sample_loss, right_token, whole_token, (right_token + 0.) / whole_token))
-                sys.stdout.flush()
-                sample_loss = 0
-            for param in model.word_hidden.wordrep.w.parameters():
-                param.requires_grad = False
+        right, whole = predict_check(tag_seq, batch_label, mask)
+        right_token += right
+        whole_token += whole
+        sample_loss += loss.data[0]
+        total_loss += loss.data[0]
+        if end % 500 == 0:
+            temp_time = time.time()
+            temp_cost = temp_time - temp_start
+            temp_start = temp_time
+            print("     Instance: %s; Time: %.2fs; loss: %.4f; acc: %s/%s=%.4f" % (
+                end, temp_cost, sample_loss, right_token, whole_token, (right_token + 0.) / whole_token))
+            sys.stdout.flush()
+            sample_loss = 0
+        for param in model.word_hidden.wordrep.w.parameters():
+            param.requires_grad = False
+        with telemetry.stage("backward"):
             loss.backward(retain_graph=True)
+        if world_size > 1:
+            with telemetry.stage("all_reduce"):
+                average_gradients(model.parameters(), world_size)
+        with telemetry.stage("optimizer_step"):
             optimizer.step()
-            model.zero_grad()
-            for param in model.word_hidden.wordrep.w.parameters():
-                param.requires_grad = True
+        model.zero_grad()
+        for param in model.word_hidden.wordrep.w.parameters():
+            param.requires_grad = True
+        with telemetry.stage("backward_wc"):
             wc_loss.backward()
+        if world_size > 1:
+            with telemetry.stage("all_reduce"):
+                average_gradients(model.word_hidden.wordrep.w.parameters(), world_size)
+        with telemetry.stage("optimizer_wc_step"):
             optimizer_wc.step()
-            model.zero_grad()
-        temp_time = time.time()
-        temp_cost = temp_time - temp_start
-        print("     Instance: %s; Time: %.2fs; loss: %.4f; acc: %s/%s=%.4f" % (
-            end, temp_cost, sample_loss, right_token, whole_token, (right_token + 0.) / whole_token))
-        epoch_finish = time.time()
-        epoch_cost = epoch_finish - epoch_start
-        print("Epoch: %s training finished. Time: %.2fs, speed: %.2fst/s,  total loss: %s" % (
-            idx, epoch_cost, train_num / epoch_cost, total_loss))
-        # continue
-        speed, acc, p, r, f, _, _ = evaluate(data, model, "dev")
-        dev_finish = time.time()
-        dev_cost = dev_finish - epoch_finish
+        model.zero_grad()
+        telemetry.batch_end()
+        memory.batch_end()
+        if batch_hook is not None and batch_hook():
+            break
+    temp_time = time.time()
+    temp_cost = temp_time - temp_start
+    print("     Instance: %s; Time: %.2fs; loss: %.4f; acc: %s/%s=%.4f" % (
+        end, temp_cost, sample_loss, right_token, whole_token, (right_token + 0.) / max(whole_token, 1)))
+    return total_loss, right_token, whole_token
+
+
+def hogwild_worker(data, model, worker_id, epoch_queue, result_queue):
+    """
+        asynchronous training process, the model parameters are in shared memory and updated without locks.
+        for every epoch id received from epoch_queue, train one epoch on the slice of this worker with its own
+        optimizer/optimizer_wc and report (worker_id, total loss, right token, whole token, instance number).
+    """
+    torch.set_num_threads(data.hogwild_threads)
+    random.seed(seed_num + worker_id)
+    torch.manual_seed(seed_num + worker_id)
+    np.random.seed(seed_num + worker_id)
+    optimizer, optimizer_wc = build_optimizer(data, model)
+    while True:
+        idx = epoch_queue.get()
+        if idx is None:
+            break
+        if data.optimizer == "SGD":
+            optimizer = lr_decay(optimizer, idx, data.HP_lr_decay, data.HP_lr)
+            optimizer_wc = lr_decay(optimizer_wc, idx, data.HP_lr_decay, data.HP_lr)
+        train_Ids = shard_instances(data.train_Ids, idx, seed_num, worker_id, data.hogwild_workers)
+        total_loss, right_token, whole_token = train_epoch(data, model, optimizer, optimizer_wc, train_Ids)
+        telemetry.summary("hogwild worker %s, epoch %s" % (worker_id, idx), epoch=idx, worker=worker_id)
+        memory.summary("hogwild worker %s, epoch %s" % (worker_id, idx), epoch=idx, worker=worker_id)
+        padding.summary("hogwild worker %s, epoch %s" % (worker_id, idx), epoch=idx, worker=worker_id)
+        result_queue.put((worker_id, total_loss, right_token, whole_token, len(train_Ids)))
 
+
+def start_hogwild_workers(data, model):
+    if data.hogwild_threads <= 0:
+        data.hogwild_threads = max(1, multiprocessing.cpu_count() // data.hogwild_workers)
+    print("Hogwild training with %s processes, %s threads each" % (data.hogwild_workers, data.hogwild_threads))
+    model.share_memory()
+    result_queue = multiprocessing.Queue()
+    epoch_queues = []
+    processes = []
+    for worker_id in range(data.hogwild_workers):
+        epoch_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=hogwild_worker,
+                                          args=(data, model, worker_id, epoch_queue, result_queue))
+        process.start()
+        epoch_queues.append(epoch_queue)
+        processes.append(process)
+    return processes, epoch_queues, result_queue
+
+
+def hogwild_epoch(idx, epoch_queues, result_queue):
+    """
+        let every worker train epoch idx and wait for all of them
+        output: total loss, right token number, whole token number, instance number over all workers
+    """
+    for epoch_queue in epoch_queues:
+        epoch_queue.put(idx)
+    total_loss, right_token, whole_token, train_num = 0, 0, 0, 0
+    for _ in epoch_queues:
+        worker_id, worker_loss, worker_right, worker_whole, worker_num = result_queue.get()
+        total_loss += worker_loss
+        right_token += worker_right
+        whole_token += worker_whole
+        train_num += worker_num
+    return total_loss, right_token, whole_token, train_num
+
+
+def stop_hogwild_workers(processes, epoch_queues):
+    for epoch_queue in epoch_queues:
+        epoch_queue.put(None)
+    for process in processes:
+        process.join()
+
+
+def report_dev(data, scheduler, saver, epoch, sampled, sent_num, dev_cost, speed, acc, p, r, f, snapshot):
+    """
+        print and log a dev result, update the scheduler and on improvement save the weights returned by snapshot()
+        output: True if test should be evaluated on the same weights
+    """
+    scheduler.record("dev", sent_num, dev_cost)
+    dev_name = "Dev sample(%s)" % (sent_num) if sampled else "Dev"
+    if data.seg:
+        current_score = f
+        print("%s: time: %.2fs, speed: %.2fst/s; acc: %.4f, p: %.4f, r: %.4f, f: %.4f" % (
+            dev_name, dev_cost, speed, acc, p, r, f))
+    else:
+        current_score = acc
+        print("%s: time: %.2fs speed: %.2fst/s; acc: %.4f" % (dev_name, dev_cost, speed, acc))
+    telemetry.event("evaluate", name="dev", epoch=epoch, sampled=sampled, sentences=sent_num,
+                    time=dev_cost, speed=speed, acc=acc, p=p, r=r, f=f)
+
+    previous_best = scheduler.best_sample_dev if sampled else scheduler.best_dev
+    improved = scheduler.update(epoch, current_score)
+    if sampled:
+        ## not comparable with full dev scores: neither saved nor ranked among the best models
+        if improved:
+            print("Exceed previous best dev sample score: %s" % (previous_best))
+        return not scheduler.test_on_improve
+    if improved:
         if data.seg:
-            current_score = f
-            print("Dev: time: %.2fs, speed: %.2fst/s; acc: %.4f, p: %.4f, r: %.4f, f: %.4f" % (
-                dev_cost, speed, acc, p, r, f))
+            print "Exceed previous best f score:", previous_best
         else:
-            current_score = acc
-            print("Dev: time: %.2fs speed: %.2fst/s; acc: %.4f" % (dev_cost, speed, acc))
+            print "Exceed previous best acc score:", previous_best
+        model_name = data.model_dir + '.' + str(epoch) + ".model"
+        print "Save current best model in file:", model_name
+        saver.save_model(snapshot(), model_name, current_score)
+    elif scheduler.patience > 0:
+        print("No improvement for %s/%s dev evaluations" % (scheduler.bad_evaluations, scheduler.patience))
+    return scheduler.test_due(improved)
 
-        if current_score > best_dev:
-            if data.seg:
-                print "Exceed previous best f score:", best_dev
-            else:
-                print "Exceed previous best acc score:", best_dev
-            model_name = data.model_dir + '.' + str(idx) + ".model"
-            print "Save current best model in file:", model_name
-            torch.save(model.state_dict(), model_name)
-            best_dev = current_score
-            # ## decode test
+
+def report_test(data, scheduler, epoch, test_cost, speed, acc, p, r, f):
+    scheduler.record("test", len(data.test_Ids), test_cost)
+    scheduler.test_score(epoch, f if data.seg else acc)
+    telemetry.event("evaluate", name="test", epoch=epoch, sentences=len(data.test_Ids), time=test_cost,
+                    speed=speed, acc=acc, p=p, r=r, f=f)
+    if data.seg:
+        print("Test: time: %.2fs, speed: %.2fst/s; acc: %.4f, p: %.4f, r: %.4f, f: %.4f" % (
+            test_cost, speed, acc, p, r, f))
+    else:
+        print("Test: time: %.2fs, speed: %.2fst/s; acc: %.4f" % (test_cost, speed, acc))
+
+
+def scheduled_evaluate(data, model, scheduler, saver, epoch, evaluator=None):
+    """
+        evaluate dev (or its subsample) and, if the scheduler asks for it, test. save the model on dev improvement
+        with a BackgroundEvaluator the current weights are only submitted to it, the results are handled by its poll()
+    """
+    scheduler.evaluated()
+    if evaluator is not None:
+        evaluator.submit(model, scheduler, epoch)
+        return
+    dev_start = time.time()
+    dev_instances = scheduler.dev_set(epoch)
+    sampled = scheduler.sampled(epoch)
+    speed, acc, p, r, f, _, _ = evaluate(data, model, "dev", instances=dev_instances)
+    dev_finish = time.time()
+    dev_acc, dev_f = acc, f
+    if report_dev(data, scheduler, saver, epoch, sampled, len(dev_instances), dev_finish - dev_start, speed, acc, p,
+                  r, f, lambda: snapshot_state_dict(model)):
         speed, acc, p, r, f, _, _ = evaluate(data, model, "test")
-        test_finish = time.time()
-        test_cost = test_finish - dev_finish
-        if data.seg:
-            print("Test: time: %.2fs, speed: %.2fst/s; acc: %.4f, p: %.4f, r: %.4f, f: %.4f" % (
-                test_cost, speed, acc, p, r, f))
+        report_test(data, scheduler, epoch, time.time() - dev_finish, speed, acc, p, r, f)
+    if model.bf16 and not sampled and scheduler.improved:
+        ## only for the saved best models, a float32 pass over dev costs as much as the bf16 one
+        report_bf16_delta(data, model, "dev", dev_acc, dev_f)
+    if scheduler.stopped:
+        print("Early stop: no dev improvement in %s evaluations" % (scheduler.patience))
+
+
+def eval_worker(data, sample_instances, threads, job_queue, result_queue):
+    """
+        process of BackgroundEvaluator: load every submitted state dict into its own model and evaluate dev (the
+        whole set or sample_instances), test, or dev with the float32 encoder ("fp32") on it. the trackers are off,
+        stage times and reports cover training.
+    """
+    torch.set_num_threads(threads)
+    telemetry.enabled = False
+    telemetry.profile = None
+    memory.enabled = False
+    padding.enabled = False
+    with skip_init():
+        model = SeqModel(data)
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        job_id, name, epoch, sampled, state_dict = job
+        model.load_state_dict(state_dict)
+        start_time = time.time()
+        if name == "fp32":
+            fp32_scores = fp32_evaluate(data, model, "dev")
+            result_queue.put((job_id, name, epoch, time.time() - start_time, None, None, None, None, None,
+                              fp32_scores))
+            continue
+        instances = sample_instances if name == "dev" and sampled else None
+        speed, acc, p, r, f, _, _ = evaluate(data, model, name, instances=instances)
+        cost = time.time() - start_time
+        result_queue.put((job_id, name, epoch, cost, speed, acc, p, r, f, None))
+
+
+class BackgroundEvaluator(object):
+    """
+        dev/test evaluation of weight snapshots in a separate process (data.async_eval), training goes on meanwhile.
+        results are handled when they arrive (poll), in submission order for dev. the scores of a snapshot are those
+        scheduled_evaluate would report for it, but everything that depends on them happens later than in
+        synchronous mode: the scheduler update, best model saving (of the snapshot) and the test evaluation run when
+        the result arrives, usually one or more epochs after the submission. early stopping takes effect at the
+        first epoch end after the stopping result arrives, so training may run more epochs than synchronously;
+        dev results of snapshots submitted after it are dropped.
+    """
+
+    def __init__(self, data, sample_instances):
+        threads = data.async_eval_threads
+        if threads <= 0:
+            threads = max(1, multiprocessing.cpu_count() // 2)
+        print("Evaluate dev/test in a background process with %s threads" % (threads))
+        self.data = data
+        self.job_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        self.pending = {}  ## job id: (epoch, sampled, dev sentence number, state dict) of the submitted dev jobs
+        self.bf16_scores = {}  ## job id: bf16 dev (acc, f) of the fp32 jobs
+        self.running = 0
+        self.job_count = 0
+        self.process = multiprocessing.Process(target=eval_worker, args=(data, sample_instances, threads,
+                                                                         self.job_queue, self.result_queue))
+        self.process.start()
+
+    def submit(self, model, scheduler, epoch):
+        sampled = scheduler.sampled(epoch)
+        state_dict = snapshot_state_dict(model)
+        self.job_count += 1
+        self.pending[self.job_count] = (epoch, sampled, len(scheduler.dev_set(epoch)), state_dict)
+        self.job_queue.put((self.job_count, "dev", epoch, sampled, state_dict))
+        self.running += 1
+
+    def poll(self, scheduler, saver, block=False):
+        """
+            handle the results which have arrived, with block=True wait until every submitted job is done
+        """
+        while self.running > 0:
+            try:
+                result = self.result_queue.get(block)
+            except Queue.Empty:
+                break
+            self.running -= 1
+            self.handle(result, scheduler, saver)
+
+    def handle(self, result, scheduler, saver):
+        job_id, name, epoch, cost, speed, acc, p, r, f, fp32_scores = result
+        if name == "test":
+            report_test(self.data, scheduler, epoch, cost, speed, acc, p, r, f)
+            return
+        if name == "fp32":
+            bf16_acc, bf16_f = self.bf16_scores.pop(job_id)
+            report_bf16_delta(self.data, None, "dev", bf16_acc, bf16_f, fp32_scores)
+            return
+        epoch, sampled, sent_num, state_dict = self.pending.pop(job_id)
+        if scheduler.stopped:
+            ## synchronous training would have stopped before this evaluation
+            return
+        if report_dev(self.data, scheduler, saver, epoch, sampled, sent_num, cost, speed, acc, p, r, f,
+                      lambda: state_dict):
+            self.job_queue.put((job_id, "test", epoch, sampled, state_dict))
+            self.running += 1
+        if self.data.HP_bf16 and not sampled and scheduler.improved:
+            self.bf16_scores[job_id] = (acc, f)
+            self.job_queue.put((job_id, "fp32", epoch, sampled, state_dict))
+            self.running += 1
+        if scheduler.stopped:
+            print("Early stop: no dev improvement in %s evaluations" % (scheduler.patience))
+
+    def close(self, scheduler, saver):
+        self.poll(scheduler, saver, block=True)
+        self.job_queue.put(None)
+        self.process.join()
+
+
+def batch_evaluate(data, model, scheduler, saver, epoch, evaluator=None):
+    """
+        batch_hook of train_epoch: evaluate every scheduler.every_batches batches, return True to stop training
+    """
+    if evaluator is not None:
+        evaluator.poll(scheduler, saver)
+    if not scheduler.batch_due():
+        return scheduler.stopped
+    scheduled_evaluate(data, model, scheduler, saver, epoch, evaluator)
+    model.train()
+    return scheduler.stopped
+
+
+def train(data, rank=0):
+    """
+        rank: process rank in distributed training (data.world_size > 1), only rank 0 evaluates and saves
+        with data.hogwild_workers > 1 this process only coordinates: evaluation and model saving
+        with data.resume_dir set, training continues after the epoch stored in that checkpoint. hogwild workers keep
+        their optimizers to themselves, so a resumed hogwild run starts them (Adam/momentum state, rng) afresh
+        output (rank 0): best dev score and its epoch, test score of that model (None if not evaluated),
+        training and evaluation speed in sentences per second
+    """
+    distributed = data.world_size > 1
+    hogwild = data.hogwild_workers > 1
+    if distributed and hogwild:
+        print "Distributed training (world_size) and hogwild training (hogwild_workers) can not be combined. Exit..."
+        exit(0)
+    if distributed and data.sparse_embedding:
+        print "Sparse embedding gradients can not be all-reduced, distributed training uses dense gradients."
+        data.sparse_embedding = False
+    if distributed:
+        init_distributed(data, rank)
+    telemetry.configure(data)
+    memory.configure(data)
+    padding.configure(data)
+    print "Training model..."
+    if rank == 0:
+        data.show_data_summary()
+        save_data_name = data.model_dir + ".dset"
+        data.save(save_data_name)
+        memory.data_report(data, save_data_name)
+    if data.resume_dir:
+        with skip_init():
+            model = SeqModel(data)
+    else:
+        model = SeqModel(data)
+    if data.window_long_sentences:
+        ## long sentences are trained on as their overlapping windows
+        data.train_Ids = window_instances(data, data.train_Ids)[0]
+    train_cache = None
+    if data.batch_cache and (distributed or hogwild):
+        print("The training shards change every epoch in distributed/hogwild training, training batches are not cached")
+    elif data.batch_cache:
+        train_cache = BatchCache(data.train_Ids, data.HP_batch_size, data.batch_cache_bucket, False,
+                                 data.batch_cache_dir, "train.%s" % (os.getpid()))
+    ## instances are shuffled in place, checkpoints keep their order as indexes into the generated order
+    train_instances = list(data.train_Ids)
+    instance_index = dict((id(instance), position) for position, instance in enumerate(train_instances))
+    checkpoint = None
+    if data.resume_dir:
+        print "Resume training from checkpoint:", data.resume_dir
+        checkpoint = load_checkpoint(data.resume_dir)
+        model.load_state_dict(checkpoint["model"])
+        data.train_Ids[:] = [train_instances[position] for position in checkpoint["train_order"]]
+    if data.HP_gpu:
+        model.cuda()
+    if distributed:
+        broadcast_model(model)
+        ## deterministic but different dropout masks on each rank
+        random.seed(seed_num + rank)
+        torch.manual_seed(seed_num + rank)
+        np.random.seed(seed_num + rank)
+
+    if hogwild:
+        processes, epoch_queues, result_queue = start_hogwild_workers(data, model)
+    else:
+        optimizer, optimizer_wc = build_optimizer(data, model)
+
+    scheduler = EvalScheduler(data, seed_num)
+    if (distributed or hogwild) and scheduler.every_batches > 0:
+        print("Evaluation every %s batches is only supported in single process training, evaluate per epoch" % (
+            scheduler.every_batches))
+        scheduler.every_batches = 0
+    start_epoch = 0
+    best_models = []
+    if checkpoint is not None:
+        if not hogwild and checkpoint["optimizer"] is not None:
+            optimizer.load_state_dict(checkpoint["optimizer"])
+            optimizer_wc.load_state_dict(checkpoint["optimizer_wc"])
+        ## distributed ranks keep their own dropout seeds
+        if not distributed:
+            set_rng_states(checkpoint["rng"])
+        if checkpoint.get("eval_schedule") is not None:
+            scheduler.load_state_dict(checkpoint["eval_schedule"])
         else:
-            print("Test: time: %.2fs, speed: %.2fst/s; acc: %.4f" % (test_cost, speed, acc))
+            scheduler.best_dev = checkpoint["best_dev"]
+        best_models = checkpoint["best_models"]
+        start_epoch = checkpoint["epoch"] + 1
+        print("Resume at epoch: %s, best dev: %s" % (start_epoch, scheduler.best_dev))
+        if hogwild:
+            print("Hogwild checkpoints have no optimizer states: the workers restart their optimizers, "
+                  "the resumed run is not identical to an uninterrupted one")
+    evaluator = None
+    train_sentences = 0
+    train_time = 0.
+    if rank == 0:
+        saver = CheckpointSaver(data.checkpoint_keep, best_models)
+        if data.async_eval and data.HP_gpu:
+            print("Background evaluation can not use cuda in a forked process, evaluate in the training process")
+        elif data.async_eval:
+            evaluator = BackgroundEvaluator(data, scheduler.sample_instances)
+    ## start training
+    for idx in range(start_epoch, data.HP_iteration):
+        epoch_start = time.time()
+        print("Epoch: %s/%s" % (idx, data.HP_iteration))
+        if hogwild:
+            total_loss, right_token, whole_token, train_num = hogwild_epoch(idx, epoch_queues, result_queue)
+            ## the same shuffle as the workers, to keep their instance order for checkpoints
+            shard_instances(data.train_Ids, idx, seed_num, 0, data.hogwild_workers)
+        else:
+            if data.optimizer == "SGD":
+                optimizer = lr_decay(optimizer, idx, data.HP_lr_decay, data.HP_lr)
+                optimizer_wc = lr_decay(optimizer_wc, idx, data.HP_lr_decay, data.HP_lr)
+            if distributed:
+                train_Ids = shard_instances(data.train_Ids, idx, seed_num, rank, data.world_size)
+            else:
+                random.shuffle(data.train_Ids)
+                train_Ids = data.train_Ids
+            train_num = len(train_Ids)
+            batch_hook = None
+            if scheduler.every_batches > 0:
+                batch_hook = functools.partial(batch_evaluate, data, model, scheduler, saver, idx, evaluator)
+            total_loss, right_token, whole_token = train_epoch(data, model, optimizer, optimizer_wc, train_Ids,
+                                                               data.world_size, batch_hook, train_cache)
+        epoch_finish = time.time()
+        epoch_cost = epoch_finish - epoch_start
+        train_sentences += train_num
+        train_time += epoch_cost
+        print("Epoch: %s training finished. Time: %.2fs, speed: %.2fst/s,  total loss: %s" % (
+            idx, epoch_cost, train_num / epoch_cost, total_loss))
+        if rank == 0:
+            if distributed:
+                print("Epoch: %s all %s ranks speed: %.2fst/s" % (idx, data.world_size,
+                                                                  train_num * data.world_size / epoch_cost))
+            if not scheduler.stopped and scheduler.epoch_due(idx):
+                scheduled_evaluate(data, model, scheduler, saver, idx, evaluator)
+            if evaluator is not None:
+                evaluator.poll(scheduler, saver)
+            train_order = [instance_index[id(instance)] for instance in data.train_Ids]
+            if hogwild:
+                ## the optimizers live in the worker processes
+                optimizers = (None, None)
+            else:
+                optimizers = (optimizer, optimizer_wc)
+            saver.save_checkpoint(build_checkpoint(model, optimizers[0], optimizers[1], idx, scheduler.best_dev,
+                                                   saver.best_models, train_order, data.HP_gpu,
+                                                   scheduler.state_dict()), data.model_dir + ".ckpt")
+        title = "epoch %s, rank %s" % (idx, rank) if distributed else "epoch %s" % (idx)
+        telemetry.summary(title, time.time() - epoch_start, epoch=idx, rank=rank, train_time=epoch_cost,
+                          train_num=train_num, loss=total_loss, speed=train_num / epoch_cost)
+        memory.summary(title, epoch=idx, rank=rank)
+        padding.summary(title, epoch=idx, rank=rank)
+        if distributed:
+            scheduler.stopped = broadcast_flag(scheduler.stopped)
+        if scheduler.stopped:
+            break
         gc.collect()
+    if hogwild:
+        stop_hogwild_workers(processes, epoch_queues)
+    telemetry.stop_profiler()
+    if rank == 0:
+        if evaluator is not None:
+            evaluator.close(scheduler, saver)
+        saver.close()
+        scheduler.report()
+        return OrderedDict([("best_dev", scheduler.best_dev), ("best_epoch", scheduler.best_epoch),
+                            ("test", scheduler.best_test),
+                            ("train_speed", train_sentences / train_time if train_time > 0 else 0.),
+                            ("eval_speed", scheduler.evaluated_sentences / scheduler.eval_time
+                             if scheduler.eval_time > 0 else 0.)])
 
 
-def load_model_decode(data, name):
+def prepare_train_data(data):
+    """
+        alphabets, translation dictionary, train/dev/test instances and pretrained embeddings for training
+    """
+    # data.initial_feature_alphabets()
+    data.build_alphabet(data.train_dir)
+    # data.build_alphabet(data.dev_dir)
+    # data.build_alphabet(data.test_dir)
+    data.build_translation_alphabet(data.trans_dir)
+    data.fix_alphabet()
+    data.build_translation_dict(data.trans_dir)
+
+    data.generate_instance('train')
+    data.generate_instance('dev')
+    data.generate_instance('test')
+    data.build_pretrain_emb()
+
+
+def distributed_train(data):
+    """
+        run train() in data.world_size local processes on the gloo backend, the preprocessed data is
+        inherited by every process
+    """
+    processes = []
+    for rank in range(data.world_size):
+        process = multiprocessing.Process(target=train, args=(data, rank))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+
+
+def quantize_model(model):
+    """
+        dynamic int8 quantization for CPU decoding: weights of the word/char/trans LSTM/GRU and all nn.Linear
+        layers (hidden2tag, WordRep.w, word2cnn) are stored in int8, activations are quantized on the fly.
+        embeddings, conv layers and the CRF stay in float32. Returns a quantized copy, the input model is kept.
+    """
+    if not hasattr(torch, "quantization") or not hasattr(torch.quantization, "quantize_dynamic"):
+        print "Dynamic quantization is not supported by this PyTorch version, decode with float model."
+        return model
+    model.eval()
+    quantized = torch.quantization.quantize_dynamic(model, {nn.LSTM, nn.GRU, nn.Linear}, dtype=torch.qint8)
+    quantized.bf16 = False
+    return quantized
+
+
+def load_model(data):
     print "Load Model from file: ", data.model_dir
-    model = SeqModel(data)
+    ## parameters are overwritten by the state dict, skip their random/pretrained init
+    with skip_init():
+        model = SeqModel(data)
     # load model need consider if the model trained in GPU and load in CPU, or vice versa
     if data.HP_gpu:
         model.load_state_dict(torch.load(data.load_model_dir, map_location='gpu'))
     else:
         model.load_state_dict(torch.load(data.load_model_dir, map_location='cpu'))
+    return model
+
+
+def load_model_decode(data, name):
+    model = load_model(data)
+
+    float_result = None
+    if data.quantize:
+        if data.HP_gpu:
+            print "Dynamic int8 quantization only runs on CPU, decode with float model."
+        else:
+            print("Decode %s data with float model for comparison ..." % (name))
+            float_result = evaluate(data, model, name, data.nbest)[:5]
+            model = quantize_model(model)
 
     print("Decode %s data, nbest: %s ..." % (name, data.nbest))
     start_time = time.time()
@@ -453,18 +1045,150 @@ def load_model_decode(data, name):
             name, time_cost, speed, acc, p, r, f))
     else:
         print("%s: time:%.2fs, speed:%.2fst/s; acc: %.4f" % (name, time_cost, speed, acc))
+    telemetry.stop_profiler()
+    telemetry.summary("decode %s" % (name), time_cost, sentences=len(pred_results), speed=speed)
+    memory.summary("decode %s" % (name))
+    padding.summary("decode %s" % (name))
+    if float_result is not None:
+        float_speed, float_acc, _, _, float_f = float_result
+        print("int8 vs float: speed: %.2f/%.2fst/s (x%.2f); acc: %.4f/%.4f (delta %.4f); f: %.4f/%.4f (delta %.4f)" % (
+            speed, float_speed, speed / float_speed, acc, float_acc, acc - float_acc, f, float_f, f - float_f))
     return pred_results, pred_scores
 
 
+## decode worker state, the Data object is inherited from the parent process by fork
+_decode_data = None
+_decode_model = None
+
+
+def init_decode_worker(threads):
+    global _decode_model
+    torch.set_num_threads(threads)
+    _decode_model = load_model(_decode_data)
+    if _decode_data.quantize and not _decode_data.HP_gpu:
+        _decode_model = quantize_model(_decode_model)
+
+
+def decode_shard(shard):
+    """
+        decode the raw instances [start, end) in a worker process
+        output: predict results, scores, sentence number, decode time of the shard
+    """
+    start, end = shard
+    shard_data = copy.copy(_decode_data)
+    shard_data.raw_Ids = _decode_data.raw_Ids[start:end]
+    start_time = time.time()
+    _, _, _, _, _, pred_results, pred_scores = evaluate(shard_data, _decode_model, 'raw', _decode_data.nbest)
+    shard_cost = time.time() - start_time
+    telemetry.summary("decode shard %s-%s" % (start, end), shard_cost, sentences=end - start)
+    memory.summary("decode shard %s-%s" % (start, end))
+    padding.summary("decode shard %s-%s" % (start, end))
+    return pred_results, pred_scores, end - start, shard_cost
+
+
+def sharded_decode(data, name):
+    """
+        split the raw instances into data.decode_workers contiguous shards, decode them in parallel processes,
+        each with its own model copy and intra-op thread budget, and merge the results in the original order
+    """
+    global _decode_data
+    workers = data.decode_workers
+    threads = data.decode_threads
+    if threads <= 0:
+        threads = max(1, multiprocessing.cpu_count() // workers)
+    instances = data.raw_Ids
+    if not instances:
+        print("Decode %s data: no sentences." % (name))
+        return [], []
+    shard_size = max(1, (len(instances) + workers - 1) // workers)
+    shards = [(start, min(start + shard_size, len(instances))) for start in range(0, len(instances), shard_size)]
+    print("Decode %s data in %s processes, %s threads each, nbest: %s ..." % (name, len(shards), threads, data.nbest))
+    _decode_data = data
+    start_time = time.time()
+    pool = multiprocessing.Pool(len(shards), initializer=init_decode_worker, initargs=(threads,))
+    shard_results = pool.map(decode_shard, shards)
+    pool.close()
+    pool.join()
+    pred_results = []
+    pred_scores = []
+    for shard_id, (shard_pred, shard_scores, shard_num, shard_cost) in enumerate(shard_results):
+        print("     Shard %s: sentences: %s, time: %.2fs, speed: %.2fst/s" % (
+            shard_id, shard_num, shard_cost, shard_num / shard_cost))
+        pred_results += shard_pred
+        pred_scores += shard_scores
+    end_time = time.time()
+    gold_results = [text[3] for text in data.raw_texts]
+    if data.nbest:
+        acc, p, r, f = get_ner_fmeasure(gold_results, [pred[0] for pred in pred_results], data.tagScheme)
+    else:
+        acc, p, r, f = get_ner_fmeasure(gold_results, pred_results, data.tagScheme)
+    ## wall time including pool startup, model loading and the merge, comparable with single process decoding.
+    ## the per shard speeds above only cover decoding
+    time_cost = end_time - start_time
+    speed = len(instances) / time_cost
+    if data.seg:
+        print("%s: time:%.2fs, speed:%.2fst/s; acc: %.4f, p: %.4f, r: %.4f, f: %.4f" % (
+            name, time_cost, speed, acc, p, r, f))
+    else:
+        print("%s: time:%.2fs, speed:%.2fst/s; acc: %.4f" % (name, time_cost, speed, acc))
+    return pred_results, pred_scores
+
+
+def export_model(data):
+    """
+        compile the trained model (word rep, encoder and viterbi) with TorchScript into data.export_dir,
+        the vocabularies needed to build the id tensors are written to data.export_dir + ".vocab.json"
+    """
+    if not hasattr(torch, "jit") or not hasattr(torch.jit, "script"):
+        print "TorchScript is not supported by this PyTorch version, export is skipped."
+        return
+    print "Load Model from file: ", data.load_model_dir
+    data.HP_gpu = False
+    with skip_init():
+        model = SeqModel(data)
+    model.load_state_dict(torch.load(data.load_model_dir, map_location='cpu'))
+    model.eval()
+    script_model = torch.jit.script(ScriptTagger(model, data).eval())
+    instances = data.dev_Ids[:data.HP_batch_size]
+    if instances:
+        ## check the compiled module against the python model on one batch
+        batch_word, batch_features, batch_wordlen, batch_wordrecover, batch_char, batch_charlen, batch_charrecover, batch_label, batch_trans, trans_seq_lengths, trans_seq_recover, mask = batchify_with_label(
+            instances, False, True)
+        tag_seq = model(batch_word, batch_features, batch_wordlen, batch_char, batch_charlen, batch_charrecover,
+                        mask, batch_trans, trans_seq_lengths, trans_seq_recover)[batch_wordrecover]
+        script_tag_seq = script_model(*build_script_inputs(instances))
+        diff_token = int((tag_seq.data.cpu() != script_tag_seq).long().sum())
+        print("Compiled model check on %s dev sentences, different tags: %s" % (len(instances), diff_token))
+        if diff_token > 0:
+            raise RuntimeError("The compiled model disagrees with the python model on %s tags, %s is not written" % (
+                diff_token, data.export_dir))
+    else:
+        print("No dev sentences, the compiled model is written without checking it against the python model.")
+    script_model.save(data.export_dir)
+    vocab = {"word": data.word_alphabet.instances,
+             "char": data.char_alphabet.instances,
+             "label": data.label_alphabet.instances,
+             "translation": data.translation_alphabet.instances,
+             "features": [alphabet.instances for alphabet in data.feature_alphabets],
+             "translation_id_format": dict((str(key), value) for key, value in data.translation_id_format.items()),
+             "number_normalized": data.number_normalized}
+    with open(data.export_dir + ".vocab.json", 'w') as fout:
+        json.dump(vocab, fout)
+    print("Compiled model has been written into file. %s" % (data.export_dir))
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Low Resource NER via Cross-lingual Knowledge-Transfer')
     # parser.add_argument('--status', choices=['train', 'decode'], help='update algorithm', default='train')
     parser.add_argument('--config', default="./demo.train.config", help='Configuration File')
+    parser.add_argument('--resume', default=None, help='Checkpoint to resume training from (model_dir.ckpt)')
 
     args = parser.parse_args()
     data = Data()
     data.read_config(args.config)
+    if args.resume:
+        data.resume_dir = args.resume
     status = data.status.lower()  # train or test
     data.HP_gpu = torch.cuda.is_available()
     print "Seed num:", seed_num
@@ -472,18 +1196,7 @@ if __name__ == '__main__':
     if status == 'train':
         print("MODEL: train")
 
-        # data.initial_feature_alphabets()
-        data.build_alphabet(data.train_dir)
-        # data.build_alphabet(data.dev_dir)
-        # data.build_alphabet(data.test_dir)
-        data.build_translation_alphabet(data.trans_dir)
-        data.fix_alphabet()
-        data.build_translation_dict(data.trans_dir)
-
-        data.generate_instance('train')
-        data.generate_instance('dev')
-        data.generate_instance('test')
-        data.build_pretrain_emb()
+        prepare_train_data(data)
         # print data.word_alphabet.instance2index
         # print data.char_alphabet.instance2index
         # print data.label_alphabet.instance2index
@@ -491,7 +1204,10 @@ if __name__ == '__main__':
         # print data.train_Ids
         # exit(0)
         # print data.train_texts
-        train(data)
+        if data.world_size > 1:
+            distributed_train(data)
+        else:
+            train(data)
     elif status == 'decode':
         print("MODEL: decode")
         data.load(data.dset_dir)
@@ -499,12 +1215,24 @@ if __name__ == '__main__':
         print data.raw_dir
         # exit(0) 
         data.show_data_summary()
+        telemetry.configure(data)
+        memory.configure(data)
+        padding.configure(data)
         data.generate_instance('raw')
+        memory.data_report(data, data.dset_dir)
         print("nbest: %s" % (data.nbest))
-        decode_results, pred_scores = load_model_decode(data, 'raw')
+        if data.decode_workers > 1:
+            decode_results, pred_scores = sharded_decode(data, 'raw')
+        else:
+            decode_results, pred_scores = load_model_decode(data, 'raw')
         if data.nbest:
             data.write_nbest_decoded_results(decode_results, pred_scores, 'raw')
         else:
             data.write_decoded_results(decode_results, 'raw')
+    elif status == 'export':
+        print("MODEL: export")
+        data.load(data.dset_dir)
+        data.read_config(args.config)
+        export_model(data)
     else:
-        print "Invalid argument! Please use valid arguments! (train/test/decode)"
+        print "Invalid argument! Please use valid arguments! (train/test/decode/export)"
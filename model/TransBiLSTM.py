@@ -6,11 +6,12 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 import numpy as np
+from initialization import init_embedding
 
 
 class TransBiLSTM(nn.Module):
     def __init__(self, alphabet_size, embedding_dim, hidden_dim, dropout, pretrain_trans_embedding, gpu,
-                 bidirect_flag=True):
+                 bidirect_flag=True, sparse=False, freeze=False):
         super(TransBiLSTM, self).__init__()
         print "build translation sequence feature extractor: LSTM ..."
         self.gpu = gpu
@@ -18,13 +19,14 @@ class TransBiLSTM(nn.Module):
         if bidirect_flag:
             self.hidden_dim = hidden_dim // 2
         self.trans_drop = nn.Dropout(dropout)
-        self.trans_embeddings = nn.Embedding(alphabet_size, embedding_dim)
+        self.trans_embeddings = nn.Embedding(alphabet_size, embedding_dim, sparse=sparse)
 
-        if pretrain_trans_embedding is not None:
-            self.trans_embeddings.weight.data.copy_(torch.from_numpy(pretrain_trans_embedding))
-        else:
-            self.trans_embeddings.weight.data.copy_(
-                torch.from_numpy(self.random_embedding(alphabet_size, embedding_dim)))
+        init_embedding(self.trans_embeddings, pretrain_trans_embedding)
+        if freeze:
+            if pretrain_trans_embedding is None:
+                print "No pretrained translation embedding to freeze, the translation embedding is trained."
+            else:
+                self.trans_embeddings.weight.requires_grad = False
 
         self.trans_lstm = nn.LSTM(embedding_dim, self.hidden_dim, num_layers=1, batch_first=True,
                                   bidirectional=bidirect_flag)
@@ -33,12 +35,6 @@ class TransBiLSTM(nn.Module):
             self.trans_embeddings = self.trans_embeddings.cuda()
             self.trans_lstm = self.trans_lstm.cuda()
 
-    def random_embedding(self, vocab_size, embedding_dim):
-        pretrain_emb = np.empty([vocab_size, embedding_dim])
-        scale = np.sqrt(3.0 / embedding_dim)
-        for index in range(vocab_size):
-            pretrain_emb[index, :] = np.random.uniform(-scale, scale, [1, embedding_dim])
-        return pretrain_emb
 
     def get_last_hiddens(self, input, seq_lengths):
         batch_size = input.size(0)
@@ -6,6 +6,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 import numpy as np
+from initialization import init_embedding
 
 class CharBiGRU(nn.Module):
     def __init__(self, alphabet_size, embedding_dim, hidden_dim, dropout, gpu, bidirect_flag = True):
@@ -17,7 +18,7 @@ class CharBiGRU(nn.Module):
             self.hidden_dim = hidden_dim // 2
         self.char_drop = nn.Dropout(dropout)
         self.char_embeddings = nn.Embedding(alphabet_size, embedding_dim)
-        self.char_embeddings.weight.data.copy_(torch.from_numpy(self.random_embedding(alphabet_size, embedding_dim)))
+        init_embedding(self.char_embeddings)
         self.char_lstm = nn.GRU(embedding_dim, self.hidden_dim, num_layers=1, batch_first=True, bidirectional=bidirect_flag)
         if self.gpu:
             self.char_drop = self.char_drop.cuda()
@@ -25,12 +26,6 @@ class CharBiGRU(nn.Module):
             self.char_lstm = self.char_lstm.cuda()
 
 
-    def random_embedding(self, vocab_size, embedding_dim):
-        pretrain_emb = np.empty([vocab_size, embedding_dim])
-        scale = np.sqrt(3.0 / embedding_dim)
-        for index in range(vocab_size):
-            pretrain_emb[index,:] = np.random.uniform(-scale, scale, [1, embedding_dim])
-        return pretrain_emb
 
 
     def get_last_hiddens(self, input, seq_lengths):
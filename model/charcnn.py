@@ -5,6 +5,7 @@ import torch.autograd as autograd
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
+from initialization import init_embedding
 
 class CharCNN(nn.Module):
     def __init__(self, alphabet_size, embedding_dim, hidden_dim, dropout, gpu):
@@ -14,7 +15,7 @@ class CharCNN(nn.Module):
         self.hidden_dim = hidden_dim
         self.char_drop = nn.Dropout(dropout)
         self.char_embeddings = nn.Embedding(alphabet_size, embedding_dim)
-        self.char_embeddings.weight.data.copy_(torch.from_numpy(self.random_embedding(alphabet_size, embedding_dim)))
+        init_embedding(self.char_embeddings)
         self.char_cnn = nn.Conv1d(embedding_dim, self.hidden_dim, kernel_size=3, padding=1)
         if self.gpu:
             self.char_drop = self.char_drop.cuda()
@@ -22,12 +23,6 @@ class CharCNN(nn.Module):
             self.char_cnn = self.char_cnn.cuda()
 
 
-    def random_embedding(self, vocab_size, embedding_dim):
-        pretrain_emb = np.empty([vocab_size, embedding_dim])
-        scale = np.sqrt(3.0 / embedding_dim)
-        for index in range(vocab_size):
-            pretrain_emb[index,:] = np.random.uniform(-scale, scale, [1, embedding_dim])
-        return pretrain_emb
 
 
     def get_last_hiddens(self, input, seq_lengths):
@@ -5,6 +5,7 @@ import torch.autograd as autograd
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
+from utils.memory import memory
 START_TAG = -2
 STOP_TAG = -1
 
@@ -63,6 +64,7 @@ class CRF(nn.Module):
         ## need to consider start
         scores = feats + self.transitions.view(1,tag_size,tag_size).expand(ins_num, tag_size, tag_size)
         scores = scores.view(seq_len, batch_size, tag_size, tag_size)
+        memory.add("crf", scores)
         # build iter
         seq_iter = enumerate(scores)
         _, inivalues = seq_iter.next()  # bat_size * from_target_size * to_target_size
@@ -106,7 +108,7 @@ class CRF(nn.Module):
                 mask: (batch, seq_len)
             output:
                 decode_idx: (batch, seq_len) decoded sequence
-                path_score: (batch, 1) corresponding score for each sequence (to be implementated)
+                path_score: (batch,) score of each decoded sequence (unnormalized, log space)
         """
         batch_size = feats.size(0)
         seq_len = feats.size(1)
@@ -122,6 +124,7 @@ class CRF(nn.Module):
         ## need to consider start
         scores = feats + self.transitions.view(1,tag_size,tag_size).expand(ins_num, tag_size, tag_size)
         scores = scores.view(seq_len, batch_size, tag_size, tag_size)
+        memory.add("crf", scores)
 
         # build iter
         seq_iter = enumerate(scores)
@@ -163,7 +166,7 @@ class CRF(nn.Module):
         last_partition = torch.gather(partition_history, 1, last_position).view(batch_size,tag_size,1)
         ### calculate the score from last partition to end state (and then select the STOP_TAG from it)
         last_values = last_partition.expand(batch_size, tag_size, tag_size) + self.transitions.view(1,tag_size, tag_size).expand(batch_size, tag_size, tag_size)
-        _, last_bp = torch.max(last_values, 1)
+        last_scores, last_bp = torch.max(last_values, 1)
         pad_zero = autograd.Variable(torch.zeros(batch_size, tag_size)).long()
         if self.gpu:
             pad_zero = pad_zero.cuda()
@@ -189,7 +192,7 @@ class CRF(nn.Module):
         for idx in range(len(back_points)-2, -1, -1):
             pointer = torch.gather(back_points[idx], 1, pointer.contiguous().view(batch_size, 1))
             decode_idx[idx] = pointer.data
-        path_score = None
+        path_score = last_scores[:, STOP_TAG]
         decode_idx = decode_idx.transpose(1,0)
         return path_score, decode_idx
 
@@ -286,6 +289,7 @@ class CRF(nn.Module):
         ## need to consider start
         scores = feats + self.transitions.view(1,tag_size,tag_size).expand(ins_num, tag_size, tag_size)
         scores = scores.view(seq_len, batch_size, tag_size, tag_size)
+        memory.add("crf", scores)
 
         # build iter
         seq_iter = enumerate(scores)
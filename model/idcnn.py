@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class IDCNN(nn.Module):
+    """
+        iterated dilated CNN word sequence extractor (Strubell et al., 2017).
+        one block of kernel-3 convolutions with the given dilations is applied `iterations` times with shared
+        parameters, so the context width grows with the dilations at a fixed parameter count:
+            receptive field = 1 + 2 * iterations * sum(dilations) words.
+        padded positions are set to zero after every convolution, so sentences in a batch do not see the padding
+        of their neighbours and a sentence boundary looks like the zero padding of Conv1d.
+    """
+    __constants__ = ['iterations']
+
+    def __init__(self, input_dim, hidden_dim, dilations, iterations, dropout, gpu):
+        super(IDCNN, self).__init__()
+        print "build word sequence feature extractor: IDCNN, dilations: %s, iterations: %s ..." % (dilations,
+                                                                                                iterations)
+        self.gpu = gpu
+        self.iterations = iterations
+        self.receptive_field = 1 + 2 * iterations * sum(dilations)
+        self.word2cnn = nn.Linear(input_dim, hidden_dim)
+        self.convs = nn.ModuleList()
+        for dilation in dilations:
+            self.convs.append(nn.Conv1d(hidden_dim, hidden_dim, kernel_size=3, padding=dilation, dilation=dilation))
+        self.drop = nn.Dropout(dropout)
+        if self.gpu:
+            self.word2cnn = self.word2cnn.cuda()
+            self.convs = self.convs.cuda()
+            self.drop = self.drop.cuda()
+
+    def forward(self, word_represent, mask):
+        """
+            input:
+                word_represent: (batch_size, sent_len, input_dim)
+                mask: (batch_size, sent_len), 1 for real words
+            output:
+                (batch_size, sent_len, hidden_dim), zero at padded positions
+        """
+        mask = mask.float().unsqueeze(1)
+        cnn_feature = torch.tanh(self.word2cnn(word_represent)).transpose(2, 1).contiguous() * mask
+        for _ in range(self.iterations):
+            for conv in self.convs:
+                cnn_feature = F.relu(conv(cnn_feature)) * mask
+            cnn_feature = self.drop(cnn_feature)
+        return cnn_feature.transpose(2, 1).contiguous()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import torch
+import torch.nn as nn
+import numpy as np
+
+## module classes whose constructor initializes the parameters through reset_parameters
+INIT_CLASSES = [cls for cls in (nn.Linear, nn.Embedding, nn.modules.conv._ConvNd, nn.modules.rnn.RNNBase,
+                                 getattr(nn.modules.batchnorm, "_NormBase", None), nn.modules.batchnorm._BatchNorm)
+                if cls is not None]
+_skip = [False]
+
+
+def random_embedding(vocab_size, embedding_dim):
+    """
+        float32 uniform(-sqrt(3/dim), sqrt(3/dim)) matrix, drawn in one call: the same numbers as filling it
+        row by row from the same numpy random state
+    """
+    scale = np.sqrt(3.0 / embedding_dim)
+    return np.random.uniform(-scale, scale, [vocab_size, embedding_dim]).astype(np.float32)
+
+
+def init_embedding(embedding, pretrain_embedding=None):
+    """
+        copy pretrain_embedding, or a random_embedding if None, into the weight of an nn.Embedding.
+        inside skip_init() nothing is done, the weight is loaded from a state dict afterwards
+    """
+    if _skip[0]:
+        return
+    if pretrain_embedding is None:
+        pretrain_embedding = random_embedding(embedding.num_embeddings, embedding.embedding_dim)
+    embedding.weight.data.copy_(torch.from_numpy(pretrain_embedding))
+
+
+@contextlib.contextmanager
+def skip_init():
+    """
+        build modules with allocated but uninitialized parameters (no random init, no copy of pretrained
+        embeddings), for models whose state dict is loaded right after construction
+    """
+    resets = [(cls, cls.__dict__["reset_parameters"]) for cls in INIT_CLASSES if "reset_parameters" in cls.__dict__]
+    for cls, _ in resets:
+        cls.reset_parameters = lambda self: None
+    _skip[0] = True
+    try:
+        yield
+    finally:
+        _skip[0] = False
+        for cls, reset_parameters in resets:
+            cls.reset_parameters = reset_parameters
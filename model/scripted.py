@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import numpy as np
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+START_TAG = -2
+STOP_TAG = -1
+
+
+class RNNLastHidden(nn.Module):
+    """
+        embedding + (bi)LSTM/GRU, returns the last hidden of each row, used for char and translation encoders.
+        rows are not required to be sorted, zero length rows (padded tokens) are encoded as one padding id.
+    """
+    __constants__ = ['hidden_dim', 'bidirectional']
+
+    def __init__(self, embeddings, rnn):
+        super(RNNLastHidden, self).__init__()
+        self.embeddings = embeddings
+        self.rnn = rnn
+        self.hidden_dim = rnn.hidden_size
+        self.bidirectional = rnn.bidirectional
+
+    def forward(self, inputs, lengths):
+        """
+            input:
+                inputs: (row_num, max_len)
+                lengths: (row_num)
+            output:
+                (row_num, hidden_dim * num_directions)
+        """
+        max_len = inputs.size(1)
+        lengths = lengths.clamp(min=1)
+        embeds = self.embeddings(inputs)
+        packed = pack_padded_sequence(embeds, lengths, batch_first=True, enforce_sorted=False)
+        rnn_out, _ = self.rnn(packed)
+        rnn_out, _ = pad_packed_sequence(rnn_out, batch_first=True, total_length=max_len)
+        last_position = (lengths - 1).view(-1, 1, 1).expand(-1, 1, self.hidden_dim)
+        forward_last = torch.gather(rnn_out[:, :, :self.hidden_dim], 1, last_position).squeeze(1)
+        if self.bidirectional:
+            return torch.cat([forward_last, rnn_out[:, 0, self.hidden_dim:]], 1)
+        return forward_last
+
+
+class CNNMaxPool(nn.Module):
+    """
+        embedding + conv1d + max pooling over the padded length, the same as CharCNN.get_last_hiddens
+    """
+
+    def __init__(self, embeddings, cnn):
+        super(CNNMaxPool, self).__init__()
+        self.embeddings = embeddings
+        self.cnn = cnn
+
+    def forward(self, inputs, lengths):
+        embeds = self.embeddings(inputs).transpose(2, 1).contiguous()
+        cnn_out = self.cnn(embeds)
+        return torch.max(cnn_out, 2)[0]
+
+
+class WordRNN(nn.Module):
+    def __init__(self, rnn):
+        super(WordRNN, self).__init__()
+        self.rnn = rnn
+
+    def forward(self, word_represent, word_seq_lengths):
+        max_len = word_represent.size(1)
+        packed = pack_padded_sequence(word_represent, word_seq_lengths, batch_first=True, enforce_sorted=False)
+        rnn_out, _ = self.rnn(packed)
+        rnn_out, _ = pad_packed_sequence(rnn_out, batch_first=True, total_length=max_len)
+        return rnn_out
+
+
+class WordCNN(nn.Module):
+    def __init__(self, word2cnn, cnn_list, cnn_batchnorm_list):
+        super(WordCNN, self).__init__()
+        self.word2cnn = word2cnn
+        layers = []
+        for idx in range(len(cnn_list)):
+            layers.append(nn.Sequential(cnn_list[idx], nn.ReLU(), cnn_batchnorm_list[idx]))
+        self.cnn_layers = nn.ModuleList(layers)
+
+    def forward(self, word_represent, word_seq_lengths):
+        cnn_feature = torch.tanh(self.word2cnn(word_represent)).transpose(2, 1).contiguous()
+        for layer in self.cnn_layers:
+            cnn_feature = layer(cnn_feature)
+        return cnn_feature.transpose(2, 1).contiguous()
+
+
+class WordIDCNN(nn.Module):
+    def __init__(self, idcnn):
+        super(WordIDCNN, self).__init__()
+        self.idcnn = idcnn
+
+    def forward(self, word_represent, word_seq_lengths):
+        sent_len = word_represent.size(1)
+        mask = torch.arange(sent_len).view(1, sent_len) < word_seq_lengths.view(-1, 1)
+        return self.idcnn(word_represent, mask)
+
+
+class ScriptTagger(nn.Module):
+    """
+        inference only copy of SeqModel (word rep + word encoder + viterbi) without Python branches on Data,
+        written to be compiled by torch.jit.script. It shares the parameters of the given trained SeqModel.
+        The compiled module only needs torch to be loaded (torch.jit.load), labels are kept in `labels`.
+    """
+    __constants__ = ['use_crf', 'use_trans']
+
+    def __init__(self, seq_model, data):
+        super(ScriptTagger, self).__init__()
+        word_hidden = seq_model.word_hidden
+        wordrep = word_hidden.wordrep
+        self.use_crf = seq_model.use_crf
+        self.use_trans = wordrep.use_trans
+        self.labels = [""] + [str(label) for label in data.label_alphabet.instances]
+        self.word_embedding = wordrep.word_embedding
+        self.feature_embeddings = wordrep.feature_embeddings
+        self.w = wordrep.w
+
+        char_encoders = []
+        if wordrep.use_char:
+            char_encoders.append(self._char_encoder(wordrep.char_feature))
+            if wordrep.char_all_feature:
+                char_encoders.append(self._char_encoder(wordrep.char_feature_extra))
+        self.char_encoders = nn.ModuleList(char_encoders)
+        trans_encoders = []
+        if wordrep.use_trans:
+            trans_encoders.append(RNNLastHidden(wordrep.trans_feature.trans_embeddings,
+                                                wordrep.trans_feature.trans_lstm))
+        self.trans_encoders = nn.ModuleList(trans_encoders)
+
+        if word_hidden.word_feature_extractor == "CNN":
+            self.encoder = WordCNN(word_hidden.word2cnn, word_hidden.cnn_list, word_hidden.cnn_batchnorm_list)
+        elif word_hidden.word_feature_extractor == "IDCNN":
+            self.encoder = WordIDCNN(word_hidden.idcnn)
+        else:
+            self.encoder = WordRNN(word_hidden.lstm)
+        self.hidden2tag = word_hidden.hidden2tag
+        if self.use_crf:
+            self.register_buffer("transitions", seq_model.crf.transitions.data.clone())
+        else:
+            self.register_buffer("transitions", torch.zeros(1, 1))
+
+    def _char_encoder(self, char_feature):
+        if hasattr(char_feature, "char_cnn"):
+            return CNNMaxPool(char_feature.char_embeddings, char_feature.char_cnn)
+        return RNNLastHidden(char_feature.char_embeddings, char_feature.char_lstm)
+
+    def forward(self, word_inputs, word_seq_lengths, feature_inputs, char_inputs, char_seq_lengths, trans_inputs,
+                trans_seq_lengths):
+        """
+            input, all LongTensor, sentences do not need to be sorted:
+                word_inputs: (batch_size, sent_len)
+                word_seq_lengths: (batch_size)
+                feature_inputs: (batch_size, sent_len, feature_num)
+                char_inputs: (batch_size, sent_len, word_length)
+                char_seq_lengths: (batch_size, sent_len)
+                trans_inputs: (batch_size, sent_len, trans_length)
+                trans_seq_lengths: (batch_size, sent_len)
+            output:
+                tag_seq: (batch_size, sent_len) label ids, padded positions are 0
+        """
+        batch_size = word_inputs.size(0)
+        sent_len = word_inputs.size(1)
+        mask = torch.arange(sent_len).view(1, sent_len) < word_seq_lengths.view(batch_size, 1)
+        word_embs = self.word_embedding(word_inputs)
+        word_list = [word_embs]
+        idx = 0
+        for feature_embedding in self.feature_embeddings:
+            word_list.append(feature_embedding(feature_inputs[:, :, idx]))
+            idx += 1
+        for char_encoder in self.char_encoders:
+            char_features = char_encoder(char_inputs.view(batch_size * sent_len, -1),
+                                         char_seq_lengths.view(batch_size * sent_len))
+            ## WordRep encodes only the real words, padded positions have zero char features
+            char_features = char_features.view(batch_size, sent_len, -1) * mask.view(batch_size, sent_len, 1).float()
+            word_list.append(char_features)
+        for trans_encoder in self.trans_encoders:
+            trans_features = trans_encoder(trans_inputs.view(batch_size * sent_len, -1),
+                                           trans_seq_lengths.view(batch_size * sent_len))
+            ## words without translation use the projected word embedding instead
+            no_trans = (trans_inputs[:, :, 0] == 0).view(batch_size * sent_len, 1)
+            word_trans = self.w(word_embs.view(batch_size * sent_len, -1))
+            trans_features = torch.where(no_trans, word_trans, trans_features)
+            word_list.append(trans_features.view(batch_size, sent_len, -1))
+        word_represent = torch.cat(word_list, 2)
+        feature_out = self.encoder(word_represent, word_seq_lengths)
+        outs = self.hidden2tag(feature_out)
+        if self.use_crf:
+            return self._viterbi_decode(outs, mask, word_seq_lengths)
+        _, tag_seq = torch.max(outs, 2)
+        return tag_seq * mask.long()
+
+    def _viterbi_decode(self, feats, mask, word_seq_lengths):
+        """
+            the same 1-best search as CRF._viterbi_decode, with the backtrace driven by sentence lengths
+        """
+        batch_size = feats.size(0)
+        seq_len = feats.size(1)
+        tag_size = feats.size(2)
+        transitions = self.transitions.view(1, tag_size, tag_size)
+        partition = feats[:, 0, :] + self.transitions[START_TAG, :].view(1, tag_size)
+        back_points = torch.zeros(seq_len, batch_size, tag_size, dtype=torch.long)
+        for idx in range(1, seq_len):
+            cur_values = partition.view(batch_size, tag_size, 1) + transitions + feats[:, idx, :].view(batch_size, 1,
+                                                                                                      tag_size)
+            cur_partition, cur_bp = torch.max(cur_values, 1)
+            mask_idx = mask[:, idx].view(batch_size, 1)
+            ## keep the partition of the last real word for finished sentences
+            partition = torch.where(mask_idx, cur_partition, partition)
+            back_points[idx] = cur_bp.masked_fill(~mask_idx, 0)
+        last_values = partition.view(batch_size, tag_size, 1) + transitions
+        _, last_bp = torch.max(last_values, 1)
+        end_pointer = last_bp[:, STOP_TAG]
+        decode_idx = torch.zeros(batch_size, seq_len, dtype=torch.long)
+        pointer = end_pointer
+        for idx in range(seq_len - 1, -1, -1):
+            pointer = torch.where(word_seq_lengths - 1 == idx, end_pointer, pointer)
+            decode_idx[:, idx] = pointer
+            if idx > 0:
+                pointer = torch.gather(back_points[idx], 1, pointer.view(batch_size, 1)).view(batch_size)
+        return decode_idx * mask.long()
+
+
+def build_script_inputs(instances):
+    """
+        input: list of instances [words, features, chars, trans, labels] as generated by Data.generate_instance
+        output: zero padded LongTensors in the order expected by ScriptTagger.forward, sentences keep their order
+    """
+    batch_size = len(instances)
+    word_seq_lengths = np.array([len(sent[0]) for sent in instances], dtype=np.int64)
+    max_seq_len = word_seq_lengths.max()
+    feature_num = len(instances[0][1][0])
+    max_word_len = max([len(char) for sent in instances for char in sent[2]])
+    max_tran_len = max([len(tran) for sent in instances for tran in sent[3]])
+    word_inputs = np.zeros((batch_size, max_seq_len), dtype=np.int64)
+    feature_inputs = np.zeros((batch_size, max_seq_len, feature_num), dtype=np.int64)
+    char_inputs = np.zeros((batch_size, max_seq_len, max_word_len), dtype=np.int64)
+    char_seq_lengths = np.zeros((batch_size, max_seq_len), dtype=np.int64)
+    trans_inputs = np.zeros((batch_size, max_seq_len, max_tran_len), dtype=np.int64)
+    trans_seq_lengths = np.zeros((batch_size, max_seq_len), dtype=np.int64)
+    for idx, sent in enumerate(instances):
+        seqlen = len(sent[0])
+        word_inputs[idx, :seqlen] = sent[0]
+        if feature_num:
+            feature_inputs[idx, :seqlen] = sent[1]
+        for idy in range(seqlen):
+            char_seq_lengths[idx, idy] = len(sent[2][idy])
+            char_inputs[idx, idy, :len(sent[2][idy])] = sent[2][idy]
+            trans_seq_lengths[idx, idy] = len(sent[3][idy])
+            trans_inputs[idx, idy, :len(sent[3][idy])] = sent[3][idy]
+    return [torch.from_numpy(tensor) for tensor in (word_inputs, word_seq_lengths, feature_inputs, char_inputs,
+                                                   char_seq_lengths, trans_inputs, trans_seq_lengths)]
@@ -8,6 +8,7 @@ import torch.nn.functional as F
 import numpy as np
 from wordsequence import WordSequence
 from crf import CRF
+from utils.telemetry import telemetry
 
 
 class SeqModel(nn.Module):
@@ -23,24 +24,48 @@ class SeqModel(nn.Module):
 
         self.gpu = data.HP_gpu
         self.average_batch = data.average_batch_loss
-        ## add two more label for downlayer lstm, use original label size for CRF
-        label_size = data.label_alphabet_size
-        data.label_alphabet_size += 2
+        ## run the encoder stack (word rep, char/trans encoders, word lstm/cnn, hidden2tag) under bfloat16 autocast
+        self.bf16 = data.HP_bf16
+        if self.bf16 and not hasattr(torch, "autocast"):
+            raise RuntimeError("bf16=True needs torch.autocast (PyTorch >= 1.10), this is PyTorch %s" % (
+                torch.__version__))
+        print "use bf16: ", self.bf16
+        ## the downlayer lstm has two more labels (WordSequence.hidden2tag), the CRF uses the original label size.
+        ## data is not changed, so several models can be built from the same data (background evaluation)
         self.word_hidden = WordSequence(data)
         if self.use_crf:
-            self.crf = CRF(label_size, self.gpu)
+            self.crf = CRF(data.label_alphabet_size, self.gpu)
+
+    def get_features(self, word_inputs, feature_inputs, word_seq_lengths, char_inputs, char_seq_lengths,
+                     char_seq_recover, trans_inputs, trans_seq_length, trans_seq_recover):
+        """
+            run the word sequence encoder, under bfloat16 autocast if enabled.
+            outputs are always returned in float32, so the CRF log-sum-exp and the loss accumulate in float32.
+        """
+        if not self.bf16:
+            return self.word_hidden(word_inputs, feature_inputs, word_seq_lengths, char_inputs, char_seq_lengths,
+                                    char_seq_recover, trans_inputs, trans_seq_length, trans_seq_recover)
+        device_type = "cuda" if self.gpu else "cpu"
+        with torch.autocast(device_type=device_type, dtype=torch.bfloat16):
+            outs, w_word_embs, trans_features_wc = self.word_hidden(word_inputs, feature_inputs, word_seq_lengths,
+                                                                    char_inputs, char_seq_lengths,
+                                                                    char_seq_recover, trans_inputs,
+                                                                    trans_seq_length, trans_seq_recover)
+        return outs.float(), w_word_embs.float(), trans_features_wc.float()
 
     def neg_log_likelihood_loss(self, word_inputs, feature_inputs, word_seq_lengths, char_inputs, char_seq_lengths,
                                 char_seq_recover, batch_label, mask, trans_inputs, trans_seq_length, trans_seq_recover):
-        outs, w_word_embs, trans_features_wc = self.word_hidden(word_inputs, feature_inputs, word_seq_lengths,
-                                                                char_inputs, char_seq_lengths,
-                                                                char_seq_recover, trans_inputs, trans_seq_length,
-                                                                trans_seq_recover)
+        outs, w_word_embs, trans_features_wc = self.get_features(word_inputs, feature_inputs, word_seq_lengths,
+                                                                 char_inputs, char_seq_lengths,
+                                                                 char_seq_recover, trans_inputs, trans_seq_length,
+                                                                 trans_seq_recover)
         batch_size = word_inputs.size(0)
         seq_len = word_inputs.size(1)
         if self.use_crf:
-            total_loss = self.crf.neg_log_likelihood_loss(outs, mask, batch_label)
-            scores, tag_seq = self.crf._viterbi_decode(outs, mask)
+            with telemetry.stage("crf_loss"):
+                total_loss = self.crf.neg_log_likelihood_loss(outs, mask, batch_label)
+            with telemetry.stage("viterbi"):
+                scores, tag_seq = self.crf._viterbi_decode(outs, mask)
             wc_loss = torch.norm(w_word_embs - trans_features_wc)
         else:
             loss_function = nn.NLLLoss(ignore_index=0, size_average=False)
@@ -55,14 +80,15 @@ class SeqModel(nn.Module):
 
     def forward(self, word_inputs, feature_inputs, word_seq_lengths, char_inputs, char_seq_lengths, char_seq_recover,
                 mask, trans_inputs, trans_seq_length, trans_seq_recover):
-        outs, w_word_embs, trans_features_wc = self.word_hidden(word_inputs, feature_inputs, word_seq_lengths,
-                                                                char_inputs, char_seq_lengths,
-                                                                char_seq_recover, trans_inputs, trans_seq_length,
-                                                                trans_seq_recover)
+        outs, w_word_embs, trans_features_wc = self.get_features(word_inputs, feature_inputs, word_seq_lengths,
+                                                                 char_inputs, char_seq_lengths,
+                                                                 char_seq_recover, trans_inputs, trans_seq_length,
+                                                                 trans_seq_recover)
         batch_size = word_inputs.size(0)
         seq_len = word_inputs.size(1)
         if self.use_crf:
-            scores, tag_seq = self.crf._viterbi_decode(outs, mask)
+            with telemetry.stage("viterbi"):
+                scores, tag_seq = self.crf._viterbi_decode(outs, mask)
         else:
             outs = outs.view(batch_size * seq_len, -1)
             _, tag_seq = torch.max(outs, 1)
@@ -71,6 +97,29 @@ class SeqModel(nn.Module):
             tag_seq = mask.long() * tag_seq
         return tag_seq
 
+    def decode_scored(self, word_inputs, feature_inputs, word_seq_lengths, char_inputs, char_seq_lengths,
+                      char_seq_recover, mask, trans_inputs, trans_seq_length, trans_seq_recover):
+        """
+            1-best decode as forward() with a score for each sentence: the viterbi path score (unnormalized, log
+            space) with CRF, else the log probability of the label sequence (sum of the token log softmax)
+            output: scores (batch,), tag_seq (batch, seq_len)
+        """
+        outs, w_word_embs, trans_features_wc = self.get_features(word_inputs, feature_inputs, word_seq_lengths,
+                                                                 char_inputs, char_seq_lengths,
+                                                                 char_seq_recover, trans_inputs, trans_seq_length,
+                                                                 trans_seq_recover)
+        batch_size = word_inputs.size(0)
+        seq_len = word_inputs.size(1)
+        if self.use_crf:
+            with telemetry.stage("viterbi"):
+                scores, tag_seq = self.crf._viterbi_decode(outs, mask)
+        else:
+            outs = outs.view(batch_size * seq_len, -1)
+            token_scores, tag_seq = torch.max(F.log_softmax(outs, 1), 1)
+            tag_seq = mask.long() * tag_seq.view(batch_size, seq_len)
+            scores = (token_scores.view(batch_size, seq_len) * mask.float()).sum(1)
+        return scores, tag_seq
+
     # def get_lstm_features(self, word_inputs, word_seq_lengths, char_inputs, char_seq_lengths, char_seq_recover):
     #     return self.word_hidden(word_inputs, word_seq_lengths, char_inputs, char_seq_lengths, char_seq_recover)
 
@@ -79,11 +128,12 @@ class SeqModel(nn.Module):
         if not self.use_crf:
             print "Nbest output is currently supported only for CRF! Exit..."
             exit(0)
-        outs, w_word_embs, trans_features_wc = self.word_hidden(word_inputs, feature_inputs, word_seq_lengths,
-                                                                char_inputs, char_seq_lengths,
-                                                                char_seq_recover, trans_inputs, trans_seq_length,
-                                                                trans_seq_recover)
+        outs, w_word_embs, trans_features_wc = self.get_features(word_inputs, feature_inputs, word_seq_lengths,
+                                                                 char_inputs, char_seq_lengths,
+                                                                 char_seq_recover, trans_inputs, trans_seq_length,
+                                                                 trans_seq_recover)
         batch_size = word_inputs.size(0)
         seq_len = word_inputs.size(1)
-        scores, tag_seq = self.crf._viterbi_decode_nbest(outs, mask, nbest)
+        with telemetry.stage("viterbi_nbest"):
+            scores, tag_seq = self.crf._viterbi_decode_nbest(outs, mask, nbest)
         return scores, tag_seq
@@ -10,6 +10,9 @@ from charbilstm import CharBiLSTM
 from charbigru import CharBiGRU
 from charcnn import CharCNN
 from model.TransBiLSTM import TransBiLSTM
+from utils.telemetry import telemetry
+from utils.memory import memory
+from initialization import init_embedding
 
 
 class WordRep(nn.Module):
@@ -29,7 +32,8 @@ class WordRep(nn.Module):
             self.trans_embedding_dim = data.trans_emb_dim
             self.trans_feature = TransBiLSTM(data.translation_alphabet.size(), self.trans_embedding_dim,
                                              self.trans_hidden_dim,
-                                             data.HP_dropout, data.pretrain_trans_embedding, self.gpu)
+                                             data.HP_dropout, data.pretrain_trans_embedding, self.gpu,
+                                             sparse=data.sparse_embedding, freeze=data.freeze_trans_emb)
 
         if self.use_char:
             self.char_hidden_dim = data.HP_char_hidden_dim
@@ -54,12 +58,15 @@ class WordRep(nn.Module):
                 exit(0)
         self.embedding_dim = data.word_emb_dim
         self.drop = nn.Dropout(data.HP_dropout)
-        self.word_embedding = nn.Embedding(data.word_alphabet.size(), self.embedding_dim)
-        if data.pretrain_word_embedding is not None:
-            self.word_embedding.weight.data.copy_(torch.from_numpy(data.pretrain_word_embedding))
-        else:
-            self.word_embedding.weight.data.copy_(
-                torch.from_numpy(self.random_embedding(data.word_alphabet.size(), self.embedding_dim)))
+        self.word_embedding = nn.Embedding(data.word_alphabet.size(), self.embedding_dim,
+                                           sparse=data.sparse_embedding)
+        init_embedding(self.word_embedding, data.pretrain_word_embedding)
+        ## a frozen table gets no gradient, its backward pass is skipped
+        if data.freeze_word_emb:
+            if data.pretrain_word_embedding is None:
+                print "No pretrained word embedding to freeze, the word embedding is trained."
+            else:
+                self.word_embedding.weight.requires_grad = False
 
         self.feature_num = data.feature_num
         self.feature_embedding_dims = data.feature_emb_dims
@@ -68,11 +75,7 @@ class WordRep(nn.Module):
             self.feature_embeddings.append(
                 nn.Embedding(data.feature_alphabets[idx].size(), self.feature_embedding_dims[idx]))
         for idx in range(self.feature_num):
-            if data.pretrain_feature_embeddings[idx] is not None:
-                self.feature_embeddings[idx].weight.data.copy_(torch.from_numpy(data.pretrain_feature_embeddings[idx]))
-            else:
-                self.feature_embeddings[idx].weight.data.copy_(torch.from_numpy(
-                    self.random_embedding(data.feature_alphabets[idx].size(), self.feature_embedding_dims[idx])))
+            init_embedding(self.feature_embeddings[idx], data.pretrain_feature_embeddings[idx])
 
         if self.gpu:
             self.drop = self.drop.cuda()
@@ -80,12 +83,14 @@ class WordRep(nn.Module):
             for idx in range(self.feature_num):
                 self.feature_embeddings[idx] = self.feature_embeddings[idx].cuda()
 
-    def random_embedding(self, vocab_size, embedding_dim):
-        pretrain_emb = np.empty([vocab_size, embedding_dim])
-        scale = np.sqrt(3.0 / embedding_dim)
-        for index in range(vocab_size):
-            pretrain_emb[index, :] = np.random.uniform(-scale, scale, [1, embedding_dim])
-        return pretrain_emb
+
+    def scatter_words(self, rows, word_positions, position_num):
+        """
+            rows: (word_num, dim) features of the real words, word_positions: (word_num) their flattened positions
+            output: (position_num, dim), padded positions are zero
+        """
+        padded = autograd.Variable(rows.data.new(position_num, rows.size(1)).zero_())
+        return padded.index_copy(0, word_positions, rows)
 
     def forward(self, word_inputs, feature_inputs, word_seq_lengths, char_inputs, char_seq_lengths, char_seq_recover,
                 trans_inputs, trans_seq_length, trans_seq_recover):
@@ -94,9 +99,10 @@ class WordRep(nn.Module):
                 word_inputs: (batch_size, sent_len)
                 features: list [(batch_size, sent_len), (batch_len, sent_len),...]
                 word_seq_lengths: list of batch_size, (batch_size,1)
-                char_inputs: (batch_size*sent_len, word_length)
-                char_seq_lengths: list of whole batch_size for char, (batch_size*sent_len, 1)
+                char_inputs: (word_num, word_length), one row for each real word (word id > 0)
+                char_seq_lengths: list of whole batch_size for char, (word_num, 1)
                 char_seq_recover: variable which records the char order information, used to recover char order
+                trans_inputs, trans_seq_length, trans_seq_recover: the same for the translations
             output: 
                 Variable(batch_size, sent_len, hidden_dim)
         """
@@ -107,42 +113,48 @@ class WordRep(nn.Module):
 
         for idx in range(self.feature_num):
             word_list.append(self.feature_embeddings[idx](feature_inputs[idx]))
+        ## char/translation rows are the real words in the order of the flattened (batch_size*sent_len) batch
+        word_positions = word_inputs.view(-1).nonzero().view(-1)
 
         if self.use_char:
-            # calculate char lstm last hidden
-            char_features, _ = self.char_feature.get_last_hiddens(char_inputs, char_seq_lengths.cpu().numpy())
-            char_features = char_features[char_seq_recover]
-            char_features = char_features.view(batch_size, sent_len, -1)
-            # concat word and char together
-            word_list.append(char_features)
-            # word_embs = torch.cat([word_embs, char_features], 2)
-            if self.char_all_feature:
-                char_features_extra, _ = self.char_feature_extra.get_last_hiddens(char_inputs,
-                                                                                  char_seq_lengths.cpu().numpy())
-                char_features_extra = char_features_extra[char_seq_recover]
-                char_features_extra = char_features_extra.view(batch_size, sent_len, -1)
+            with telemetry.stage("word_rep.char"):
+                # calculate char lstm last hidden
+                char_features, _ = self.char_feature.get_last_hiddens(char_inputs, char_seq_lengths.cpu().numpy())
+                char_features = self.scatter_words(char_features[char_seq_recover], word_positions,
+                                                   batch_size * sent_len)
+                char_features = char_features.view(batch_size, sent_len, -1)
                 # concat word and char together
-                word_list.append(char_features_extra)
+                word_list.append(char_features)
+                # word_embs = torch.cat([word_embs, char_features], 2)
+                if self.char_all_feature:
+                    char_features_extra, _ = self.char_feature_extra.get_last_hiddens(char_inputs,
+                                                                                      char_seq_lengths.cpu().numpy())
+                    char_features_extra = self.scatter_words(char_features_extra[char_seq_recover], word_positions,
+                                                             batch_size * sent_len)
+                    char_features_extra = char_features_extra.view(batch_size, sent_len, -1)
+                    # concat word and char together
+                    word_list.append(char_features_extra)
 
         if self.use_trans:
-            trans_features, trans_rnn_length = self.trans_feature.get_last_hiddens(trans_inputs,
-                                                                                   trans_seq_length.cpu().numpy())
+            with telemetry.stage("word_rep.trans"):
+                trans_features, trans_rnn_length = self.trans_feature.get_last_hiddens(trans_inputs,
+                                                                                       trans_seq_length.cpu().numpy())
 
-            trans_features_wc = trans_features
-            if self.gpu:
-                trans_features_wc.cuda()
-            trans_features_wc = trans_features_wc[trans_seq_recover]
-            trans_inputs = trans_inputs[trans_seq_recover]
-            word_embs_temp = word_embs.view(batch_size * sent_len, -1)
-            for index, line in enumerate(trans_inputs):
-                if line[0].data.cpu().numpy()[0] == 0:
-                    trans_features_wc[index] = self.w(word_embs_temp[index])
+                word_embs_temp = word_embs.view(batch_size * sent_len, -1)
+                w_word_embs = self.w(word_embs_temp)
+                trans_features = self.scatter_words(trans_features[trans_seq_recover], word_positions,
+                                                    batch_size * sent_len)
+                ## words without translation (first id 0) and padded positions use the projected word embedding
+                has_trans = (trans_inputs[trans_seq_recover][:, 0] > 0).float().view(-1, 1)
+                has_trans = self.scatter_words(has_trans, word_positions, batch_size * sent_len)
+                trans_features_wc = has_trans * trans_features + (1 - has_trans) * w_word_embs
 
-            trans_features_wc_temp = trans_features_wc
-            trans_features_wc = trans_features_wc.view(batch_size, sent_len, -1)
+                trans_features_wc_temp = trans_features_wc
+                trans_features_wc = trans_features_wc.view(batch_size, sent_len, -1)
 
-            word_list.append(trans_features_wc)
+                word_list.append(trans_features_wc)
 
         word_embs = torch.cat(word_list, 2)
         word_represent = self.drop(word_embs)
-        return word_represent, self.w(word_embs_temp), trans_features_wc_temp
+        memory.add("word_rep", word_embs, word_represent, *word_list)
+        return word_represent, w_word_embs, trans_features_wc_temp
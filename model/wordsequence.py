@@ -7,6 +7,8 @@ import torch.nn.functional as F
 import numpy as np
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from wordrep import WordRep
+from idcnn import IDCNN
+from utils.telemetry import telemetry
 
 
 class WordSequence(nn.Module):
@@ -65,8 +67,12 @@ class WordSequence(nn.Module):
                     nn.Conv1d(data.HP_hidden_dim, data.HP_hidden_dim, kernel_size=kernel, padding=pad_size))
                 self.cnn_drop_list.append(nn.Dropout(data.HP_dropout))
                 self.cnn_batchnorm_list.append(nn.BatchNorm1d(data.HP_hidden_dim))
+        elif self.word_feature_extractor == "IDCNN":
+            self.idcnn = IDCNN(self.input_size, data.HP_hidden_dim, data.HP_idcnn_dilations, data.HP_idcnn_iterations,
+                               data.HP_dropout, self.gpu)
+            print "IDCNN receptive field: ", self.idcnn.receptive_field
         # The linear layer that maps from hidden state space to tag space
-        self.hidden2tag = nn.Linear(data.HP_hidden_dim, data.label_alphabet_size)
+        self.hidden2tag = nn.Linear(data.HP_hidden_dim, data.label_alphabet_size + 2)
 
         if self.gpu:
             self.droplstm = self.droplstm.cuda()
@@ -77,7 +83,7 @@ class WordSequence(nn.Module):
                     self.cnn_list[idx] = self.cnn_list[idx].cuda()
                     self.cnn_drop_list[idx] = self.cnn_drop_list[idx].cuda()
                     self.cnn_batchnorm_list[idx] = self.cnn_batchnorm_list[idx].cuda()
-            else:
+            elif self.word_feature_extractor != "IDCNN":
                 self.lstm = self.lstm.cuda()
 
     def forward(self, word_inputs, feature_inputs, word_seq_lengths, char_inputs, char_seq_lengths, char_seq_recover,
@@ -86,35 +92,40 @@ class WordSequence(nn.Module):
             input:
                 word_inputs: (batch_size, sent_len)
                 word_seq_lengths: list of batch_size, (batch_size,1)
-                char_inputs: (batch_size*sent_len, word_length)
-                char_seq_lengths: list of whole batch_size for char, (batch_size*sent_len, 1)
+                char_inputs: (word_num, word_length), one row for each real word
+                char_seq_lengths: list of whole batch_size for char, (word_num, 1)
                 char_seq_recover: variable which records the char order information, used to recover char order
             output: 
                 Variable(batch_size, sent_len, hidden_dim)
         """
-        word_represent, w_word_embs, trans_features_wc = self.wordrep(word_inputs, feature_inputs, word_seq_lengths,
-                                                                      char_inputs, char_seq_lengths,
-                                                                      char_seq_recover, trans_inputs,
-                                                                      trans_seq_length, trans_seq_recover)
+        with telemetry.stage("word_rep"):
+            word_represent, w_word_embs, trans_features_wc = self.wordrep(word_inputs, feature_inputs,
+                                                                          word_seq_lengths, char_inputs,
+                                                                          char_seq_lengths, char_seq_recover,
+                                                                          trans_inputs, trans_seq_length,
+                                                                          trans_seq_recover)
 
-        ## word_embs (batch_size, seq_len, embed_size)
-        if self.word_feature_extractor == "CNN":
-            word_in = F.tanh(self.word2cnn(word_represent)).transpose(2, 1).contiguous()
-            for idx in range(self.cnn_layer):
-                if idx == 0:
-                    cnn_feature = F.relu(self.cnn_list[idx](word_in))
-                else:
-                    cnn_feature = F.relu(self.cnn_list[idx](cnn_feature))
-                cnn_feature = self.cnn_drop_list[idx](cnn_feature)
-                cnn_feature = self.cnn_batchnorm_list[idx](cnn_feature)
-            feature_out = cnn_feature.transpose(2, 1).contiguous()
-        else:
-            packed_words = pack_padded_sequence(word_represent, word_seq_lengths.cpu().numpy(), True)
-            hidden = None
-            lstm_out, hidden = self.lstm(packed_words, hidden)
-            lstm_out, _ = pad_packed_sequence(lstm_out)
-            ## lstm_out (seq_len, seq_len, hidden_size)
-            feature_out = self.droplstm(lstm_out.transpose(1, 0))
+        with telemetry.stage("word_encoder"):
+            ## word_embs (batch_size, seq_len, embed_size)
+            if self.word_feature_extractor == "CNN":
+                word_in = F.tanh(self.word2cnn(word_represent)).transpose(2, 1).contiguous()
+                for idx in range(self.cnn_layer):
+                    if idx == 0:
+                        cnn_feature = F.relu(self.cnn_list[idx](word_in))
+                    else:
+                        cnn_feature = F.relu(self.cnn_list[idx](cnn_feature))
+                    cnn_feature = self.cnn_drop_list[idx](cnn_feature)
+                    cnn_feature = self.cnn_batchnorm_list[idx](cnn_feature)
+                feature_out = cnn_feature.transpose(2, 1).contiguous()
+            elif self.word_feature_extractor == "IDCNN":
+                feature_out = self.idcnn(word_represent, word_inputs > 0)
+            else:
+                packed_words = pack_padded_sequence(word_represent, word_seq_lengths.cpu().numpy(), True)
+                hidden = None
+                lstm_out, hidden = self.lstm(packed_words, hidden)
+                lstm_out, _ = pad_packed_sequence(lstm_out)
+                ## lstm_out (seq_len, seq_len, hidden_size)
+                feature_out = self.droplstm(lstm_out.transpose(1, 0))
         ## feature_out (batch_size, seq_len, hidden_size)
         outputs = self.hidden2tag(feature_out)
         return outputs, w_word_embs, trans_features_wc
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+import time
+import os
+import json
+import argparse
+import threading
+import Queue
+import BaseHTTPServer
+import SocketServer
+import torch
+from tagger import Tagger
+from utils.data import Data
+
+
+class TagRequest(object):
+    def __init__(self, instances, nbest):
+        self.instances = instances
+        self.nbest = nbest
+        self.labels = None
+        self.scores = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """
+        collect concurrent tag requests into micro-batches of about max_batch_size sentences, waiting at most
+        max_wait milliseconds after the first request for more, and run them through the model in one thread.
+        at most queue_limit requests can wait, further requests are shed.
+    """
+
+    def __init__(self, tagger, max_batch_size, max_wait, queue_limit):
+        self.tagger = tagger
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait / 1000.0
+        self.queue = Queue.Queue(queue_limit)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, request):
+        """
+            return False if the queue is full and the request is rejected
+        """
+        try:
+            self.queue.put_nowait(request)
+        except Queue.Full:
+            return False
+        return True
+
+    def next_batch(self):
+        requests = [self.queue.get()]
+        sent_num = len(requests[0].instances)
+        deadline = time.time() + self.max_wait
+        while sent_num < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=remaining)
+            except Queue.Empty:
+                break
+            requests.append(request)
+            sent_num += len(request.instances)
+        return requests
+
+    def run(self):
+        while True:
+            requests = self.next_batch()
+            for nbest in set([request.nbest for request in requests]):
+                group = [request for request in requests if request.nbest == nbest]
+                instances = []
+                for request in group:
+                    instances += request.instances
+                try:
+                    pred_results, pred_scores = self.tagger.tag_instances(instances, nbest)
+                except BaseException as e:
+                    ## also SystemExit of the model code: this thread must go on or every later request hangs
+                    for request in group:
+                        request.error = repr(e)
+                        request.done.set()
+                    continue
+                start = 0
+                for request in group:
+                    end = start + len(request.instances)
+                    request.labels = pred_results[start:end]
+                    request.scores = pred_scores[start:end]
+                    request.done.set()
+                    start = end
+
+
+class TagHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+        POST /tag  {"sentences": [["token", ...], ...], "nbest": 1}
+            -> {"labels": [[label, ...], ...], "scores": [[score, ...], ...]}
+            without nbest: labels [[label, ...], ...] (one sequence per sentence) and scores [score, ...]
+        GET /health -> {"status": "ok", "queue": waiting requests}
+    """
+
+    def send_json(self, code, content):
+        body = json.dumps(content)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "unknown path: %s" % (self.path)})
+            return
+        self.send_json(200, {"status": "ok", "queue": self.server.batcher.queue.qsize()})
+
+    def do_POST(self):
+        if self.path != "/tag":
+            self.send_json(404, {"error": "unknown path: %s" % (self.path)})
+            return
+        try:
+            length = int(self.headers.getheader('content-length', 0))
+            body = json.loads(self.rfile.read(length))
+            sentences = body["sentences"]
+            nbest = body.get("nbest", self.server.data.nbest or None)
+            if not isinstance(sentences, list) or not sentences:
+                raise ValueError("sentences must be a non-empty list")
+            for sentence in sentences:
+                if not isinstance(sentence, list) or not sentence or \
+                        not all(isinstance(token, basestring) and token.strip() for token in sentence):
+                    raise ValueError("every sentence must be a non-empty list of non-empty token strings")
+            if nbest is not None and (isinstance(nbest, bool) or not isinstance(nbest, (int, long)) or nbest < 1):
+                raise ValueError("nbest must be a positive integer")
+            if nbest and not self.server.tagger.data.use_crf:
+                raise ValueError("nbest output needs a CRF model")
+            instances = self.server.tagger.instances(sentences)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_json(400, {"error": "illegal request: %s" % (repr(e))})
+            return
+        request = TagRequest(instances, nbest)
+        if not self.server.batcher.submit(request):
+            self.send_json(503, {"error": "server is overloaded, queue limit reached"})
+            return
+        while not request.done.wait(1.0):
+            pass
+        if request.error is not None:
+            self.send_json(500, {"error": request.error})
+            return
+        self.send_json(200, {"labels": request.labels, "scores": request.scores})
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def warm_up(tagger, batch_size, nbest):
+    """
+        run one full micro-batch (with nbest if configured) before accepting requests
+    """
+    instances = tagger.data.dev_Ids[:batch_size]
+    if not instances:
+        instances = tagger.instances([["warm", "up"]] * batch_size)
+    start_time = time.time()
+    tagger.tag_instances(instances)
+    if nbest:
+        tagger.tag_instances(instances, nbest)
+    print("Warm up with %s sentences: time: %.2fs" % (len(instances), time.time() - start_time))
+
+
+def serve(data):
+    tagger = Tagger(data.dset_dir, data.load_model_dir, data.HP_gpu, data.serve_batch_size, data.quantize)
+    if data.nbest and not tagger.data.use_crf:
+        print "Nbest output is currently supported only for CRF! Exit..."
+        exit(0)
+    warm_up(tagger, data.serve_batch_size, data.nbest)
+    batcher = MicroBatcher(tagger, data.serve_batch_size, data.serve_max_wait, data.serve_queue_limit)
+    batcher.start()
+    if data.serve_socket:
+        if os.path.exists(data.serve_socket):
+            os.remove(data.serve_socket)
+        server = ThreadingUnixHTTPServer(data.serve_socket, TagHandler)
+        print("Serving on unix socket %s" % (data.serve_socket))
+    else:
+        server = ThreadingHTTPServer((data.serve_host, data.serve_port), TagHandler)
+        print("Serving on http://%s:%s" % (data.serve_host, data.serve_port))
+    print("     micro-batch size: %s, max wait: %sms, queue limit: %s" % (
+        data.serve_batch_size, data.serve_max_wait, data.serve_queue_limit))
+    server.data = data
+    server.tagger = tagger
+    server.batcher = batcher
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tagging server with dynamic micro-batching')
+    parser.add_argument('--config', default="./demo.server.config", help='Configuration File')
+    args = parser.parse_args()
+    data = Data()
+    data.read_config(args.config)
+    data.HP_gpu = torch.cuda.is_available()
+    serve(data)
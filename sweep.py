@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import math
+import json
+import time
+import Queue
+import random
+import argparse
+import itertools
+import traceback
+import multiprocessing
+from collections import OrderedDict
+import torch
+from main import train, prepare_train_data, seed_num
+from utils.data import Data
+
+## config items read while preprocessing (or shared by all trials), a sweep can not change them
+FIXED_ITEMS = ["train_dir", "dev_dir", "test_dir", "trans_dir", "raw_dir", "dset_dir", "model_dir", "word_emb_dir",
+               "char_emb_dir", "trans_embed_dir", "MAX_SENTENCE_LENGTH", "MAX_WORD_LENGTH", "MAX_TRANS_NUM",
+               "number_normalized", "norm_word_emb", "norm_char_emb", "feature", "preprocess_workers", "status",
+               "world_size", "dist_init_method", "resume_dir", "window_long_sentences"]
+## window_context can change: the windows are split in train()/evaluate() of each trial, not while preprocessing
+## embedding sizes are fixed by the pretrained embedding file if there is one
+PRETRAINED_DIMS = {"word_emb_dim": "word_emb_dir", "char_emb_dim": "char_emb_dir", "trans_emb_dim": "trans_embed_dir"}
+
+
+def load_spec(spec_file):
+    """
+        JSON sweep spec:
+            {"search": "grid" or "random", "trials": 20, "seed": 42,
+             "params": {"hidden_dim": [100, 200], "char_seq_feature": ["CNN", "LSTM"],
+                        "learning_rate": {"min": 0.005, "max": 0.05, "log": true}}}
+        params are config items. grid: every combination of the value lists. random: "trials" draws, a value
+        list is sampled uniformly, a {"min", "max"} range uniformly (log-uniformly with "log", integer if min and
+        max are integers).
+    """
+    with open(spec_file) as fin:
+        spec = json.load(fin, object_pairs_hook=OrderedDict)
+    spec.setdefault("search", "grid")
+    if spec["search"] not in ("grid", "random"):
+        raise ValueError("Unknown search %s, use grid or random" % (spec["search"]))
+    for name, values in spec["params"].items():
+        if name in FIXED_ITEMS:
+            raise ValueError("%s is read during preprocessing, it can not change between trials" % (name))
+        if spec["search"] == "grid" and not isinstance(values, list):
+            raise ValueError("Grid search needs a list of values for %s" % (name))
+    return spec
+
+
+def check_spec(spec, data):
+    for name, emb_dir in PRETRAINED_DIMS.items():
+        if name in spec["params"] and getattr(data, emb_dir):
+            raise ValueError("%s is given by the pretrained embedding %s" % (name, getattr(data, emb_dir)))
+
+
+def sample_value(rng, values):
+    if isinstance(values, list):
+        return rng.choice(values)
+    low, high = values["min"], values["max"]
+    if values.get("log"):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    if isinstance(low, int) and isinstance(high, int):
+        return int(round(value))
+    return value
+
+
+def trial_params(spec):
+    """
+        output: list of OrderedDict config item: value, one per trial
+    """
+    params = spec["params"]
+    if spec["search"] == "grid":
+        names = list(params)
+        return [OrderedDict(zip(names, values)) for values in itertools.product(*[params[name] for name in names])]
+    rng = random.Random(spec.get("seed", seed_num))
+    return [OrderedDict((name, sample_value(rng, values)) for name, values in params.items())
+            for _ in range(spec["trials"])]
+
+
+def config_value(value):
+    """
+        spec value to its config file string: booleans as True/False, lists comma separated
+    """
+    if isinstance(value, list):
+        return ",".join(str(item) for item in value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def run_trial(data, trial_id, params, threads, result_queue):
+    """
+        process of one trial, forked from the process which preprocessed data: the instances, alphabets and
+        embedding matrices are shared copy-on-write. training output goes to model_dir.trial<id>.log, the models
+        to model_dir.trial<id>.*
+    """
+    data.model_dir = "%s.trial%s" % (data.model_dir, trial_id)
+    log_file = open(data.model_dir + ".log", 'w')
+    sys.stdout = log_file
+    sys.stderr = log_file
+    torch.set_num_threads(threads)
+    data.set_config(dict((name, config_value(value)) for name, value in params.items()))
+    print("Trial %s: %s" % (trial_id, json.dumps(params)))
+    start_time = time.time()
+    try:
+        result = train(data)
+    except (Exception, SystemExit):
+        traceback.print_exc()
+        result = None
+    log_file.flush()
+    result_queue.put((trial_id, result, time.time() - start_time))
+
+
+def run_sweep(data, params_list, workers, threads):
+    """
+        run the trials in at most `workers` processes at a time, each with `threads` intra-op threads
+        output: list of (trial id, params, train() result or None if the trial failed, seconds)
+    """
+    result_queue = multiprocessing.Queue()
+    pending = list(enumerate(params_list))
+    running = {}
+    results = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            trial_id, params = pending.pop(0)
+            process = multiprocessing.Process(target=run_trial, args=(data, trial_id, params, threads,
+                                                                      result_queue))
+            process.start()
+            running[trial_id] = process
+        try:
+            trial_id, result, cost = result_queue.get(timeout=1)
+        except Queue.Empty:
+            ## a trial killed without reporting (e.g. out of memory)
+            for trial_id, process in running.items():
+                if process.exitcode not in (None, 0):
+                    print("Trial %s: process exited with code %s" % (trial_id, process.exitcode))
+                    results[trial_id] = (None, 0.)
+                    del running[trial_id]
+            continue
+        running.pop(trial_id).join()
+        results[trial_id] = (result, cost)
+        print("Trial %s finished%s in %.2fs, %s/%s done" % (trial_id, "" if result else " (failed)", cost,
+                                                            len(results), len(params_list)))
+    return [(trial_id, params_list[trial_id]) + results[trial_id] for trial_id in range(len(params_list))]
+
+
+def print_table(data, trials, names):
+    score = "f" if data.seg else "acc"
+    header = ["trial"] + names + ["dev " + score, "test " + score, "epoch", "train st/s", "eval st/s", "time(s)"]
+    rows = []
+    ranked = sorted(trials, key=lambda trial: -trial[2]["best_dev"] if trial[2] else float("inf"))
+    for trial_id, params, result, cost in ranked:
+        row = [str(trial_id)] + [config_value(params[name]) for name in names]
+        if result:
+            row += ["%.4f" % result["best_dev"],
+                    "%.4f" % result["test"] if result["test"] is not None else "-",
+                    str(result["best_epoch"]), "%.2f" % result["train_speed"], "%.2f" % result["eval_speed"]]
+        else:
+            row += ["failed", "-", "-", "-", "-"]
+        rows.append(row + ["%.2f" % cost])
+    widths = [max(len(row[idx]) for row in [header] + rows) for idx in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hyperparameter sweep on data preprocessed once')
+    parser.add_argument('--config', default="./demo.train.config", help='Base configuration File')
+    parser.add_argument('--spec', default="./demo.sweep.json", help='JSON grid/random search spec')
+    parser.add_argument('--workers', type=int, default=2, help='Trials run at the same time')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='torch intra-op threads per trial, 0: cpu count / workers')
+    parser.add_argument('--output', default="./sweep_result.json", help='JSON result file')
+
+    args = parser.parse_args()
+    data = Data()
+    data.read_config(args.config)
+    data.HP_gpu = torch.cuda.is_available()
+    spec = load_spec(args.spec)
+    check_spec(spec, data)
+    params_list = trial_params(spec)
+    threads = args.threads if args.threads > 0 else max(1, multiprocessing.cpu_count() // args.workers)
+    print("Sweep: %s search, %s trials, %s at a time with %s threads each" % (spec["search"], len(params_list),
+                                                                           args.workers, threads))
+    start_time = time.time()
+    prepare_train_data(data)
+    print("Preprocessing time: %.2fs" % (time.time() - start_time))
+    trials = run_sweep(data, params_list, args.workers, threads)
+    print("Sweep time: %.2fs" % (time.time() - start_time))
+    print_table(data, trials, list(spec["params"]))
+    with open(args.output, 'w') as fout:
+        json.dump([OrderedDict([("trial", trial_id), ("params", params), ("result", result), ("time", cost)])
+                   for trial_id, params, result, cost in trials], fout, indent=2)
+    print("Sweep result has been written into file. %s" % (args.output))
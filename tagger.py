@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import torch
+from main import load_model, quantize_model, decode_instances
+from utils.data import Data
+
+
+class Tagger(object):
+    """
+        in-process tagging API, the dset and the model are loaded once and nothing is read or written afterwards:
+
+            tagger = Tagger("data/lstmcrf.dset", "data/lstmcrf.85.model")
+            labels, scores = tagger.tag([["Jan", "woont", "in", "Amsterdam"]])
+            labels, scores = tagger.tag(sentences, nbest=3)
+
+        1-best scores are the viterbi path score (unnormalized, log space) with CRF, else the log probability of
+        the label sequence. nbest scores (CRF models) are the probabilities of the nbest label sequences relative to
+        each other.
+    """
+
+    def __init__(self, dset_dir, load_model_dir, gpu=False, batch_size=None, quantize=False):
+        self.data = Data()
+        self.data.load(dset_dir)
+        self.data.dset_dir = dset_dir
+        self.data.load_model_dir = load_model_dir
+        self.data.HP_gpu = gpu
+        if batch_size:
+            self.data.HP_batch_size = batch_size
+        self.model = load_model(self.data)
+        if quantize and not gpu:
+            self.model = quantize_model(self.model)
+        self.model.eval()
+
+    def instances(self, sentences):
+        return self.data.instances_from_tokens(sentences)
+
+    def tag_instances(self, instances, nbest=None):
+        """
+            tag instances built by instances(), sentences are batched by length and returned in input order
+        """
+        ## empty sentences are not sent to the model, they get empty labels
+        order = sorted([idx for idx in range(len(instances)) if instances[idx][0]],
+                       key=lambda idx: len(instances[idx][0]))
+        sorted_instances = [instances[idx] for idx in order]
+        if not sorted_instances:
+            return [[] for _ in instances], [None for _ in instances]
+        if hasattr(torch, "no_grad"):
+            with torch.no_grad():
+                sorted_labels, sorted_scores = decode_instances(self.data, self.model, sorted_instances, nbest)
+        else:
+            sorted_labels, sorted_scores = decode_instances(self.data, self.model, sorted_instances, nbest)
+        labels = [[] for _ in instances]
+        scores = [None for _ in instances]
+        for position, idx in enumerate(order):
+            labels[idx] = sorted_labels[position]
+            scores[idx] = sorted_scores[position]
+        return labels, scores
+
+    def tag(self, sentences, nbest=None):
+        """
+            input:
+                sentences: list of token lists (unicode or utf-8 strings)
+                nbest: number of best label sequences, None for 1-best
+            output:
+                labels: [sent_num, each_sent_length], or [sent_num, nbest, each_sent_length] with nbest
+                scores: [sent_num, nbest] probability of each label sequence with nbest, else [sent_num] 1-best
+                        score, None for an empty sentence
+        """
+        if not sentences:
+            return [], []
+        return self.tag_instances(self.instances(sentences), nbest)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from main import BackgroundEvaluator
+from model.seqmodel import SeqModel
+from utils.checkpoint import CheckpointSaver
+from utils.eval_schedule import EvalScheduler
+from toy_data import toy_data
+
+
+class BackgroundEvaluatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_one_dev_evaluation(self):
+        data = toy_data(self.directory, async_eval="True", async_eval_threads="1")
+        label_alphabet_size = data.label_alphabet_size
+        ## built before the worker is forked, as in train()
+        model = SeqModel(data)
+        self.assertEqual(data.label_alphabet_size, label_alphabet_size)
+        scheduler = EvalScheduler(data)
+        saver = CheckpointSaver(data.checkpoint_keep)
+        evaluator = BackgroundEvaluator(data, scheduler.sample_instances)
+        evaluator.submit(model, scheduler, 0)
+        evaluator.close(scheduler, saver)
+        saver.close()
+        self.assertEqual(evaluator.process.exitcode, 0)
+        self.assertEqual(scheduler.dev_evaluations, 1)
+        self.assertEqual(scheduler.best_epoch, 0)
+        self.assertTrue(os.path.exists(data.model_dir + ".0.model"))
+
+
+if __name__ == '__main__':
+    unittest.main()
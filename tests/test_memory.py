@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import torch
+import torch.autograd as autograd
+from utils.memory import MemoryTracker, tensor_bytes
+
+
+class TrackerData(object):
+    memory_report = True
+    memory_top_batches = 5
+    HP_gpu = False
+
+
+class MemoryTrackerTest(unittest.TestCase):
+
+    def test_tensor_bytes_of_feature_list(self):
+        features = [autograd.Variable(torch.zeros(2, 3).long()), autograd.Variable(torch.zeros(2, 3).long())]
+        self.assertEqual(tensor_bytes(features), 2 * 6 * 8)
+        self.assertEqual(tensor_bytes([]), 0)
+
+    def test_one_batch(self):
+        tracker = MemoryTracker()
+        tracker.configure(TrackerData())
+        batch_word = autograd.Variable(torch.zeros(2, 4).long())
+        batch_features = [autograd.Variable(torch.zeros(2, 4).long())]
+        batch_char = autograd.Variable(torch.zeros(8, 5).long())
+        batch_trans = autograd.Variable(torch.zeros(8, 3).long())
+        batch_wordlen = torch.LongTensor([4, 3])
+        batch_label = autograd.Variable(torch.zeros(2, 4).long())
+        mask = autograd.Variable(torch.ones(2, 4).byte())
+        ## the argument order of the call sites in main.py
+        tracker.batch_begin(batch_word, batch_char, batch_trans, batch_features, batch_wordlen, batch_label, mask)
+        tracker.add("word_rep", autograd.Variable(torch.zeros(2, 4, 10)))
+        tracker.batch_end()
+        self.assertEqual(tracker.batch_num, 1)
+        self.assertEqual(tracker.largest[0][2], (2, 4, 5, 3))
+        self.assertEqual(tracker.largest[0][3]["input"], (8 + 8 + 40 + 24 + 2 + 8) * 8 + 8)
+        tracker.summary("test")
+        self.assertEqual(tracker.batch_num, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import json
+import shutil
+import httplib
+import tempfile
+import threading
+import unittest
+from server import MicroBatcher, TagHandler, ThreadingHTTPServer
+from tagger import Tagger
+from toy_data import toy_model_files
+
+
+class TagRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        tagger = Tagger(*toy_model_files(self.directory))
+        batcher = MicroBatcher(tagger, 8, 1, 16)
+        batcher.start()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), TagHandler)
+        self.server.data = tagger.data
+        self.server.tagger = tagger
+        self.server.batcher = batcher
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def post(self, body):
+        connection = httplib.HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=30)
+        connection.request("POST", "/tag", body)
+        response = connection.getresponse()
+        content = json.loads(response.read())
+        connection.close()
+        return response.status, content
+
+    def test_tag(self):
+        status, content = self.post(json.dumps({"sentences": [["Jan", "werkt", "in", "Utrecht"]]}))
+        self.assertEqual(status, 200)
+        self.assertEqual(len(content["labels"][0]), 4)
+        self.assertEqual(len(content["scores"]), 1)
+
+    def test_bad_requests(self):
+        for body in ["not json", json.dumps([]), json.dumps({"sentences": []}),
+                     json.dumps({"sentences": "Jan werkt"}), json.dumps({"sentences": ["Jan werkt"]}),
+                     json.dumps({"sentences": [["Jan", 3]]}), json.dumps({"sentences": [["Jan", ""]]}),
+                     json.dumps({"sentences": [[]]}), json.dumps({"sentences": [["Jan"]], "nbest": 0}),
+                     json.dumps({"sentences": [["Jan"]], "nbest": "2"})]:
+            status, content = self.post(body)
+            self.assertEqual(status, 400, body)
+            self.assertIn("error", content)
+        ## the server still answers after the rejected requests
+        self.assertEqual(self.post(json.dumps({"sentences": [["Het", "regent"]]}))[0], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
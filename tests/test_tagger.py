@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+from tagger import Tagger
+from toy_data import toy_model_files
+
+SENTENCES = [["Jan", "werkt", "in", "Utrecht"], ["Het", "regent"]]
+
+
+class TaggerScoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_one_best(self, use_crf):
+        tagger = Tagger(*toy_model_files(self.directory, use_crf=use_crf))
+        labels, scores = tagger.tag(SENTENCES)
+        self.assertEqual([len(sentence_labels) for sentence_labels in labels], [4, 2])
+        self.assertEqual(len(scores), len(SENTENCES))
+        for score in scores:
+            self.assertIsInstance(score, float)
+
+    def test_one_best_crf(self):
+        self.check_one_best("True")
+
+    def test_one_best_softmax(self):
+        self.check_one_best("False")
+
+    def test_nbest_one(self):
+        tagger = Tagger(*toy_model_files(self.directory))
+        labels, scores = tagger.tag(SENTENCES, nbest=1)
+        self.assertEqual([len(sentence_scores) for sentence_scores in scores], [1, 1])
+        self.assertEqual([len(sentence_labels[0]) for sentence_labels in labels], [4, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import os
+from utils.data import Data
+from main import prepare_train_data
+
+SENTENCES = [[("Jan", "B-PER"), ("woont", "O"), ("in", "O"), ("Amsterdam", "B-LOC")],
+             [("Marie", "B-PER"), ("werkt", "O"), ("in", "O"), ("Utrecht", "B-LOC"), (".", "O")],
+             [("Het", "O"), ("regent", "O")]]
+TRANSLATIONS = ["woont: lives", "werkt: works", "in: in", "regent: rains", "Het: It"]
+
+
+def write_toy_files(directory):
+    """
+        tiny BIO corpus (train = dev = test) and translation file in directory
+    """
+    corpus_file = os.path.join(directory, "toy.bio")
+    with open(corpus_file, 'w') as fout:
+        for sentence in SENTENCES:
+            for word, label in sentence:
+                fout.write("%s %s\n" % (word, label))
+            fout.write("\n")
+    trans_file = os.path.join(directory, "toy.trans")
+    with open(trans_file, 'w') as fout:
+        fout.write("\n".join(TRANSLATIONS) + "\n")
+    return corpus_file, trans_file
+
+
+def toy_data(directory, **config):
+    """
+        preprocessed Data of the toy corpus with a small model configuration, config: extra config items
+    """
+    corpus_file, trans_file = write_toy_files(directory)
+    data = Data()
+    items = {"train_dir": corpus_file, "dev_dir": corpus_file, "test_dir": corpus_file, "trans_dir": trans_file,
+             "model_dir": os.path.join(directory, "toy"), "word_emb_dim": "8", "char_emb_dim": "4",
+             "trans_emb_dim": "8", "char_hidden_dim": "4", "trans_hidden_dim": "8", "hidden_dim": "8",
+             "batch_size": "2", "iteration": "1"}
+    items.update(config)
+    data.set_config(items)
+    data.HP_gpu = False
+    prepare_train_data(data)
+    return data
+
+
+def toy_model_files(directory, **config):
+    """
+        .dset and an untrained .model file of the toy corpus, as written by training
+        output: dset path, model path
+    """
+    import torch
+    from model.seqmodel import SeqModel
+    data = toy_data(directory, **config)
+    dset_file = data.model_dir + ".dset"
+    data.save(dset_file)
+    model_file = data.model_dir + ".0.model"
+    torch.save(SeqModel(data).state_dict(), model_file)
+    return dset_file, model_file
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import numpy as np
+import torch
+import torch.autograd as autograd
+
+BUCKET_FIELDS = ["words", "labels", "lengths", "offsets", "chars", "char_lengths", "trans", "trans_lengths",
+                 "positions"]
+
+
+def pad_rows(rows):
+    """
+        rows: id lists of various length
+        output: (row_num, max_len) int64 array zero padded, (row_num,) lengths
+    """
+    lengths = np.array(map(len, rows), dtype=np.int64)
+    array = np.zeros((len(rows), lengths.max() if len(rows) else 0), dtype=np.int64)
+    if lengths.sum() > 0:
+        array[np.arange(array.shape[1]) < lengths[:, None]] = np.concatenate(rows)
+    return array, lengths
+
+
+def pack_rows(rows, lengths, volatile_flag):
+    """
+        the output of pack_word_rows (main.py) from padded rows: sorted by length (descending), recover index
+    """
+    perm = np.argsort(-lengths, kind='mergesort')
+    recover = np.argsort(perm)
+    rows = np.ascontiguousarray(rows[perm, :lengths.max()])
+    return autograd.Variable(torch.from_numpy(rows), volatile=volatile_flag), torch.from_numpy(lengths[perm]), \
+           torch.from_numpy(recover)
+
+
+class Bucket(object):
+    """
+        padded id arrays of sentences sorted by length (descending):
+            words, labels, features[idx]: (sent_num, max_sent_len), lengths: (sent_num,)
+            chars/trans: (word_num, max_len) one row per real word in sentence order, with their lengths.
+                         the words of sentence i are rows offsets[i]:offsets[i + 1]
+            positions: index of every sentence in the instance list the bucket was built from
+    """
+
+    def __init__(self, instances, positions):
+        self.words, self.lengths = pad_rows([instance[0] for instance in instances])
+        self.labels, _ = pad_rows([instance[4] for instance in instances])
+        feature_num = len(instances[0][1][0]) if instances[0][1] else 0
+        self.features = [pad_rows([[feature[idx] for feature in instance[1]] for instance in instances])[0]
+                         for idx in range(feature_num)]
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)]).astype(np.int64)
+        self.chars, self.char_lengths = pad_rows([word for instance in instances for word in instance[2]])
+        self.trans, self.trans_lengths = pad_rows([tran for instance in instances for tran in instance[3]])
+        self.positions = np.array(positions, dtype=np.int64)
+
+    def size(self):
+        return len(self.lengths)
+
+    def memmap(self, prefix):
+        """
+            write the arrays to prefix.<field>.npy and replace them by read-only memory maps of these files
+        """
+        names = BUCKET_FIELDS + ["features%s" % (idx) for idx in range(len(self.features))]
+        arrays = [getattr(self, name) for name in BUCKET_FIELDS] + self.features
+        mapped = []
+        for name, array in zip(names, arrays):
+            path = "%s.%s.npy" % (prefix, name)
+            np.save(path, array)
+            mapped.append(np.load(path, mmap_mode='r'))
+        for name, array in zip(BUCKET_FIELDS, mapped):
+            setattr(self, name, array)
+        self.features = mapped[len(BUCKET_FIELDS):]
+
+    def batch(self, idx, gpu, volatile_flag=False):
+        """
+            idx: sorted indexes of the sentences of the batch in this bucket
+            output: the tensors of batchify_with_label (main.py) for these sentences, which are already sorted, so
+            word_seq_recover is the identity: the batch order is the order of positions[idx]
+        """
+        lengths = self.lengths[idx]
+        max_len = lengths.max()
+        word_seq_tensor = autograd.Variable(torch.from_numpy(np.ascontiguousarray(self.words[idx, :max_len])),
+                                            volatile=volatile_flag)
+        label_seq_tensor = autograd.Variable(torch.from_numpy(np.ascontiguousarray(self.labels[idx, :max_len])),
+                                             volatile=volatile_flag)
+        feature_seq_tensors = [autograd.Variable(torch.from_numpy(np.ascontiguousarray(feature[idx, :max_len])),
+                                                 volatile=volatile_flag) for feature in self.features]
+        mask = autograd.Variable(torch.from_numpy((np.arange(max_len) < lengths[:, None]).astype(np.uint8)),
+                                 volatile=volatile_flag)
+        word_seq_lengths = torch.from_numpy(lengths)
+        word_seq_recover = torch.arange(0, len(idx)).long()
+        ## rows of the words of the batch, in sentence order
+        word_index = np.repeat(self.offsets[idx] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        char_seq_tensor, char_seq_lengths, char_seq_recover = pack_rows(self.chars[word_index],
+                                                                        self.char_lengths[word_index], volatile_flag)
+        trans_seq_tensor, trans_seq_lengths, trans_seq_recover = pack_rows(self.trans[word_index],
+                                                                           self.trans_lengths[word_index],
+                                                                           volatile_flag)
+        if gpu:
+            word_seq_tensor = word_seq_tensor.cuda()
+            feature_seq_tensors = [feature_seq_tensor.cuda() for feature_seq_tensor in feature_seq_tensors]
+            word_seq_lengths = word_seq_lengths.cuda()
+            word_seq_recover = word_seq_recover.cuda()
+            label_seq_tensor = label_seq_tensor.cuda()
+            char_seq_tensor = char_seq_tensor.cuda()
+            char_seq_recover = char_seq_recover.cuda()
+            trans_seq_tensor = trans_seq_tensor.cuda()
+            trans_seq_recover = trans_seq_recover.cuda()
+            mask = mask.cuda()
+        return word_seq_tensor, feature_seq_tensors, word_seq_lengths, word_seq_recover, \
+               char_seq_tensor, char_seq_lengths, char_seq_recover, \
+               label_seq_tensor, \
+               trans_seq_tensor, trans_seq_lengths, trans_seq_recover, mask
+
+
+class BatchCache(object):
+    """
+        instances collated once into padded arrays, batches are cut out of them with a few numpy gathers instead of
+        batchify_with_label on id lists. the instances are sorted by length and split into buckets of
+        bucket_batches * batch_size sentences. without regrouping the batches are fixed: consecutive sentences of a
+        bucket (length-sorted batches, as used for dev/test with bucket_batches=1). with cache_dir the arrays are
+        memory-mapped .npy files instead of process memory.
+    """
+
+    def __init__(self, instances, batch_size, bucket_batches=1, volatile_flag=False, cache_dir=None, name="batch"):
+        self.batch_size = batch_size
+        self.volatile_flag = volatile_flag
+        order = sorted(range(len(instances)), key=lambda position: -len(instances[position][0]))
+        bucket_size = batch_size * max(1, bucket_batches)
+        self.buckets = []
+        for start in range(0, len(order), bucket_size):
+            positions = order[start:start + bucket_size]
+            bucket = Bucket([instances[position] for position in positions], positions)
+            if cache_dir:
+                bucket.memmap(os.path.join(cache_dir, "%s.%s" % (name, len(self.buckets))))
+            self.buckets.append(bucket)
+
+    def batches(self, shuffle=False, regroup=False):
+        """
+            shuffle: shuffle the order of the batches, regroup: draw the sentences of the batches of each bucket anew
+            output: list of (bucket id, sorted sentence indexes in the bucket)
+        """
+        batches = []
+        for bucket_id, bucket in enumerate(self.buckets):
+            idx = range(bucket.size())
+            if regroup:
+                random.shuffle(idx)
+            for start in range(0, len(idx), self.batch_size):
+                batches.append((bucket_id, np.sort(np.array(idx[start:start + self.batch_size], dtype=np.int64))))
+        if shuffle:
+            random.shuffle(batches)
+        return batches
+
+    def collate(self, batch, gpu):
+        bucket_id, idx = batch
+        return self.buckets[bucket_id].batch(idx, gpu, self.volatile_flag)
+
+    def positions(self, batch):
+        bucket_id, idx = batch
+        return self.buckets[bucket_id].positions[idx]
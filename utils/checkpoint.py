@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import random
+import threading
+import Queue
+import numpy as np
+import torch
+
+
+def snapshot_state_dict(model):
+    """
+        copy of the model weights on cpu, training can go on while the copy is written
+    """
+    return dict((key, value.cpu().clone()) for key, value in model.state_dict().items())
+
+
+def rng_states(gpu=False):
+    states = {"random": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if gpu:
+        states["cuda"] = torch.cuda.get_rng_state()
+    return states
+
+
+def set_rng_states(states):
+    random.setstate(states["random"])
+    np.random.set_state(states["numpy"])
+    torch.set_rng_state(states["torch"])
+    if "cuda" in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state(states["cuda"])
+
+
+def atomic_save(obj, path):
+    """
+        write to a temporary file first and rename it, a crash never leaves a truncated file at path
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as fout:
+        torch.save(obj, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.rename(temp_path, path)
+
+
+def load_checkpoint(path):
+    return torch.load(path, map_location='cpu')
+
+
+class CheckpointSaver(object):
+    """
+        write model files and full-state checkpoints in a background thread.
+        best model files (state dict only, as loaded by decode) are ranked by dev score and only the top `keep`
+        files stay on disk (keep <= 0 keeps all), the full-state checkpoint for resuming is a single file
+        replaced at every save.
+    """
+
+    def __init__(self, keep=3, best_models=None):
+        self.keep = keep
+        self.best_models = list(best_models or [])  ## (score, path), best first
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            obj, path, removed_paths = job
+            atomic_save(obj, path)
+            ## old files are only removed once the new one is complete
+            for old_path in removed_paths:
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+                    print("Remove model file out of the top %s: %s" % (self.keep, old_path))
+
+    def save_model(self, state_dict, path, score):
+        ## a path saved again (several evaluations in one epoch) keeps only its latest score
+        self.best_models = [item for item in self.best_models if item[1] != path]
+        self.best_models.append((score, path))
+        self.best_models.sort(key=lambda item: -item[0])
+        removed_paths = []
+        while 0 < self.keep < len(self.best_models):
+            _, old_path = self.best_models.pop()
+            if old_path != path:
+                removed_paths.append(old_path)
+        self.queue.put((state_dict, path, removed_paths))
+
+    def save_checkpoint(self, checkpoint, path):
+        self.queue.put((checkpoint, path, []))
+
+    def close(self):
+        """
+            wait until all pending files are written
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+
+def build_checkpoint(model, optimizer, optimizer_wc, epoch, best_dev, best_models, train_order, gpu=False,
+                     eval_schedule=None):
+    """
+        full training state after `epoch`: weights, both optimizers, rng states, best dev score, the kept best
+        model files, the order of the training instances (indexes into the originally generated order) and the
+        evaluation scheduler state
+    """
+    return {"model": snapshot_state_dict(model),
+            "optimizer": copy.deepcopy(optimizer.state_dict()) if optimizer is not None else None,
+            "optimizer_wc": copy.deepcopy(optimizer_wc.state_dict()) if optimizer_wc is not None else None,
+            "epoch": epoch,
+            "best_dev": best_dev,
+            "best_models": list(best_models),
+            "rng": rng_states(gpu),
+            "train_order": train_order,
+            "eval_schedule": eval_schedule}
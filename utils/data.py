@@ -5,6 +5,7 @@ import sys
 import numpy as np
 from alphabet import Alphabet
 from functions import *
+from preprocess import parallel_build_alphabet, parallel_read_instance
 import cPickle as pickle
 
 START = "</s>"
@@ -15,9 +16,16 @@ PADDING = "</pad>"
 class Data:
     def __init__(self):
         self.MAX_SENTENCE_LENGTH = 250
-        self.MAX_WORD_LENGTH = -1
+        self.window_long_sentences = False  ## keep longer sentences, process them as overlapping windows
+        self.window_context = 25  ## words of overlap context on each side of a window
+        self.MAX_WORD_LENGTH = -1  ## longer words keep their first and last chars, -1: no truncation
+        self.MAX_TRANS_NUM = -1  ## translation candidates kept for each word, -1: all
         self.number_normalized = True
+        self.preprocess_workers = 1  ## processes for building the alphabet and reading instances, 1: no pool
         self.norm_word_emb = False
+        self.freeze_word_emb = False  ## keep the pretrained word embedding fixed
+        self.freeze_trans_emb = False  ## keep the pretrained translation embedding fixed
+        self.sparse_embedding = False  ## row-sparse gradients and optimizer for the word/translation embeddings
         self.norm_char_emb = False
         self.norm_trans_emb = False
         self.word_alphabet = Alphabet('word')
@@ -48,6 +56,7 @@ class Data:
         self.dset_dir = None  ## data vocabulary related file
         self.model_dir = None  ## model save  file
         self.load_model_dir = None  ## model load file
+        self.export_dir = None  ## compiled model file
 
         self.word_emb_dir = None
         self.char_emb_dir = None
@@ -84,19 +93,60 @@ class Data:
         self.trans_emb_dim = 100
 
         ###Networks
-        self.word_feature_extractor = "LSTM"  ## "LSTM"/"CNN"/"GRU"/
+        self.word_feature_extractor = "LSTM"  ## "LSTM"/"CNN"/"GRU"/"IDCNN"
         self.use_char = True
         self.char_seq_feature = "CNN"  ## "LSTM"/"CNN"/"GRU"/None
         self.use_trans = True
         self.use_crf = True
         self.nbest = None
+        self.quantize = False  ## dynamic int8 quantization in decode
+        self.decode_workers = 1  ## number of decode processes, each decodes one shard of the raw file
+        self.decode_threads = 0  ## intra-op threads per decode process, 0: cpu count / decode_workers
+
+        ### Server
+        self.serve_host = "127.0.0.1"
+        self.serve_port = 8000
+        self.serve_socket = None  ## unix socket path, used instead of host/port if set
+        self.serve_batch_size = 64  ## max sentences per micro-batch
+        self.serve_max_wait = 5  ## max milliseconds to wait for more requests before running a micro-batch
+        self.serve_queue_limit = 256  ## max waiting requests, new requests are rejected (503) beyond it
 
         ## Training
         self.average_batch_loss = False
         self.optimizer = "SGD"  ## "SGD"/"AdaGrad"/"AdaDelta"/"RMSProp"/"Adam"
         self.status = "train"
+        self.world_size = 1  ## number of local training processes, gradients are all-reduced on gloo
+        self.dist_init_method = "tcp://127.0.0.1:23456"
+        self.hogwild_workers = 1  ## number of lock-free training processes sharing the model in memory
+        self.hogwild_threads = 0  ## intra-op threads per hogwild process, 0: cpu count / hogwild_workers
+        self.checkpoint_keep = 3  ## number of best model files kept on disk, 0: keep all
+        self.resume_dir = None  ## full-state checkpoint to resume training from
+        self.eval_every_epochs = 1  ## evaluate dev after every n epochs (and after the last one)
+        self.eval_every_batches = 0  ## also evaluate dev every n training batches, 0: disabled
+        self.dev_sample = 0  ## number of dev sentences evaluated during the first dev_sample_epochs, 0: all
+        self.dev_sample_epochs = 0
+        self.test_on_improve = True  ## evaluate test only when dev improves
+        self.patience = 0  ## stop after n dev evaluations without improvement, 0: disabled
+        self.batch_cache = False  ## collate dev/test (fixed length-sorted batches) and train (buckets) only once
+        self.batch_cache_bucket = 4  ## training batches per bucket of length-sorted sentences
+        self.batch_cache_regroup = False  ## draw the sentences of the batches in every bucket anew each epoch
+        self.batch_cache_dir = None  ## directory for memory-mapped cache arrays, None: in memory
+        self.async_eval = False  ## evaluate weight snapshots in a background process while training goes on
+        self.async_eval_threads = 0  ## intra-op threads of the evaluation process, 0: cpu count / 2
+        self.telemetry = False  ## per-stage wall time summary after every epoch/decode
+        self.telemetry_log = None  ## JSONL file for stage times, evaluation results and profiler events
+        self.profile = None  ## None/"torch"/"cprofile": profile a window of batches
+        self.profile_start = 10  ## first profiled batch
+        self.profile_batches = 20  ## number of profiled batches
+        self.profile_output = "profile"  ## prefix of the profiler output files
+        self.memory_report = False  ## Data field sizes at startup, batch memory and peak RSS after every epoch
+        self.memory_top_batches = 5  ## number of largest batches listed in the memory report
+        self.padding_report = False  ## real vs padded cells of the word/char/trans tensors after every epoch
+        self.padding_worst_batches = 5  ## number of least efficient batches listed in the padding report
         ### Hyperparameters
         self.HP_cnn_layer = 4
+        self.HP_idcnn_dilations = [1, 2, 4]  ## dilations of the IDCNN block
+        self.HP_idcnn_iterations = 4  ## times the IDCNN block is applied, parameters are shared
         self.HP_iteration = 100
         self.HP_batch_size = 10
         self.HP_char_hidden_dim = 50
@@ -112,6 +162,7 @@ class Data:
         self.HP_clip = None
         self.HP_momentum = 0
         self.HP_l2 = 1e-8
+        self.HP_bf16 = False
 
     def show_data_summary(self):
         print("++" * 50)
@@ -119,8 +170,11 @@ class Data:
         print(" I/O:")
         print("     Tag          scheme: %s" % (self.tagScheme))
         print("     MAX SENTENCE LENGTH: %s" % (self.MAX_SENTENCE_LENGTH))
+        print("     Window long/context: %s/%s" % (self.window_long_sentences, self.window_context))
         print("     MAX   WORD   LENGTH: %s" % (self.MAX_WORD_LENGTH))
+        print("     MAX    TRANS    NUM: %s" % (self.MAX_TRANS_NUM))
         print("     Number   normalized: %s" % (self.number_normalized))
+        print("     Preprocess  workers: %s" % (self.preprocess_workers))
         print("     Word  alphabet size: %s" % (self.word_alphabet_size))
         print("     Char  alphabet size: %s" % (self.char_alphabet_size))
         print("     Label alphabet size: %s" % (self.label_alphabet_size))
@@ -132,6 +186,8 @@ class Data:
         print("     Char embedding size: %s" % (self.char_emb_dim))
         print("     Tran embedding size: %s" % (self.trans_emb_dim))
         print("     Norm   word     emb: %s" % (self.norm_word_emb))
+        print("     Freeze word/trans emb: %s/%s" % (self.freeze_word_emb, self.freeze_trans_emb))
+        print("     Sparse embedding grad: %s" % (self.sparse_embedding))
         print("     Norm   char     emb: %s" % (self.norm_char_emb))
         print("     Norm   tran     emb: %s" % (self.norm_trans_emb))
         print("     Train  file directory: %s" % (self.train_dir))
@@ -142,6 +198,7 @@ class Data:
         print("     Model  file directory: %s" % (self.model_dir))
         print("     Loadmodel   directory: %s" % (self.load_model_dir))
         print("     Decode file directory: %s" % (self.decode_dir))
+        print("     Export file directory: %s" % (self.export_dir))
         print("     Train instance number: %s" % (len(self.train_texts)))
         print("     Dev   instance number: %s" % (len(self.dev_texts)))
         print("     Test  instance number: %s" % (len(self.test_texts)))
@@ -172,6 +229,25 @@ class Data:
         print("     Iteration: %s" % (self.HP_iteration))
         print("     BatchSize: %s" % (self.HP_batch_size))
         print("     Average  batch   loss: %s" % (self.average_batch_loss))
+        print("     World          size: %s" % (self.world_size))
+        print("     Hogwild     workers: %s" % (self.hogwild_workers))
+        print("     Checkpoint     keep: %s" % (self.checkpoint_keep))
+        print("     Resume   checkpoint: %s" % (self.resume_dir))
+        print("     Eval   every epochs: %s" % (self.eval_every_epochs))
+        print("     Eval  every batches: %s" % (self.eval_every_batches))
+        print("     Dev   sample/epochs: %s/%s" % (self.dev_sample, self.dev_sample_epochs))
+        print("     Test   on   improve: %s" % (self.test_on_improve))
+        print("     Patience           : %s" % (self.patience))
+        print("     Async eval  /threads: %s/%s" % (self.async_eval, self.async_eval_threads))
+        print("     Batch cache  /bucket: %s/%s" % (self.batch_cache, self.batch_cache_bucket))
+        print("     Batch cache  regroup: %s" % (self.batch_cache_regroup))
+        print("     Batch cache      dir: %s" % (self.batch_cache_dir))
+        print("     Telemetry      /log: %s/%s" % (self.telemetry, self.telemetry_log))
+        print("     Profile  mode/start: %s/%s" % (self.profile, self.profile_start))
+        print("     Profile     batches: %s" % (self.profile_batches))
+        print("     Profile      output: %s" % (self.profile_output))
+        print("     Memory  report/top : %s/%s" % (self.memory_report, self.memory_top_batches))
+        print("     Padding report/top : %s/%s" % (self.padding_report, self.padding_worst_batches))
 
         print(" " + "++" * 20)
         print(" Hyperparameters:")
@@ -184,8 +260,12 @@ class Data:
         print("     Hyper      hidden_dim: %s" % (self.HP_hidden_dim))
         print("     Hyper         dropout: %s" % (self.HP_dropout))
         print("     Hyper      lstm_layer: %s" % (self.HP_lstm_layer))
+        if self.word_feature_extractor == "IDCNN":
+            print("     Hyper idcnn dilations: %s, iterations: %s" % (self.HP_idcnn_dilations,
+                                                                     self.HP_idcnn_iterations))
         print("     Hyper          bilstm: %s" % (self.HP_bilstm))
         print("     Hyper             GPU: %s" % (self.HP_gpu))
+        print("     Hyper            bf16: %s" % (self.HP_bf16))
         print("DATA SUMMARY END.")
         print("++" * 50)
         sys.stdout.flush()
@@ -217,22 +297,25 @@ class Data:
 
     def build_alphabet(self, input_file):
         print ("Build alphabet......")
-        in_lines = open(input_file, 'r').readlines()
-        for line in in_lines:
-            if len(line) > 2:
-                pairs = line.strip().split()
-                word = pairs[0].decode('utf-8')
-                if self.number_normalized:
-                    word = normalize_word(word)
-                label = pairs[-1]
-                self.label_alphabet.add(label)
-                self.word_alphabet.add(word)
-                ## build feature alphabet 
-                for idx in range(self.feature_num):
-                    feat_idx = pairs[idx + 1].split(']', 1)[-1]
-                    self.feature_alphabets[idx].add(feat_idx)
-                for char in word:
-                    self.char_alphabet.add(char)
+        if self.preprocess_workers > 1:
+            parallel_build_alphabet(self, input_file)
+        else:
+            in_lines = open(input_file, 'r').readlines()
+            for line in in_lines:
+                if len(line) > 2:
+                    pairs = line.strip().split()
+                    word = pairs[0].decode('utf-8')
+                    if self.number_normalized:
+                        word = normalize_word(word)
+                    label = pairs[-1]
+                    self.label_alphabet.add(label)
+                    self.word_alphabet.add(word)
+                    ## build feature alphabet 
+                    for idx in range(self.feature_num):
+                        feat_idx = pairs[idx + 1].split(']', 1)[-1]
+                        self.feature_alphabets[idx].add(feat_idx)
+                    for char in word:
+                        self.char_alphabet.add(char)
         self.word_alphabet_size = self.word_alphabet.size()
         self.char_alphabet_size = self.char_alphabet.size()
         self.label_alphabet_size = self.label_alphabet.size()
@@ -287,31 +370,64 @@ class Data:
                     self.feature_emb_dirs[idx], self.feature_alphabets[idx], self.feature_emb_dims[idx],
                     self.norm_feature_embs[idx])
 
+    def sentence_length_limit(self):
+        """
+            sentences of this many words or more are dropped while reading, -1: none are (they are split into
+            windows later)
+        """
+        if self.window_long_sentences:
+            return -1
+        return self.MAX_SENTENCE_LENGTH
+
+    def read_instance_file(self, input_file):
+        """
+            read_instance with the settings of this Data, in preprocess_workers processes if more than one
+        """
+        if self.preprocess_workers > 1:
+            return parallel_read_instance(self, input_file)
+        return read_instance(input_file, self.word_alphabet, self.char_alphabet, self.feature_alphabets,
+                             self.label_alphabet, self.number_normalized, self.sentence_length_limit(),
+                             self.translation_id_format, max_word_length=self.MAX_WORD_LENGTH)
+
     def generate_instance(self, name):
         self.fix_alphabet()
         if name == "train":
-            self.train_texts, self.train_Ids = read_instance(self.train_dir, self.word_alphabet, self.char_alphabet,
-                                                             self.feature_alphabets, self.label_alphabet,
-                                                             self.number_normalized, self.MAX_SENTENCE_LENGTH,
-                                                             self.translation_id_format)
+            self.train_texts, self.train_Ids = self.read_instance_file(self.train_dir)
         elif name == "dev":
-            self.dev_texts, self.dev_Ids = read_instance(self.dev_dir, self.word_alphabet, self.char_alphabet,
-                                                         self.feature_alphabets, self.label_alphabet,
-                                                         self.number_normalized, self.MAX_SENTENCE_LENGTH,
-                                                         self.translation_id_format)
+            self.dev_texts, self.dev_Ids = self.read_instance_file(self.dev_dir)
         elif name == "test":
-            self.test_texts, self.test_Ids = read_instance(self.test_dir, self.word_alphabet, self.char_alphabet,
-                                                           self.feature_alphabets, self.label_alphabet,
-                                                           self.number_normalized, self.MAX_SENTENCE_LENGTH,
-                                                           self.translation_id_format)
+            self.test_texts, self.test_Ids = self.read_instance_file(self.test_dir)
         elif name == "raw":
-            self.raw_texts, self.raw_Ids = read_instance(self.raw_dir, self.word_alphabet, self.char_alphabet,
-                                                         self.feature_alphabets, self.label_alphabet,
-                                                         self.number_normalized, self.MAX_SENTENCE_LENGTH,
-                                                         self.translation_id_format)
+            self.raw_texts, self.raw_Ids = self.read_instance_file(self.raw_dir)
         else:
             print("Error: you can only generate train/dev/test instance! Illegal input:%s" % (name))
 
+    def instances_from_tokens(self, sentences):
+        """
+            build instances from tokenized sentences in memory, in the same format as generate_instance.
+            sentences: list of token lists, tokens are unicode or utf-8 strings. Feature columns are not given,
+            so features get the unknown id, and labels are set to 0 (no gold label).
+        """
+        instances = []
+        for tokens in sentences:
+            word_Ids = []
+            feature_Ids = []
+            char_Ids = []
+            translation_Ids = []
+            for token in tokens:
+                word = token if isinstance(token, unicode) else token.decode('utf-8')
+                if self.number_normalized:
+                    word = normalize_word(word)
+                word_id = self.word_alphabet.get_index(word)
+                word_Ids.append(word_id)
+                feature_Ids.append([self.feature_alphabets[idx].get_index(self.feature_alphabets[idx].UNKNOWN)
+                                    for idx in range(self.feature_num)])
+                char_Ids.append([self.char_alphabet.get_index(char)
+                                 for char in truncate_word(list(word), self.MAX_WORD_LENGTH)])
+                translation_Ids.append(self.translation_id_format.get(word_id, [0]))
+            instances.append([word_Ids, feature_Ids, char_Ids, translation_Ids, [0] * len(word_Ids)])
+        return instances
+
     def write_decoded_results(self, predict_results, name):
         fout = open(self.decode_dir, 'w')
         sent_num = len(predict_results)
@@ -365,6 +481,7 @@ class Data:
             print("Error: illegal name during writing predict result, name should be within train/dev/test/raw !")
         assert (sent_num == len(content_list))
         assert (sent_num == len(pred_scores))
+        nbest = self.nbest
         for idx in range(sent_num):
             sent_length = len(predict_results[idx][0])
             nbest = len(predict_results[idx])
@@ -384,7 +501,12 @@ class Data:
         print("Predict %s %s-best result has been written into file. %s" % (name, nbest, self.decode_dir))
 
     def read_config(self, config_file):
-        config = config_file_to_dict(config_file)
+        self.set_config(config_file_to_dict(config_file))
+
+    def set_config(self, config):
+        """
+            config: dict of config item name to its string value (as in the config file)
+        """
         ## read data:
         the_item = 'train_dir'
         if the_item in config:
@@ -415,6 +537,9 @@ class Data:
         the_item = 'load_model_dir'
         if the_item in config:
             self.load_model_dir = config[the_item]
+        the_item = 'export_dir'
+        if the_item in config:
+            self.export_dir = config[the_item]
 
         the_item = 'word_emb_dir'
         if the_item in config:
@@ -429,19 +554,40 @@ class Data:
         the_item = 'MAX_SENTENCE_LENGTH'
         if the_item in config:
             self.MAX_SENTENCE_LENGTH = int(config[the_item])
+        the_item = 'window_long_sentences'
+        if the_item in config:
+            self.window_long_sentences = str2bool(config[the_item])
+        the_item = 'window_context'
+        if the_item in config:
+            self.window_context = int(config[the_item])
         the_item = 'MAX_WORD_LENGTH'
         if the_item in config:
             self.MAX_WORD_LENGTH = int(config[the_item])
+        the_item = 'MAX_TRANS_NUM'
+        if the_item in config:
+            self.MAX_TRANS_NUM = int(config[the_item])
 
         the_item = 'norm_word_emb'
         if the_item in config:
             self.norm_word_emb = str2bool(config[the_item])
+        the_item = 'freeze_word_emb'
+        if the_item in config:
+            self.freeze_word_emb = str2bool(config[the_item])
+        the_item = 'freeze_trans_emb'
+        if the_item in config:
+            self.freeze_trans_emb = str2bool(config[the_item])
+        the_item = 'sparse_embedding'
+        if the_item in config:
+            self.sparse_embedding = str2bool(config[the_item])
         the_item = 'norm_char_emb'
         if the_item in config:
             self.norm_char_emb = str2bool(config[the_item])
         the_item = 'number_normalized'
         if the_item in config:
             self.number_normalized = str2bool(config[the_item])
+        the_item = 'preprocess_workers'
+        if the_item in config:
+            self.preprocess_workers = int(config[the_item])
 
         the_item = 'seg'
         if the_item in config:
@@ -475,6 +621,35 @@ class Data:
         the_item = 'nbest'
         if the_item in config:
             self.nbest = int(config[the_item])
+        the_item = 'quantize'
+        if the_item in config:
+            self.quantize = str2bool(config[the_item])
+        the_item = 'decode_workers'
+        if the_item in config:
+            self.decode_workers = int(config[the_item])
+        the_item = 'decode_threads'
+        if the_item in config:
+            self.decode_threads = int(config[the_item])
+
+        ## read server setting:
+        the_item = 'serve_host'
+        if the_item in config:
+            self.serve_host = config[the_item]
+        the_item = 'serve_port'
+        if the_item in config:
+            self.serve_port = int(config[the_item])
+        the_item = 'serve_socket'
+        if the_item in config:
+            self.serve_socket = config[the_item]
+        the_item = 'serve_batch_size'
+        if the_item in config:
+            self.serve_batch_size = int(config[the_item])
+        the_item = 'serve_max_wait'
+        if the_item in config:
+            self.serve_max_wait = float(config[the_item])
+        the_item = 'serve_queue_limit'
+        if the_item in config:
+            self.serve_queue_limit = int(config[the_item])
 
         the_item = 'feature'
         if the_item in config:
@@ -490,11 +665,103 @@ class Data:
         the_item = 'status'
         if the_item in config:
             self.status = config[the_item]
+        the_item = 'world_size'
+        if the_item in config:
+            self.world_size = int(config[the_item])
+        the_item = 'dist_init_method'
+        if the_item in config:
+            self.dist_init_method = config[the_item]
+        the_item = 'hogwild_workers'
+        if the_item in config:
+            self.hogwild_workers = int(config[the_item])
+        the_item = 'hogwild_threads'
+        if the_item in config:
+            self.hogwild_threads = int(config[the_item])
+        the_item = 'checkpoint_keep'
+        if the_item in config:
+            self.checkpoint_keep = int(config[the_item])
+        the_item = 'resume_dir'
+        if the_item in config:
+            self.resume_dir = config[the_item]
+        the_item = 'eval_every_epochs'
+        if the_item in config:
+            self.eval_every_epochs = int(config[the_item])
+        the_item = 'eval_every_batches'
+        if the_item in config:
+            self.eval_every_batches = int(config[the_item])
+        the_item = 'dev_sample'
+        if the_item in config:
+            self.dev_sample = int(config[the_item])
+        the_item = 'dev_sample_epochs'
+        if the_item in config:
+            self.dev_sample_epochs = int(config[the_item])
+        the_item = 'test_on_improve'
+        if the_item in config:
+            self.test_on_improve = str2bool(config[the_item])
+        the_item = 'patience'
+        if the_item in config:
+            self.patience = int(config[the_item])
+        the_item = 'batch_cache'
+        if the_item in config:
+            self.batch_cache = str2bool(config[the_item])
+        the_item = 'batch_cache_bucket'
+        if the_item in config:
+            self.batch_cache_bucket = int(config[the_item])
+        the_item = 'batch_cache_regroup'
+        if the_item in config:
+            self.batch_cache_regroup = str2bool(config[the_item])
+        the_item = 'batch_cache_dir'
+        if the_item in config:
+            self.batch_cache_dir = config[the_item]
+        the_item = 'async_eval'
+        if the_item in config:
+            self.async_eval = str2bool(config[the_item])
+        the_item = 'async_eval_threads'
+        if the_item in config:
+            self.async_eval_threads = int(config[the_item])
+        the_item = 'telemetry'
+        if the_item in config:
+            self.telemetry = str2bool(config[the_item])
+        the_item = 'telemetry_log'
+        if the_item in config:
+            self.telemetry_log = config[the_item]
+        the_item = 'profile'
+        if the_item in config:
+            self.profile = config[the_item].lower()
+            if self.profile not in ("torch", "cprofile"):
+                self.profile = None
+        the_item = 'profile_start'
+        if the_item in config:
+            self.profile_start = int(config[the_item])
+        the_item = 'profile_batches'
+        if the_item in config:
+            self.profile_batches = int(config[the_item])
+        the_item = 'profile_output'
+        if the_item in config:
+            self.profile_output = config[the_item]
+        the_item = 'memory_report'
+        if the_item in config:
+            self.memory_report = str2bool(config[the_item])
+        the_item = 'memory_top_batches'
+        if the_item in config:
+            self.memory_top_batches = int(config[the_item])
+        the_item = 'padding_report'
+        if the_item in config:
+            self.padding_report = str2bool(config[the_item])
+        the_item = 'padding_worst_batches'
+        if the_item in config:
+            self.padding_worst_batches = int(config[the_item])
 
         ## read Hyperparameters:
         the_item = 'cnn_layer'
         if the_item in config:
             self.HP_cnn_layer = int(config[the_item])
+        the_item = 'idcnn_dilations'
+        if the_item in config:
+            self.HP_idcnn_dilations = [int(dilation) for dilation in config[the_item].split(',')]
+        the_item = 'idcnn_iterations'
+        if the_item in config:
+            self.HP_idcnn_iterations = int(config[the_item])
         the_item = 'iteration'
         if the_item in config:
             self.HP_iteration = int(config[the_item])
@@ -541,6 +808,9 @@ class Data:
         the_item = 'l2'
         if the_item in config:
             self.HP_l2 = float(config[the_item])
+        the_item = 'bf16'
+        if the_item in config:
+            self.HP_bf16 = str2bool(config[the_item])
 
     def build_translation_alphabet(self, trans_path):
         print("Creating translation alphabet......")
@@ -550,6 +820,8 @@ class Data:
                 if len(line.strip().split(":")) == 2:
                     temp = line.strip().split(":", 1)
                     words = temp[1].split()
+                    if self.MAX_TRANS_NUM > 0:
+                        words = words[:self.MAX_TRANS_NUM]
                     for word in words:
                         self.translation_alphabet.add(word.strip())
         self.trans_alphabet_size = self.translation_alphabet.size()
@@ -565,6 +837,8 @@ class Data:
                     temp = line.strip().split(":")
                     word_id = self.word_alphabet.get_index(temp[0].strip())
                     translations = temp[1].split()
+                    if self.MAX_TRANS_NUM > 0:
+                        translations = translations[:self.MAX_TRANS_NUM]
                     for translation in translations:
                         ids.append(self.translation_alphabet.get_index(translation.strip()))
                     translation_id_format_temp[word_id] = ids
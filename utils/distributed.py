@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import random
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(data, rank):
+    print("Init process group, backend: gloo, rank: %s/%s, method: %s" % (rank, data.world_size,
+                                                                         data.dist_init_method))
+    dist.init_process_group("gloo", init_method=data.dist_init_method, world_size=data.world_size, rank=rank)
+
+
+def broadcast_model(model):
+    """
+        copy parameters and buffers of rank 0 to all ranks, so every rank starts from the same model
+    """
+    for tensor in model.state_dict().values():
+        dist.broadcast(tensor, 0)
+
+
+def broadcast_flag(flag):
+    """
+        send a boolean decision of rank 0 (e.g. early stopping) to all ranks
+    """
+    tensor = torch.IntTensor([int(flag)])
+    dist.broadcast(tensor, 0)
+    return bool(tensor[0])
+
+
+def average_gradients(parameters, world_size):
+    """
+        all-reduce the gradients of the trainable parameters in one flattened buffer and average them.
+        parameters without gradient in this step (requires_grad=False) are skipped on every rank.
+    """
+    params = [param for param in parameters if param.requires_grad]
+    if not params:
+        return
+    grads = []
+    for param in params:
+        if param.grad is None:
+            grads.append(param.data.new(param.data.numel()).zero_())
+        else:
+            grads.append(param.grad.data.contiguous().view(-1))
+    flat_grad = torch.cat(grads)
+    dist.all_reduce(flat_grad)
+    flat_grad /= world_size
+    offset = 0
+    for param in params:
+        numel = param.data.numel()
+        if param.grad is not None:
+            param.grad.data.copy_(flat_grad[offset:offset + numel].view_as(param.grad.data))
+        offset += numel
+
+
+def shard_instances(instances, epoch, seed, rank, world_size):
+    """
+        shuffle the instances with the same seed on every rank, and return the disjoint shard of this rank.
+        every shard has the same size so that all ranks run the same number of batches, the remainder
+        (less than world_size sentences) is left out of this epoch.
+    """
+    random.Random(seed + epoch).shuffle(instances)
+    shard_size = len(instances) // world_size
+    return instances[rank * shard_size:(rank + 1) * shard_size]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+
+class EvalScheduler(object):
+    """
+        decide when dev/test are evaluated during training and keep the early stopping state.
+            dev: after every `eval_every_epochs` epochs (and the last one), and every `eval_every_batches`
+                 training batches if > 0. During the first `dev_sample_epochs` epochs only a fixed random
+                 subsample of `dev_sample` sentences is evaluated.
+            test: only when the dev score improves (every dev evaluation if test_on_improve is False).
+            early stopping: after `patience` full dev evaluations without improvement (0 disables it).
+        subsample and full dev scores are not comparable: the subsample keeps its own best score, only for
+        progress output, and neither counts against patience nor selects (saves) models.
+    """
+
+    def __init__(self, data, seed=42):
+        self.every_epochs = max(1, data.eval_every_epochs)
+        self.every_batches = data.eval_every_batches
+        self.test_on_improve = data.test_on_improve
+        self.patience = data.patience
+        self.iteration = data.HP_iteration
+        self.dev_instances = data.dev_Ids
+        self.test_num = len(data.test_Ids)
+        self.sample_epochs = data.dev_sample_epochs
+        self.sample_instances = data.dev_Ids
+        if 0 < data.dev_sample < len(data.dev_Ids):
+            self.sample_instances = random.Random(seed).sample(data.dev_Ids, data.dev_sample)
+        self.best_dev = -10
+        self.best_sample_dev = -10
+        self.best_epoch = None  ## epoch of the best full dev score
+        self.best_test = None  ## test score of the weights with the best full dev score, if test was evaluated
+        self.bad_evaluations = 0
+        self.improved = False  ## result of the latest update()
+        self.stopped = False
+        self.batch_count = 0
+        self.batches_since_eval = 0
+        ## accounting against evaluating full dev and test after every epoch
+        self.dev_evaluations = 0
+        self.test_evaluations = 0
+        self.evaluated_sentences = 0
+        self.baseline_sentences = 0
+        self.eval_time = 0.
+
+    def sampled(self, epoch):
+        return epoch < self.sample_epochs and len(self.sample_instances) < len(self.dev_instances)
+
+    def dev_set(self, epoch):
+        if self.sampled(epoch):
+            return self.sample_instances
+        return self.dev_instances
+
+    def batch_due(self):
+        """
+            called after every training batch
+        """
+        self.batch_count += 1
+        self.batches_since_eval += 1
+        return self.every_batches > 0 and self.batch_count % self.every_batches == 0
+
+    def epoch_due(self, epoch):
+        """
+            called after every training epoch
+        """
+        self.baseline_sentences += len(self.dev_instances) + self.test_num
+        ## the last batch of this epoch has just been evaluated
+        if self.every_batches > 0 and self.batches_since_eval == 0:
+            return False
+        return (epoch + 1) % self.every_epochs == 0 or epoch + 1 == self.iteration
+
+    def evaluated(self):
+        """
+            called when the current weights are evaluated (or submitted for a background evaluation)
+        """
+        self.batches_since_eval = 0
+
+    def update(self, epoch, score):
+        """
+            record a dev score, return True if it improves the best score of its (sampled or full) dev set
+        """
+        if self.sampled(epoch):
+            improved = score > self.best_sample_dev
+            if improved:
+                self.best_sample_dev = score
+            self.improved = improved
+            return improved
+        improved = score > self.best_dev
+        if improved:
+            self.best_dev = score
+            self.best_epoch = epoch
+            self.best_test = None
+            self.bad_evaluations = 0
+        else:
+            self.bad_evaluations += 1
+            if 0 < self.patience <= self.bad_evaluations:
+                self.stopped = True
+        self.improved = improved
+        return improved
+
+    def test_due(self, improved):
+        return improved or not self.test_on_improve
+
+    def test_score(self, epoch, score):
+        if epoch == self.best_epoch:
+            self.best_test = score
+
+    def record(self, name, sent_num, seconds):
+        if name == "test":
+            self.test_evaluations += 1
+        else:
+            self.dev_evaluations += 1
+        self.evaluated_sentences += sent_num
+        self.eval_time += seconds
+
+    def report(self):
+        sent_cost = self.eval_time / max(self.evaluated_sentences, 1)
+        saved = (self.baseline_sentences - self.evaluated_sentences) * sent_cost
+        print("Evaluation: dev %s times, test %s times, %s sentences, time: %.2fs; estimated time saved: %.2fs" % (
+            self.dev_evaluations, self.test_evaluations, self.evaluated_sentences, self.eval_time, saved))
+
+    def state_dict(self):
+        return {"best_dev": self.best_dev, "best_sample_dev": self.best_sample_dev,
+                "bad_evaluations": self.bad_evaluations, "batch_count": self.batch_count,
+                "best_epoch": self.best_epoch, "best_test": self.best_test}
+
+    def load_state_dict(self, state):
+        self.best_dev = state["best_dev"]
+        self.best_sample_dev = state["best_sample_dev"]
+        self.bad_evaluations = state["bad_evaluations"]
+        self.batch_count = state["batch_count"]
+        self.best_epoch = state.get("best_epoch")
+        self.best_test = state.get("best_test")
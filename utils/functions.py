@@ -5,7 +5,21 @@ import numpy as np
 from alphabet import Alphabet
 
 
+_digit_table = {}
+
+
+def digit_table():
+    """
+        unicode.translate table mapping every code point with isdigit() to u'0', built once on first use
+    """
+    if not _digit_table:
+        _digit_table.update((code, u'0') for code in xrange(sys.maxunicode + 1) if unichr(code).isdigit())
+    return _digit_table
+
+
 def normalize_word(word):
+    if isinstance(word, unicode):
+        return word.translate(digit_table())
     new_word = ""
     for char in word:
         if char.isdigit():
@@ -15,10 +29,33 @@ def normalize_word(word):
     return new_word
 
 
+def truncate_word(chars, max_word_length):
+    """
+        keep the first (max_word_length + 1) // 2 and the last max_word_length // 2 chars of overlong words,
+        prefixes and suffixes carry most of the char features. max_word_length <= 0: no truncation
+    """
+    if max_word_length <= 0 or len(chars) <= max_word_length:
+        return chars
+    tail = max_word_length // 2
+    return chars[:max_word_length - tail] + chars[len(chars) - tail:]
+
+
 def read_instance(input_file, word_alphabet, char_alphabet, feature_alphabets, label_alphabet, number_normalized,
-                  max_sent_length, translation_id_format, char_padding_size=-1, char_padding_symbol='</pad>', ):
-    feature_num = len(feature_alphabets)
+                  max_sent_length, translation_id_format, char_padding_size=-1, char_padding_symbol='</pad>',
+                  max_word_length=-1):
     in_lines = open(input_file, 'r').readlines()
+    return parse_instances(in_lines, word_alphabet, char_alphabet, feature_alphabets, label_alphabet,
+                           number_normalized, max_sent_length, translation_id_format, char_padding_size,
+                           char_padding_symbol, max_word_length)
+
+
+def parse_instances(in_lines, word_alphabet, char_alphabet, feature_alphabets, label_alphabet, number_normalized,
+                    max_sent_length, translation_id_format, char_padding_size=-1, char_padding_symbol='</pad>',
+                    max_word_length=-1):
+    """
+        read_instance on lines already in memory, e.g. one shard of a CoNLL file
+    """
+    feature_num = len(feature_alphabets)
     instence_texts = []
     instence_Ids = []
     words = []
@@ -55,6 +92,7 @@ def read_instance(input_file, word_alphabet, char_alphabet, feature_alphabets, l
             char_Id = []
             for char in word:
                 char_list.append(char)
+            char_list = truncate_word(char_list, max_word_length)
             if char_padding_size > 0:
                 char_number = len(char_list)
                 if char_number < char_padding_size:
@@ -93,26 +131,28 @@ def build_pretrain_embedding(embedding_path, word_alphabet, embedd_dim=100, norm
         embedd_dict, embedd_dim = load_pretrain_emb(embedding_path)
     alphabet_size = word_alphabet.size()
     scale = np.sqrt(3.0 / embedd_dim)
-    pretrain_emb = np.empty([word_alphabet.size(), embedd_dim])
+    ## float32 like the model parameters, row 0 (padding) is zero
+    pretrain_emb = np.zeros([word_alphabet.size(), embedd_dim], dtype=np.float32)
     perfect_match = 0
     case_match = 0
-    not_match = 0
+    matched = []
+    oov = []
     for word, index in word_alphabet.iteritems():
         if word in embedd_dict:
-            if norm:
-                pretrain_emb[index, :] = norm2one(embedd_dict[word])
-            else:
-                pretrain_emb[index, :] = embedd_dict[word]
+            pretrain_emb[index, :] = embedd_dict[word]
             perfect_match += 1
+            matched.append(index)
         elif word.lower() in embedd_dict:
-            if norm:
-                pretrain_emb[index, :] = norm2one(embedd_dict[word.lower()])
-            else:
-                pretrain_emb[index, :] = embedd_dict[word.lower()]
+            pretrain_emb[index, :] = embedd_dict[word.lower()]
             case_match += 1
+            matched.append(index)
         else:
-            pretrain_emb[index, :] = np.random.uniform(-scale, scale, [1, embedd_dim])
-            not_match += 1
+            oov.append(index)
+    if norm and matched:
+        pretrain_emb[matched] /= np.sqrt(np.sum(np.square(pretrain_emb[matched]), axis=1, keepdims=True))
+    ## one draw in the same order as the row by row init
+    pretrain_emb[oov] = np.random.uniform(-scale, scale, [len(oov), embedd_dim])
+    not_match = len(oov)
     pretrained_size = len(embedd_dict)
     print("Embedding:\n     pretrain word:%s, prefect match:%s, case_match:%s, oov:%s, oov%%:%s" % (
         pretrained_size, perfect_match, case_match, not_match, (not_match + 0.) / alphabet_size))
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import heapq
+import resource
+import numpy as np
+from collections import OrderedDict
+from utils.telemetry import telemetry
+
+MB = 1024. * 1024.
+
+
+def tensor_bytes(tensor):
+    """
+        bytes of a Tensor/Variable (numel * element size), 0 for None, summed over lists/tuples of them
+        (batch_features)
+    """
+    if tensor is None:
+        return 0
+    if isinstance(tensor, (list, tuple)):
+        return sum(tensor_bytes(item) for item in tensor)
+    if hasattr(tensor, "data") and not hasattr(tensor, "element_size"):
+        tensor = tensor.data
+    if hasattr(tensor, "element_size"):
+        return tensor.numel() * tensor.element_size()
+    return tensor.numel() * tensor.storage().element_size()
+
+
+def deep_size(obj, seen=None):
+    """
+        recursive host memory of obj: containers, their items and object __dict__s, numpy arrays by nbytes.
+        objects already in seen (by id) are not counted again, so shared strings/lists are charged once.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, np.ndarray):
+            total += sys.getsizeof(item)
+            if item.base is None:
+                total += item.nbytes
+            if item.dtype == object:
+                stack.extend(item.ravel())
+            continue
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__") and not isinstance(item, type):
+            stack.append(item.__dict__)
+    return total
+
+
+def describe(value):
+    if isinstance(value, np.ndarray):
+        return "ndarray %s %s" % (value.dtype, "x".join(str(dim) for dim in value.shape))
+    if isinstance(value, (list, tuple, dict)):
+        return "%s of %s" % (type(value).__name__, len(value))
+    return type(value).__name__
+
+
+def process_memory():
+    """
+        output: (current RSS, peak RSS) of this process in bytes.
+        the peak is VmHWM of /proc/self/status, which reset_peak() can restart on linux; ru_maxrss otherwise.
+    """
+    current, peak = 0, 0
+    try:
+        with open("/proc/self/status") as fin:
+            for line in fin:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    if peak == 0:
+        ## kilobytes on linux, bytes on mac
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak *= 1024
+    return current, peak
+
+
+def reset_peak():
+    """
+        restart the peak RSS measurement (linux >= 4.0), return False if it is not supported
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fout:
+            fout.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+class MemoryTracker(object):
+    """
+        memory accounting of preprocessing, batches and training.
+            data_report: deep size of every Data field and of the saved .dset pickle.
+            batches: input tensors plus the activations the model reports through add() ("word_rep", "crf"),
+                     summed per batch. summary() prints the peak batch, the largest batches and the peak RSS
+                     (and peak cuda memory) since the previous summary.
+        disabled (the default) add()/batch_begin()/batch_end() return immediately.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.gpu = False
+        self.top = 5
+        self.batch_parts = OrderedDict()
+        self.batch_shape = None
+        self.batch_count = 0
+        self.batch_num = 0
+        self.batch_total = 0
+        self.largest = []  ## heap of (bytes, batch number, shape, parts)
+        self.peak_resettable = False
+
+    def configure(self, data):
+        self.enabled = data.memory_report
+        self.gpu = data.HP_gpu
+        self.top = data.memory_top_batches
+        if self.enabled:
+            self.peak_resettable = reset_peak()
+
+    def add(self, name, *tensors):
+        if not self.enabled or self.batch_shape is None:
+            return
+        self.batch_parts[name] = self.batch_parts.get(name, 0) + sum(tensor_bytes(tensor) for tensor in tensors)
+
+    def batch_begin(self, *tensors):
+        """
+            tensors: the batchified input tensors, word_inputs (batch, seq_len), char_inputs (word_num, word_len)
+            and trans_inputs (word_num, trans_len) first
+        """
+        if not self.enabled:
+            return
+        word_inputs, char_inputs, trans_inputs = tensors[:3]
+        self.batch_shape = (word_inputs.size(0), word_inputs.size(1), char_inputs.size(1), trans_inputs.size(1))
+        self.batch_parts = OrderedDict()
+        self.add("input", *tensors)
+
+    def batch_end(self):
+        if not self.enabled or self.batch_shape is None:
+            return
+        total = sum(self.batch_parts.values())
+        self.batch_count += 1
+        self.batch_num += 1
+        self.batch_total += total
+        record = (total, self.batch_count, self.batch_shape, self.batch_parts)
+        if len(self.largest) < self.top:
+            heapq.heappush(self.largest, record)
+        elif self.top > 0 and total > self.largest[0][0]:
+            heapq.heapreplace(self.largest, record)
+        self.batch_shape = None
+
+    def data_report(self, data, dset_file=None):
+        """
+            print the host memory of every Data field (largest first) and the .dset size, log a "data_memory" event
+        """
+        if not self.enabled:
+            return
+        seen = set()
+        fields = []
+        for name, value in sorted(data.__dict__.items()):
+            fields.append((deep_size(value, seen), name, describe(value)))
+        fields.sort(reverse=True)
+        total = sum(size for size, _, _ in fields)
+        print("Data memory: %.1fMB" % (total / MB))
+        print("     %-32s %10s  %s" % ("field", "MB", "type"))
+        for size, name, description in fields:
+            if size < 0.01 * MB:
+                break
+            print("     %-32s %10.2f  %s" % (name, size / MB, description))
+        dset_size = None
+        if dset_file and os.path.exists(dset_file):
+            dset_size = os.path.getsize(dset_file)
+            print("     %-32s %10.2f" % ("(dset file) " + os.path.basename(dset_file), dset_size / MB))
+        current, peak = process_memory()
+        print("     Process RSS: %.1fMB, peak: %.1fMB" % (current / MB, peak / MB))
+        telemetry.event("data_memory", total=total, dset=dset_size, rss=current, peak_rss=peak,
+                        fields=OrderedDict((name, size) for size, name, _ in fields))
+
+    def summary(self, title, **fields):
+        """
+            print batch memory and peak RSS since the previous summary, log a "memory" event and start again
+        """
+        if not self.enabled:
+            return
+        current, peak = process_memory()
+        cuda_peak = None
+        if self.gpu:
+            import torch
+            cuda_peak = torch.cuda.max_memory_allocated()
+            if hasattr(torch.cuda, "reset_max_memory_allocated"):
+                torch.cuda.reset_max_memory_allocated()
+        largest = sorted(self.largest, reverse=True)
+        print("Memory (%s): RSS: %.1fMB, peak RSS: %.1fMB%s" % (
+            title, current / MB, peak / MB, "" if self.peak_resettable else " (since start)"))
+        if cuda_peak is not None:
+            print("     Peak cuda allocated: %.1fMB" % (cuda_peak / MB))
+        if self.batch_num > 0:
+            print("     Batches: %s, mean: %.2fMB, peak: %.2fMB" % (
+                self.batch_num, self.batch_total / MB / self.batch_num, largest[0][0] / MB))
+            print("     Largest batches (batch x seq_len x word_len x trans_len):")
+            for total, batch_id, shape, parts in largest:
+                print("         #%-8s %-22s %8.2fMB  %s" % (batch_id, "x".join(str(dim) for dim in shape), total / MB,
+                                                           ", ".join("%s: %.2f" % (name, size / MB)
+                                                                     for name, size in parts.items())))
+        telemetry.event("memory", title=title, rss=current, peak_rss=peak, cuda_peak=cuda_peak,
+                        batches=self.batch_num, mean_batch=self.batch_total / max(self.batch_num, 1),
+                        largest=[OrderedDict([("batch", batch_id), ("shape", shape), ("bytes", total),
+                                              ("parts", parts)]) for total, batch_id, shape, parts in largest],
+                        **fields)
+        self.batch_num = 0
+        self.batch_total = 0
+        self.largest = []
+        if self.peak_resettable:
+            reset_peak()
+
+
+memory = MemoryTracker()
@@ -6,53 +6,177 @@ import sys
 import os
 
 
+## label kinds of the span tables
+OTHER = 0
+BEGIN = 1
+INSIDE = 2
+END = 3
+SINGLE = 4
+
+
+class NERMetric(object):
+    """
+        streaming accuracy and span P/R/F over tag id sequences, with the same results as get_ner_fmeasure.
+        every tag id is mapped once to (kind, entity type id) following get_ner_BMES/get_ner_BIO: labels are
+        matched upper-cased by "B-", then "S-"/"E-" (BMES) or "I-" (BIO), a span still open at the end of a
+        sentence has no end (-1) like a single word span. only counts are kept, no corpus level lists.
+    """
+
+    def __init__(self, labels=None, label_type="BMES"):
+        self.label_type = label_type
+        self.label_index = {}
+        self.type_index = {"": 0}  ## type id 0: empty entity type, does not open a span
+        self.canonical = []
+        self.kinds = []
+        self.types = []
+        self.canonical_table = np.zeros(0, dtype=np.int64)
+        self.kind_table = np.zeros(0, dtype=np.int64)
+        self.type_table = np.zeros(0, dtype=np.int64)
+        for label in labels or []:
+            self.add_label(label)
+        self.right_tag = 0
+        self.all_tag = 0
+        self.right_num = 0
+        self.golden_num = 0
+        self.predict_num = 0
+
+    def add_label(self, label):
+        """
+            append label as the next tag id, equal labels share the same canonical id for accuracy
+        """
+        tag_id = len(self.canonical)
+        self.canonical.append(self.label_index.setdefault(label, tag_id))
+        kind = OTHER
+        entity = ""
+        if label is not None:
+            current_label = label.upper()
+            if "B-" in current_label:
+                kind, entity = BEGIN, current_label.replace("B-", "", 1)
+            elif self.label_type == "BMES" and "S-" in current_label:
+                kind, entity = SINGLE, current_label.replace("S-", "", 1)
+            elif self.label_type == "BMES" and "E-" in current_label:
+                kind, entity = END, current_label.replace("E-", "", 1)
+            elif self.label_type != "BMES" and "I-" in current_label:
+                kind, entity = INSIDE, current_label.replace("I-", "", 1)
+        self.kinds.append(kind)
+        self.types.append(self.type_index.setdefault(entity, len(self.type_index)))
+        self.canonical_table = np.array(self.canonical, dtype=np.int64)
+        self.kind_table = np.array(self.kinds, dtype=np.int64)
+        self.type_table = np.array(self.types, dtype=np.int64)
+        return tag_id
+
+    def label_ids(self, label_list):
+        return [self.label_index[label] if label in self.label_index else self.add_label(label)
+                for label in label_list]
+
+    def get_spans(self, tag_ids):
+        """
+            input: tag ids of one sentence (numpy array)
+            output: list of spans (start, end, type id), end is -1 for single word spans and unfinished spans
+        """
+        kinds = self.kind_table[tag_ids]
+        types = self.type_table[tag_ids]
+        if self.label_type == "BMES":
+            ## M-/O labels never change the open span
+            positions = np.nonzero(kinds)[0]
+        else:
+            ## I- continuing a span of the same type, and O after a non span label, change nothing
+            prev_kinds = np.concatenate(([OTHER], kinds[:-1]))
+            prev_types = np.concatenate(([0], types[:-1]))
+            continued = ((kinds == INSIDE) & (types == prev_types) & (prev_kinds != OTHER)) | (
+                (kinds == OTHER) & (prev_kinds == OTHER))
+            positions = np.nonzero(~continued)[0]
+        spans = []
+        start = -1
+        entity = 0
+        for idx, kind, current_entity in zip(positions.tolist(), kinds[positions].tolist(),
+                                             types[positions].tolist()):
+            if kind == BEGIN:
+                if start >= 0:
+                    spans.append((start, idx - 1, entity))
+                if current_entity:
+                    start, entity = idx, current_entity
+                else:
+                    start = -1
+            elif kind == SINGLE:
+                if start >= 0:
+                    spans.append((start, idx - 1, entity))
+                spans.append((idx, -1, current_entity))
+                start = -1
+            elif kind == END:
+                if start >= 0:
+                    spans.append((start, idx, entity))
+                start = -1
+            elif kind == INSIDE:
+                if start >= 0 and current_entity != entity:
+                    spans.append((start, idx - 1, entity))
+                    start = -1
+            elif start >= 0:
+                spans.append((start, idx - 1, entity))
+                start = -1
+        if start >= 0:
+            spans.append((start, -1, entity))
+        return spans
+
+    def update(self, golden_ids, predict_ids):
+        """
+            add one sentence of gold and predicted tag ids
+        """
+        golden_ids = np.asarray(golden_ids, dtype=np.int64)
+        predict_ids = np.asarray(predict_ids, dtype=np.int64)
+        self.right_tag += int((self.canonical_table[golden_ids] == self.canonical_table[predict_ids]).sum())
+        self.all_tag += len(golden_ids)
+        gold_spans = self.get_spans(golden_ids)
+        pred_spans = self.get_spans(predict_ids)
+        self.golden_num += len(gold_spans)
+        self.predict_num += len(pred_spans)
+        self.right_num += len(set(gold_spans).intersection(set(pred_spans)))
+
+    def update_batch(self, golden_ids, predict_ids, lengths):
+        """
+            add a padded batch, golden_ids/predict_ids: (batch_size, max_len) numpy arrays, lengths: (batch_size)
+        """
+        for idx in range(len(lengths)):
+            self.update(golden_ids[idx, :lengths[idx]], predict_ids[idx, :lengths[idx]])
+
+    def update_labels(self, golden_list, predict_list):
+        """
+            add one sentence of label strings
+        """
+        self.update(self.label_ids(golden_list), self.label_ids(predict_list))
+
+    def result(self):
+        if self.predict_num == 0:
+            precision = -1
+        else:
+            precision = (self.right_num + 0.0) / self.predict_num
+        if self.golden_num == 0:
+            recall = -1
+        else:
+            recall = (self.right_num + 0.0) / self.golden_num
+        if (precision == -1) or (recall == -1) or (precision + recall) <= 0.:
+            f_measure = -1
+        else:
+            f_measure = 2 * precision * recall / (precision + recall)
+        accuracy = (self.right_tag + 0.0) / self.all_tag
+        print "gold_num = ", self.golden_num, " pred_num = ", self.predict_num, " right_num = ", self.right_num
+        return accuracy, precision, recall, f_measure
+
+
+def metric_from_alphabet(label_alphabet, label_type="BMES", extra_num=2):
+    """
+        metric over the tag ids of label_alphabet, id 0 is padding. the extra ids (CRF START/STOP) map to the
+        first label like Alphabet.get_instance does for unknown ids.
+    """
+    return NERMetric([None] + label_alphabet.instances + label_alphabet.instances[:1] * extra_num, label_type)
+
+
 ## input as sentence level labels
 def get_ner_fmeasure(golden_lists, predict_lists, label_type="BMES"):
-    sent_num = len(golden_lists)
-    golden_full = []
-    predict_full = []
-    right_full = []
-    right_tag = 0
-    all_tag = 0
-    for idx in range(0, sent_num):
-        # word_list = sentence_lists[idx]
-        golden_list = golden_lists[idx]
-        predict_list = predict_lists[idx]
-        for idy in range(len(golden_list)):
-            if golden_list[idy] == predict_list[idy]:
-                right_tag += 1
-        all_tag += len(golden_list)
-        if label_type == "BMES":
-            gold_matrix = get_ner_BMES(golden_list)
-            pred_matrix = get_ner_BMES(predict_list)
-        else:
-            gold_matrix = get_ner_BIO(golden_list)
-            pred_matrix = get_ner_BIO(predict_list)
-        # print "gold", gold_matrix
-        # print "pred", pred_matrix
-        right_ner = list(set(gold_matrix).intersection(set(pred_matrix)))
-        golden_full += gold_matrix
-        predict_full += pred_matrix
-        right_full += right_ner
-    right_num = len(right_full)
-    golden_num = len(golden_full)
-    predict_num = len(predict_full)
-    if predict_num == 0:
-        precision = -1
-    else:
-        precision = (right_num + 0.0) / predict_num
-    if golden_num == 0:
-        recall = -1
-    else:
-        recall = (right_num + 0.0) / golden_num
-    if (precision == -1) or (recall == -1) or (precision + recall) <= 0.:
-        f_measure = -1
-    else:
-        f_measure = 2 * precision * recall / (precision + recall)
-    accuracy = (right_tag + 0.0) / all_tag
-    # print "Accuracy: ", right_tag,"/",all_tag,"=",accuracy
-    print "gold_num = ", golden_num, " pred_num = ", predict_num, " right_num = ", right_num
-    return accuracy, precision, recall, f_measure
+    metric = NERMetric(label_type=label_type)
+    for idx in range(len(golden_lists)):
+        metric.update_labels(golden_lists[idx], predict_lists[idx])
+    return metric.result()
 
 
 def reverse_style(input_string):
@@ -203,19 +327,63 @@ def readTwoLabelSentence(input_file, pred_col=-1):
     return sentences, golden_labels, predict_labels
 
 
+def iter_sentences(input_file):
+    """
+        the same sentences as readSentence, read line by line
+    """
+    sentence = []
+    label = []
+    with open(input_file, 'r') as in_file:
+        for line in in_file:
+            if len(line) < 2:
+                yield sentence, label
+                sentence = []
+                label = []
+            else:
+                pair = line.strip('\n').split(' ')
+                sentence.append(pair[0])
+                label.append(pair[-1])
+
+
+def iter_two_label_sentences(input_file, pred_col=-1):
+    """
+        the same sentences as readTwoLabelSentence, read line by line
+    """
+    sentence = []
+    golden_label = []
+    predict_label = []
+    with open(input_file, 'r') as in_file:
+        for line in in_file:
+            if "##score##" in line:
+                continue
+            if len(line) < 2:
+                yield sentence, golden_label, predict_label
+                sentence = []
+                golden_label = []
+                predict_label = []
+            else:
+                pair = line.strip('\n').split(' ')
+                sentence.append(pair[0])
+                golden_label.append(pair[1])
+                predict_label.append(pair[pred_col])
+
+
 def fmeasure_from_file(golden_file, predict_file, label_type="BMES"):
     print "Get f measure from file:", golden_file, predict_file
     print "Label format:", label_type
-    golden_sent, golden_labels = readSentence(golden_file)
-    predict_sent, predict_labels = readSentence(predict_file)
-    P, R, F = get_ner_fmeasure(golden_labels, predict_labels, label_type)
-    print ("P:%sm R:%s, F:%s" % (P, R, F))
+    metric = NERMetric(label_type=label_type)
+    for (_, golden_label), (_, predict_label) in zip(iter_sentences(golden_file), iter_sentences(predict_file)):
+        metric.update_labels(golden_label, predict_label)
+    acc, P, R, F = metric.result()
+    print ("Acc:%s, P:%s, R:%s, F:%s" % (acc, P, R, F))
 
 
 def fmeasure_from_singlefile(twolabel_file, label_type="BMES", pred_col=-1):
-    sent, golden_labels, predict_labels = readTwoLabelSentence(twolabel_file, pred_col)
-    P, R, F = get_ner_fmeasure(golden_labels, predict_labels, label_type)
-    print ("P:%s, R:%s, F:%s" % (P, R, F))
+    metric = NERMetric(label_type=label_type)
+    for _, golden_label, predict_label in iter_two_label_sentences(twolabel_file, pred_col):
+        metric.update_labels(golden_label, predict_label)
+    acc, P, R, F = metric.result()
+    print ("Acc:%s, P:%s, R:%s, F:%s" % (acc, P, R, F))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import torch.nn as nn
+import torch.optim as optim
+
+
+class CombinedOptimizer(object):
+    """
+        several optimizers stepped together, e.g. a dense one for the network and a sparse one for the embedding
+        tables. param_groups is the concatenation of their groups, so lr_decay works unchanged.
+    """
+
+    def __init__(self, optimizers):
+        self.optimizers = optimizers
+
+    @property
+    def param_groups(self):
+        return [group for optimizer in self.optimizers for group in optimizer.param_groups]
+
+    def step(self):
+        for optimizer in self.optimizers:
+            optimizer.step()
+
+    def zero_grad(self):
+        for optimizer in self.optimizers:
+            optimizer.zero_grad()
+
+    def state_dict(self):
+        return {"optimizers": [optimizer.state_dict() for optimizer in self.optimizers]}
+
+    def load_state_dict(self, state_dict):
+        for optimizer, state in zip(self.optimizers, state_dict["optimizers"]):
+            optimizer.load_state_dict(state)
+
+
+def split_sparse_parameters(model):
+    """
+        output: (dense parameters, weights of the nn.Embedding modules with sparse gradients), frozen parameters
+        (requires_grad=False) are left out of both, so no optimizer state is kept for them
+    """
+    sparse_ids = set()
+    sparse_params = []
+    for module in model.modules():
+        if isinstance(module, nn.Embedding) and module.sparse and module.weight.requires_grad:
+            sparse_ids.add(id(module.weight))
+            sparse_params.append(module.weight)
+    dense_params = [param for param in model.parameters() if param.requires_grad and id(param) not in sparse_ids]
+    return dense_params, sparse_params
+
+
+def densify_embeddings(model):
+    for module in model.modules():
+        if isinstance(module, nn.Embedding):
+            module.sparse = False
+
+
+def build_sparse_optimizer(name, params, lr):
+    """
+        row-sparse update of the embedding tables: only the rows looked up in the batch are touched.
+        adam: SparseAdam (lazy moments of the seen rows), sgd: plain SGD, adagrad: Adagrad.
+        momentum and weight decay would densify the update and are not applied to these tables.
+        output: None if the optimizer has no sparse version
+    """
+    if name == "adam":
+        if not hasattr(optim, "SparseAdam"):
+            return None
+        return optim.SparseAdam(params, lr=lr)
+    if name == "sgd":
+        return optim.SGD(params, lr=lr)
+    if name == "adagrad":
+        return optim.Adagrad(params, lr=lr)
+    return None
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+from collections import OrderedDict
+from utils.telemetry import telemetry
+
+TENSORS = ["word", "char", "trans"]
+BINS = 10
+
+
+class PaddingStats(object):
+    """
+        real vs padded cells of one phase (train/dev/test/raw): totals and an efficiency histogram per tensor
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.real = dict((name, 0) for name in TENSORS)
+        self.cells = dict((name, 0) for name in TENSORS)
+        self.histogram = dict((name, [0] * BINS) for name in TENSORS)
+
+    def add(self, counts):
+        self.batches += 1
+        for name in TENSORS:
+            real, cells = counts[name]
+            self.real[name] += real
+            self.cells[name] += cells
+            self.histogram[name][min(BINS - 1, int(BINS * real / max(cells, 1)))] += 1
+
+
+class PaddingTracker(object):
+    """
+        padding efficiency (real cells / tensor cells) of the batchified tensors:
+            word: (batch, max_seq_len), real cells are the sentence lengths.
+            char: (word_num, max_word_len), real cells are the char lengths.
+            trans: (word_num, max_trans_len), real cells are the translation lengths.
+        char and trans rows exist only for the real words, their padding comes from the longest word/translation
+        list of the batch. counted per phase until summary(), which also lists the worst batches (lowest
+        char+trans+word efficiency). disabled (the default) update() returns immediately.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.top = 5
+        self.phases = OrderedDict()
+        self.worst = []  ## heap of (padded share, batch number, phase, shape, counts)
+        self.batch_count = 0
+
+    def configure(self, data):
+        self.enabled = data.padding_report
+        self.top = data.padding_worst_batches
+
+    def update(self, phase, word_inputs, word_seq_lengths, char_inputs, char_seq_lengths, trans_inputs,
+               trans_seq_lengths):
+        if not self.enabled:
+            return
+        batch_size = word_inputs.size(0)
+        counts = {"word": (int(word_seq_lengths.sum()), batch_size * word_inputs.size(1)),
+                  "char": (int(char_seq_lengths.sum()), char_inputs.size(0) * char_inputs.size(1)),
+                  "trans": (int(trans_seq_lengths.sum()), trans_inputs.size(0) * trans_inputs.size(1))}
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = PaddingStats()
+            self.phases[phase] = stats
+        stats.add(counts)
+        self.batch_count += 1
+        real = sum(counts[name][0] for name in TENSORS)
+        cells = sum(counts[name][1] for name in TENSORS)
+        shape = (batch_size, word_inputs.size(1), char_inputs.size(1), trans_inputs.size(1))
+        record = (1. - float(real) / max(cells, 1), self.batch_count, phase, shape, counts)
+        if len(self.worst) < self.top:
+            heapq.heappush(self.worst, record)
+        elif self.top > 0 and record[0] > self.worst[0][0]:
+            heapq.heapreplace(self.worst, record)
+
+    def summary(self, title, **fields):
+        """
+            print the efficiency per phase and tensor, the efficiency histogram and the worst batches,
+            log a "padding" event and start a new accumulation
+        """
+        if not self.enabled or not self.phases:
+            return
+        print("Padding (%s):" % (title))
+        print("     %-6s %-6s %8s %12s %12s %7s %8s" % ("phase", "tensor", "batches", "real", "cells", "eff",
+                                                       "blow-up"))
+        phases = OrderedDict()
+        for phase, stats in self.phases.items():
+            tensors = OrderedDict()
+            for name in TENSORS:
+                real, cells = stats.real[name], stats.cells[name]
+                print("     %-6s %-6s %8s %12s %12s %6.1f%% %7.2fx" % (phase, name, stats.batches, real, cells,
+                                                                      100. * real / max(cells, 1),
+                                                                      float(cells) / max(real, 1)))
+                tensors[name] = OrderedDict([("real", real), ("cells", cells), ("histogram", stats.histogram[name])])
+            phases[phase] = OrderedDict([("batches", stats.batches), ("tensors", tensors)])
+            print("     %-6s efficiency histogram, word/char/trans batches: %s" % (phase, " ".join(
+                "%s-%s%%: %s/%s/%s" % (100 // BINS * idx, 100 // BINS * (idx + 1), stats.histogram["word"][idx],
+                                       stats.histogram["char"][idx], stats.histogram["trans"][idx])
+                for idx in range(BINS) if stats.histogram["word"][idx] or stats.histogram["char"][idx] or
+                stats.histogram["trans"][idx])))
+        worst = sorted(self.worst, reverse=True)
+        if worst:
+            print("     Worst batches (batch x seq_len x word_len x trans_len), word/char/trans efficiency:")
+            for padded, batch_id, phase, shape, counts in worst:
+                print("         #%-8s %-6s %-22s %s" % (batch_id, phase, "x".join(str(dim) for dim in shape),
+                                                       "/".join("%.1f%%" % (100. * counts[name][0] /
+                                                                            max(counts[name][1], 1))
+                                                                for name in TENSORS)))
+        telemetry.event("padding", title=title, phases=phases,
+                        worst=[OrderedDict([("batch", batch_id), ("phase", phase), ("shape", shape),
+                                            ("counts", counts)]) for _, batch_id, phase, shape, counts in worst],
+                        **fields)
+        self.phases = OrderedDict()
+        self.worst = []
+
+
+padding = PaddingTracker()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import multiprocessing
+from cStringIO import StringIO
+from functions import digit_table, normalize_word, parse_instances
+
+## the Data object of the parent, inherited by the forked pool workers instead of being pickled per shard
+_preprocess_data = None
+
+
+def shard_file(input_file, shards):
+    """
+        split input_file into at most `shards` contiguous byte ranges of similar size. every range but the last ends
+        right after a sentence boundary (a line of at most 2 chars, as in read_instance), so each range holds whole
+        sentences and reading the ranges one after another gives the sentences of the whole file.
+        output: list of (input_file, start, end)
+    """
+    size = os.path.getsize(input_file)
+    offsets = [0]
+    with open(input_file, 'rb') as fin:
+        for shard_id in range(1, shards):
+            target = max(offsets[-1], size * shard_id // shards)
+            if target > 0:
+                ## finish the line the target falls into
+                fin.seek(target - 1)
+                if fin.read(1) != '\n':
+                    fin.readline()
+            else:
+                fin.seek(0)
+            while True:
+                line = fin.readline()
+                if len(line) <= 2:
+                    break
+            position = fin.tell()
+            if position >= size:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+    offsets.append(size)
+    return [(input_file, offsets[idx], offsets[idx + 1]) for idx in range(len(offsets) - 1)]
+
+
+def read_lines(input_file, start, end):
+    with open(input_file, 'rb') as fin:
+        fin.seek(start)
+        return StringIO(fin.read(end - start)).readlines()
+
+
+def first_occurrences():
+    """
+        output: (ordered list, add function), add appends items not seen before
+    """
+    seen = set()
+    ordered = []
+
+    def add(item):
+        if item not in seen:
+            seen.add(item)
+            ordered.append(item)
+    return ordered, add
+
+
+def count_shard(shard):
+    """
+        output: labels, words, chars and the values of every feature of one shard, each in the order of first
+        occurrence in the shard
+    """
+    data = _preprocess_data
+    labels, add_label = first_occurrences()
+    words, add_word = first_occurrences()
+    chars, add_char = first_occurrences()
+    features = [first_occurrences() for _ in range(data.feature_num)]
+    for line in read_lines(*shard):
+        if len(line) > 2:
+            pairs = line.strip().split()
+            word = pairs[0].decode('utf-8')
+            if data.number_normalized:
+                word = normalize_word(word)
+            add_label(pairs[-1])
+            add_word(word)
+            for idx in range(data.feature_num):
+                features[idx][1](pairs[idx + 1].split(']', 1)[-1])
+            for char in word:
+                add_char(char)
+    return labels, words, chars, [feature for feature, _ in features]
+
+
+def read_shard(shard):
+    data = _preprocess_data
+    return parse_instances(read_lines(*shard), data.word_alphabet, data.char_alphabet, data.feature_alphabets,
+                           data.label_alphabet, data.number_normalized, data.sentence_length_limit(),
+                           data.translation_id_format, max_word_length=data.MAX_WORD_LENGTH)
+
+
+def map_shards(data, function, input_file):
+    global _preprocess_data
+    shards = shard_file(input_file, data.preprocess_workers)
+    _preprocess_data = data
+    if data.number_normalized:
+        ## build the table once here rather than in every worker
+        digit_table()
+    try:
+        pool = multiprocessing.Pool(min(len(shards), data.preprocess_workers))
+        try:
+            results = pool.map(function, shards)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _preprocess_data = None
+    return results
+
+
+def parallel_build_alphabet(data, input_file):
+    """
+        count the vocabularies of the shards of input_file in data.preprocess_workers processes and add them to the
+        alphabets of data shard by shard. the first occurrence of an item in the file is its first occurrence in the
+        earliest shard containing it, so the ids are the same as those of the sequential Data.build_alphabet.
+    """
+    start_time = time.time()
+    results = map_shards(data, count_shard, input_file)
+    for labels, words, chars, features in results:
+        for label in labels:
+            data.label_alphabet.add(label)
+        for word in words:
+            data.word_alphabet.add(word)
+        for idx in range(data.feature_num):
+            for feature in features[idx]:
+                data.feature_alphabets[idx].add(feature)
+        for char in chars:
+            data.char_alphabet.add(char)
+    print("     Counted %s shards of %s in %.2fs" % (len(results), input_file, time.time() - start_time))
+
+
+def parallel_read_instance(data, input_file):
+    """
+        read_instance of input_file in data.preprocess_workers processes. the alphabets must be closed: the
+        workers only look ids up, so the output is the same as the sequential read_instance.
+        output: instance texts, instance ids
+    """
+    start_time = time.time()
+    results = map_shards(data, read_shard, input_file)
+    texts = []
+    Ids = []
+    for shard_texts, shard_Ids in results:
+        texts += shard_texts
+        Ids += shard_Ids
+    print("     Read %s sentences in %s shards of %s in %.2fs" % (len(Ids), len(results), input_file,
+                                                                time.time() - start_time))
+    return texts, Ids
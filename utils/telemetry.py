@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import json
+import cProfile
+import pstats
+from collections import OrderedDict
+
+
+class NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Stage(object):
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+        self.start = 0.
+
+    def __enter__(self):
+        if self.telemetry.sync is not None:
+            self.telemetry.sync()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.telemetry.sync is not None:
+            self.telemetry.sync()
+        self.telemetry.add(self.name, time.time() - self.start)
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Telemetry(object):
+    """
+        wall time per stage, JSONL event log and an optional profiler window.
+        stages may be nested ("word_rep" contains "word_rep.char"), the times are inclusive. with gpu the cuda
+        queue is synchronized around every stage, which slows training a little but gives the real stage time.
+        the profiler window counts the batches of training, evaluation and decoding in run order.
+        disabled (the default) every stage is a shared no-op context.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sync = None
+        self.stages = OrderedDict()
+        self.log_file = None
+        self.profile = None  ## None/"torch"/"cprofile"
+        self.profile_start = 10
+        self.profile_batches = 20
+        self.profile_output = "profile"
+        self.profiler = None
+        self.batch_count = 0
+
+    def configure(self, data):
+        self.enabled = data.telemetry
+        self.sync = None
+        if data.HP_gpu and self.enabled:
+            import torch
+            self.sync = torch.cuda.synchronize
+        if data.telemetry_log:
+            self.log_file = open(data.telemetry_log, 'a')
+        self.profile = data.profile
+        self.profile_start = data.profile_start
+        self.profile_batches = data.profile_batches
+        self.profile_output = data.profile_output
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def add(self, name, seconds):
+        if not self.enabled:
+            return
+        record = self.stages.get(name)
+        if record is None:
+            record = [0., 0]
+            self.stages[name] = record
+        record[0] += seconds
+        record[1] += 1
+
+    def event(self, event, **fields):
+        """
+            append one JSON line {"event": event, "time": ..., "pid": ..., fields...} to the telemetry log
+        """
+        if self.log_file is None:
+            return
+        record = OrderedDict([("event", event), ("time", time.time()), ("pid", os.getpid())])
+        for key in sorted(fields):
+            record[key] = fields[key]
+        self.log_file.write(json.dumps(record) + "\n")
+        self.log_file.flush()
+
+    def summary(self, title, wall_time=None, **fields):
+        """
+            print the accumulated stage times, log them as a "stages" event and start a new accumulation
+        """
+        if not self.enabled:
+            return
+        print("Stage times (%s):" % (title))
+        print("     %-24s %10s %8s %10s %7s" % ("stage", "time(s)", "calls", "ms/call", "share"))
+        for name, (seconds, count) in self.stages.items():
+            share = "%6.1f%%" % (100. * seconds / wall_time) if wall_time else "-"
+            print("     %-24s %10.3f %8d %10.3f %7s" % (name, seconds, count, 1000. * seconds / count, share))
+        stages = OrderedDict((name, {"seconds": seconds, "count": count})
+                             for name, (seconds, count) in self.stages.items())
+        self.event("stages", title=title, wall_time=wall_time, stages=stages, **fields)
+        self.stages = OrderedDict()
+
+    def batch_begin(self):
+        if self.profile and self.profiler is None and self.batch_count == self.profile_start:
+            print("Start %s profiler at batch %s for %s batches" % (self.profile, self.batch_count,
+                                                                   self.profile_batches))
+            if self.profile == "torch":
+                import torch
+                self.profiler = torch.autograd.profiler.profile()
+                self.profiler.__enter__()
+            else:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+
+    def batch_end(self):
+        self.batch_count += 1
+        if self.profiler is not None and self.batch_count == self.profile_start + self.profile_batches:
+            self.stop_profiler()
+
+    def stop_profiler(self):
+        if self.profiler is None:
+            return
+        if self.profile == "torch":
+            self.profiler.__exit__(None, None, None)
+            table = self.profiler.key_averages().table(sort_by="cpu_time_total")
+            self.profiler.export_chrome_trace(self.profile_output + ".trace.json")
+            print("Chrome trace has been written into file. %s" % (self.profile_output + ".trace.json"))
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_output + ".prof")
+            stream = open(self.profile_output + ".txt", 'w')
+            pstats.Stats(self.profiler, stream=stream).sort_stats("cumulative").print_stats(40)
+            stream.close()
+            table = None
+        if table is not None:
+            with open(self.profile_output + ".txt", 'w') as fout:
+                fout.write(table)
+        print("Profile of batches %s-%s has been written into file. %s" % (
+            self.profile_start, self.batch_count - 1, self.profile_output + ".txt"))
+        self.event("profile", mode=self.profile, start=self.profile_start, end=self.batch_count,
+                   output=self.profile_output)
+        self.profiler = None
+        self.profile = None
+
+
+telemetry = Telemetry()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+
+def split_windows(instances, window_size, context):
+    """
+        split the instances longer than window_size words into windows of window_size words (the last one may be
+        shorter), consecutive windows overlap by 2 * context words. every word is predicted by exactly one window,
+        the one where it is at least context words away from a window border (the first/last context words of a
+        sentence by its first/last window), so each prediction sees context words on both sides.
+        output: windows, spans: (sentence index, keep start, keep end) of every window, relative to the window.
+                spans is None and windows is instances if no instance is longer than window_size
+    """
+    if all(len(instance[0]) <= window_size for instance in instances):
+        return instances, None
+    context = max(0, min(context, (window_size - 1) // 2))
+    step = window_size - 2 * context
+    windows = []
+    spans = []
+    for sent_id, instance in enumerate(instances):
+        length = len(instance[0])
+        if length <= window_size:
+            windows.append(instance)
+            spans.append((sent_id, 0, length))
+            continue
+        start = 0
+        while True:
+            end = min(start + window_size, length)
+            windows.append([field[start:end] for field in instance])
+            keep_start = 0 if start == 0 else context
+            keep_end = end - start if end == length else window_size - context
+            spans.append((sent_id, keep_start, keep_end))
+            if end == length:
+                break
+            start += step
+    return windows, spans
+
+
+def stitch_windows(window_results, spans, nbest=False):
+    """
+        join the kept parts of the window predictions back into sentences
+        window_results: per window a label list, or with nbest a list of nbest label lists
+        output: per sentence a label list, or with nbest a list of nbest label lists (the k-th best of every window)
+    """
+    results = []
+    for result, (sent_id, keep_start, keep_end) in zip(window_results, spans):
+        if sent_id == len(results):
+            results.append([[] for _ in result] if nbest else [])
+        if nbest:
+            for path, window_path in zip(results[sent_id], result):
+                path.extend(window_path[keep_start:keep_end])
+        else:
+            results[sent_id].extend(result[keep_start:keep_end])
+    return results
+
+
+def sum_scores(window_scores, spans):
+    """
+        1-best log space scores of the sentences: sum of the scores of their windows
+    """
+    scores = []
+    for window_score, (sent_id, _, _) in zip(window_scores, spans):
+        if sent_id == len(scores):
+            scores.append(window_score)
+        else:
+            scores[sent_id] += window_score
+    return scores
+
+
+def stitch_scores(window_scores, spans):
+    """
+        nbest scores of the sentences: product of the path probabilities of their windows
+    """
+    scores = []
+    for window_score, (sent_id, _, _) in zip(window_scores, spans):
+        if sent_id == len(scores):
+            scores.append(list(window_score))
+        else:
+            scores[sent_id] = [score * path_score for score, path_score in zip(scores[sent_id], window_score)]
+    return scores